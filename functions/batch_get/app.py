@@ -0,0 +1,177 @@
+import json, os
+from typing import Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+import common_funcs as cf
+
+
+BUCKET = os.environ['BUCKET']
+BATCH_GET_MAX_ITEMS = int(os.environ.get('BATCH_GET_MAX_ITEMS', 25))
+BATCH_GET_WORKERS = int(os.environ.get('BATCH_GET_WORKERS', 8))
+# Max size of the whole response, the files that don't fit are returned as presigned urls
+BATCH_GET_MAX_RESPONSE_SIZE = int(os.environ.get('BATCH_GET_MAX_RESPONSE_SIZE', cf.MAX_INLINE_RESPONSE_SIZE))
+# Size of the fields of an item besides its file (filename, version_id, status...)
+ITEM_OVERHEAD_SIZE = 512
+
+
+def get_item_result(filename: str, version_id: Optional[str], status: str, **fields) -> str:
+    return json.dumps({'filename': filename, 'version_id': version_id, 'status': status, **fields})
+
+def get_presigned_url_result(filename: str, version_id: str, s3_key: str) -> str:
+    return get_item_result(filename, version_id, 'presigned_url', presigned_url=cf.get_presigned_get_url(s3_key))
+
+def plan_items(contract_number: str, items: List[Dict]) -> List[Dict]:
+    """
+    Resolves the version of every item from the manifest of the contract (a single GET) and
+    decides which files are returned inline: the smallest ones first, while the response has room.
+    Sizes are estimated like _get does (cf.get_inline_response_size) from the format of the version
+    in the manifest, so both endpoints return the same files inline. Versions missing in the manifest,
+    or whose format it doesn't have yet, are checked once they are downloaded.
+    """
+    manifest = cf.get_manifest(contract_number, cached=True)
+    plans = []
+    for item in items:
+        filename = item['filename'].split('.')[0]
+        file_entry = manifest['files'].get(filename, {})
+        version_id = item.get('version_id') or file_entry.get('latest')
+        plan = {'filename': filename, 'version_id': version_id, 'action': 'inline', 'estimated_size': 0}
+        version = file_entry.get('versions', {}).get(version_id)
+        if not version_id:
+            plan['action'] = 'not_found'
+        elif version:
+            if version['storage_class'] == 'GLACIER':
+                plan['action'] = 'archived'
+            # Without a format the size is the one of the stored object, which is never bigger than the response
+            plan['estimated_size'] = cf.get_inline_response_size(
+                version['size'], {'encoded_content_type': version.get('format')}
+            )
+        plan['s3_key'] = f'{contract_number}/{filename}/{version_id}.txt'
+        plans.append(plan)
+
+    response_size = 0
+    for plan in sorted(plans, key=lambda plan: plan['estimated_size']):
+        if plan['action'] != 'inline':
+            continue
+        response_size += ITEM_OVERHEAD_SIZE + plan['estimated_size']
+        if plan['estimated_size'] >= cf.MAX_INLINE_RESPONSE_SIZE or response_size > BATCH_GET_MAX_RESPONSE_SIZE:
+            plan['action'] = 'presigned_url'
+            response_size -= plan['estimated_size']
+    return plans
+
+def fetch_item(plan: Dict) -> str:
+    """
+    Returns the result of an item (json): the file itself, a presigned url or an error.
+    """
+    filename, version_id, s3_key = plan['filename'], plan['version_id'], plan['s3_key']
+    if plan['action'] == 'not_found':
+        return get_item_result(filename, version_id, 'not_found', error='File not found.')
+    if plan['action'] == 'archived':
+        return get_item_result(filename, version_id, 'archived', error='File is in Glacier Storage, you must restore it first.')
+    if plan['action'] == 'presigned_url':
+        return get_presigned_url_result(filename, version_id, s3_key)
+
+    try:
+        response = cf.get_client('s3').get_object(Bucket=BUCKET, Key=s3_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+            return get_item_result(filename, version_id, 'not_found', error='File not found.')
+        if e.response['Error']['Code'] == 'InvalidObjectState':
+            return get_item_result(filename, version_id, 'archived', error='File is in Glacier Storage, you must restore it first.')
+        raise
+    inline_size = cf.get_inline_response_size(response['ContentLength'], cf.get_object_metadata(response))
+    if inline_size >= cf.MAX_INLINE_RESPONSE_SIZE:
+        response['Body'].close()
+        return get_presigned_url_result(filename, version_id, s3_key)
+
+    # The body of _get ({"content_type", "filename", "file"}) is extended without parsing the file again
+    file_body = cf.get_response_body_from_s3_response(response)
+    return f'{file_body[:-1]}, "version_id": {json.dumps(version_id)}, "status": "inline"}}'
+
+def fetch_items(plans: List[Dict]) -> List[str]:
+    """
+    Fetches the items concurrently and returns their results in the order of the request.
+    """
+    def fetch_indexed_item(indexed_plan: Tuple[int, Dict]) -> Tuple[int, str]:
+        index, plan = indexed_plan
+        return index, fetch_item(plan)
+
+    results = [None] * len(plans)
+    for index, result in cf.run_concurrently(fetch_indexed_item, enumerate(plans), BATCH_GET_WORKERS):
+        results[index] = result
+
+    # Spill the biggest inline files to presigned urls while the response is too big
+    # (only the versions that weren't in the manifest can exceed the estimate)
+    response_size = sum(len(result) for result in results)
+    inline_indexes = sorted(
+        (index for index in range(len(plans)) if results[index].endswith('"status": "inline"}')),
+        key=lambda index: len(results[index]), reverse=True
+    )
+    for index in inline_indexes:
+        if response_size <= BATCH_GET_MAX_RESPONSE_SIZE:
+            break
+        plan = plans[index]
+        presigned_url_result = get_presigned_url_result(plan['filename'], plan['version_id'], plan['s3_key'])
+        response_size += len(presigned_url_result) - len(results[index])
+        results[index] = presigned_url_result
+    return results
+
+def get_items_error(items) -> str:
+    if not isinstance(items, list) or not items:
+        return "'items' parameter must be a non-empty list."
+    if len(items) > BATCH_GET_MAX_ITEMS:
+        return f"'items' parameter can't have more than {BATCH_GET_MAX_ITEMS} items."
+    for item in items:
+        if not isinstance(item, dict) or not item.get('filename'):
+            return "Every item must have a 'filename'."
+    return ''
+
+
+@cf.track_clients_usage
+def lambda_handler(event, context):
+    cf.start_phase('parse')
+    if 'body' not in event:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "A body in the request is required."
+            })
+        }
+
+    body = cf.get_body_dict_from_event(event)
+    if not body:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "The body isn't formatted properly."
+            })
+        }
+
+    missing_parameters = cf.missing_parameters_from_file_dict(body, ['contract_number', 'items'])
+    if missing_parameters:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f'\'{", ".join(missing_parameters)}\' parameter(s) is/are missing.'
+            })
+        }
+    items_error = get_items_error(body['items'])
+    if items_error:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': items_error
+            })
+        }
+
+    cf.start_phase('resolve')
+    plans = plan_items(body['contract_number'], body['items'])
+    cf.start_phase('fetch')
+    results = fetch_items(plans)
+    cf.start_phase('serialize')
+
+    return {
+            'statusCode': 200,
+            'body': '{"items": [' + ', '.join(results) + ']}',
+            'isBase64Encoded': False
+        }
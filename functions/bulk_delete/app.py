@@ -0,0 +1,189 @@
+import json, os
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from botocore.exceptions import ClientError
+
+import common_funcs as cf
+
+BUCKET = os.environ['BUCKET']
+BULK_DELETE_WORKERS = int(os.environ.get('BULK_DELETE_WORKERS', 4))
+# Max keys of a DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+
+def iter_batches(s3_keys: Iterable[str], batch_size: int=DELETE_BATCH_SIZE) -> Iterator[List[str]]:
+    s3_keys = iter(s3_keys)
+    while True:
+        batch = list(islice(s3_keys, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def get_key_result(s3_key: str, status: str, error: str=None) -> Dict:
+    """
+    Returns the result of a key as it's shown to the clients (filename and version_id).
+    """
+    _, filename, _ = s3_key.split('/')
+    result = {'filename': filename, 'version_id': cf.get_version_id_from_key(s3_key), 'status': status}
+    if error:
+        result['error'] = error
+    return result
+
+def delete_batch(s3_keys: List[str]) -> List[Dict]:
+    """
+    Deletes up to 1000 keys with a single request and returns the result of every key.
+    Like _delete, the keys get a delete marker (the versions themselves are kept by the bucket).
+    """
+    try:
+        resp = cf.get_client('s3').delete_objects(
+            Bucket=BUCKET, Delete={'Objects': [{'Key': s3_key} for s3_key in s3_keys], 'Quiet': False}
+        )
+    except ClientError as e:
+        print(e.response['Error'])
+        return [get_key_result(s3_key, 'failed', e.response['Error'].get('Code')) for s3_key in s3_keys]
+
+    errors = {error['Key']: error.get('Code') for error in resp.get('Errors', [])}
+    for s3_key, code in errors.items():
+        print(f'ERROR deleting {s3_key}: {code}')
+    return [
+        get_key_result(s3_key, 'failed', errors[s3_key]) if s3_key in errors else get_key_result(s3_key, 'deleted')
+        for s3_key in s3_keys
+    ]
+
+def resolve_items(contract_number: str, items: List[Dict]) -> Tuple[List[str], List[str]]:
+    """
+    Returns the keys of the (filename, version_id) items that exist and the ones that don't,
+    from the manifest of the contract (no listings).
+    """
+    manifest = cf.get_manifest(contract_number)
+    found_keys, missing_keys = [], []
+    for item in items:
+        filename = item['filename'].split('.')[0]
+        s3_key = f"{contract_number}/{filename}/{item['version_id']}.txt"
+        if item['version_id'] in manifest['files'].get(filename, {}).get('versions', {}):
+            found_keys.append(s3_key)
+        else:
+            missing_keys.append(s3_key)
+    return found_keys, missing_keys
+
+def resolve_filename(contract_number: str, filename: str) -> List[str]:
+    """
+    Returns the keys of all the versions of a file, from the manifest of the contract.
+    """
+    manifest = cf.get_manifest(contract_number)
+    versions = manifest['files'].get(filename, {}).get('versions', {})
+    return [f'{contract_number}/{filename}/{version_id}.txt' for version_id in sorted(versions)]
+
+def iter_contract_keys(contract_number: str) -> Iterator[str]:
+    """
+    Lazily yields the keys of all the versions of a contract, from its paginated listing
+    (every page of 1000 keys becomes a batch as soon as it's listed).
+    """
+    for s3_object in cf.iter_objects_in_contract_number(contract_number):
+        if len(s3_object['Key'].split('/')) == 3:
+            yield s3_object['Key']
+
+def get_items_error(items) -> str:
+    if not isinstance(items, list) or not items:
+        return "'items' parameter must be a non-empty list."
+    for item in items:
+        if not isinstance(item, dict) or not item.get('filename') or not item.get('version_id'):
+            return "Every item must have a 'filename' and a 'version_id'."
+    return ''
+
+
+@cf.track_clients_usage
+def lambda_handler(event, context):
+    if 'body' not in event:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "A body in the request is required."
+            })
+        }
+
+    body = cf.get_body_dict_from_event(event)
+    if not body:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "The body isn't formatted properly."
+            })
+        }
+
+    missing_parameters = cf.missing_parameters_from_file_dict(body, ['contract_number'])
+    if missing_parameters:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f'\'{", ".join(missing_parameters)}\' parameter(s) is/are missing.'
+            })
+        }
+
+    contract_number = body['contract_number']
+    not_found_error = 'File not found.'
+    missing_keys = []
+    if 'items' in body:
+        items_error = get_items_error(body['items'])
+        if items_error:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({
+                    'error': items_error
+                })
+            }
+        s3_keys, missing_keys = resolve_items(contract_number, body['items'])
+    elif body.get('filename'):
+        s3_keys = resolve_filename(contract_number, body['filename'].split('.')[0])
+    elif body.get('all_files') is True:
+        # The whole contract is deleted as it's listed
+        s3_keys = iter_contract_keys(contract_number)
+        not_found_error = 'Contract number not found.'
+    else:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "'items', 'filename' or 'all_files' (true) parameter is required."
+            })
+        }
+
+    results = [get_key_result(s3_key, 'not_found') for s3_key in missing_keys]
+    deleted_keys = []
+    for batch_results in cf.run_concurrently(delete_batch, iter_batches(s3_keys), BULK_DELETE_WORKERS):
+        results.extend(batch_results)
+    for result in results:
+        if result['status'] == 'deleted':
+            deleted_keys.append(f"{contract_number}/{result['filename']}/{result['version_id']}.txt")
+    if deleted_keys:
+        cf.remove_keys_from_manifest(contract_number, deleted_keys)
+
+    summary = {status: sum(1 for result in results if result['status'] == status) for status in ['deleted', 'not_found', 'failed']}
+    print(json.dumps({'bulk_delete': {'contract_number': contract_number, **summary}}))
+    if summary['failed']:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'error': 'Internal Server Error',
+                **summary,
+                'results': results
+            })
+        }
+    if not summary['deleted']:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({
+                'error': not_found_error,
+                **summary,
+                'results': results
+            })
+        }
+
+    return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Files deleted.',
+                **summary,
+                'results': results
+            })
+        }
@@ -1,7 +1,5 @@
 import json, logging, os
 
-import boto3
-
 import common_funcs as cf
 
 BUCKET = os.environ['BUCKET']
@@ -9,6 +7,7 @@ logger = logging.getLogger()
 logger.setLevel(logging.WARNING)
 
 
+@cf.track_clients_usage
 def lambda_handler(event, context):
     if 'body' not in event or event['body'] == '':
         return {
@@ -52,7 +51,11 @@ def lambda_handler(event, context):
     contract_number = file_dict['contract_number']
     root_folder_s3 = f"{contract_number}/{filename_no_extension}"
     
-    if cf.folder_exists_and_not_empty(root_folder_s3):
+    # The manifest tells if the file exists without a listing. The file is stored before it's added
+    # to the manifest: if another request creates it at the same time, the conditional write of the
+    # manifest accepts only one of them, and the others delete the version they stored.
+    manifest, etag, _ = cf.load_fresh_manifest(contract_number)
+    if filename_no_extension in manifest['files']:
         return {
             'statusCode': 400,
             'body': json.dumps({
@@ -60,11 +63,22 @@ def lambda_handler(event, context):
             })
         }
     
-    
+    stored_document = cf.get_stored_document(file_dict)
     s3_key = cf.get_new_s3_key(root_folder_s3)
-    file_encoded = json.dumps(file_dict)
-    s3 = boto3.resource('s3')
-    s3.Object(BUCKET, s3_key).put(Body=file_encoded, Metadata={"encoded_content_type": 'application/json'})
+    stored_size, digest = cf.put_file(s3_key, file_dict, stored_document, IfNoneMatch='*')
+    file_created = cf.add_new_file_to_manifest(
+        s3_key, stored_size, digest, stored_document.file_format, manifest, etag
+    )
+    if file_created is False:
+        cf.get_client('s3').delete_object(Bucket=BUCKET, Key=s3_key)
+        # A rebuild of the manifest may have listed the version before it was deleted
+        cf.remove_key_from_manifest(s3_key)
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': 'A filename already exists in that contract_number.'
+            })
+        }
     
     
     return {
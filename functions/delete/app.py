@@ -1,6 +1,5 @@
 import json, os
 
-import boto3
 from botocore.exceptions import ClientError
 
 import common_funcs as cf
@@ -8,6 +7,7 @@ import common_funcs as cf
 BUCKET = os.environ['BUCKET']
 
 
+@cf.track_clients_usage
 def lambda_handler(event, context):
     if 'body' not in event:
         return {
@@ -38,15 +38,18 @@ def lambda_handler(event, context):
     version = body.get('version_id')
     contract_number = body['contract_number']
     filename_no_extension = body['filename'].split('.')[0]
-    if not version:
-        # si no existe version = false
-        if cf.folder_exists_and_not_empty(f"{contract_number}/{filename_no_extension}"):
-            version = cf.get_latest_version(contract_number, filename_no_extension)
+    if version:
+        s3_key = f"{contract_number}/{filename_no_extension}/{version}.txt"
+        file_exists = cf.key_exists_in_bucket(s3_key)
+    else:
+        # The listing of the latest version already tells if the file exists.
+        latest_object = cf.get_latest_version_object(contract_number, filename_no_extension)
+        file_exists = bool(latest_object)
+        if latest_object:
+            s3_key = latest_object['Key']
     
-    s3_key = f"{contract_number}/{filename_no_extension}/{version}.txt"
-    
-    s3_client = boto3.client('s3')
-    if not cf.key_exists_in_bucket(s3_key):
+    s3_client = cf.get_client('s3')
+    if not file_exists:
         return {
             'statusCode': 404,
             'body': json.dumps({
@@ -64,6 +67,7 @@ def lambda_handler(event, context):
                 'error': e.response['Error']['Message']
             })
         }
+    cf.remove_key_from_manifest(s3_key)
     
     return {
             'statusCode': 200,
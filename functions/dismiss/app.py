@@ -1,39 +1,148 @@
-import json, logging, os
+import json, logging, os, time
+from typing import Dict, List, Optional, Tuple
 
-import boto3
 from botocore.exceptions import ClientError
 
 import common_funcs as cf
 
 
 BUCKET = os.environ['BUCKET']
+DISMISS_WORKERS = int(os.environ.get('DISMISS_WORKERS', 8))
+# Objects listed and dismissed in every chunk of a job (a chunk must fit in the timeout of the function)
+DISMISS_PAGE_SIZE = int(os.environ.get('DISMISS_PAGE_SIZE', 250))
+# Time the requests wait for the job before answering with its job_id (the rest continues asynchronously)
+DISMISS_RESPONSE_TIME_BUDGET = int(os.environ.get('DISMISS_RESPONSE_TIME_BUDGET', 8000)) # ms
+# Time kept free at the end of an invocation to save the checkpoint and invoke the next one
+DISMISS_TIME_MARGIN = int(os.environ.get('DISMISS_TIME_MARGIN', 2000)) # ms
+ARCHIVED_STORAGE_CLASSES = ['GLACIER', 'GLACIER_IR']
 
 
-def update_object_to_glacier(s3_key, s3_version_id: str):
+def update_object_to_glacier(s3_key: str):
     """
     Update the storage class of an object.
     NOTE: To update the class of an object it needs to be copied and pasted with the same key, so it's
-    necessary to delete the old version.
+    necessary to delete the old version. The copy tells which version it copied, so there is no need
+    of a HEAD request to know it.
     """
-    
-    s3 = boto3.client('s3')
-    copy_source = {
-        'Bucket': BUCKET,
-        'Key': s3_key
-    }
-    
-    s3.copy(
-      copy_source, BUCKET, s3_key,
-      ExtraArgs = {
-        'StorageClass': 'GLACIER_IR',
-        'MetadataDirective': 'COPY'
-      }
+    s3 = cf.get_client('s3')
+    copy_response = s3.copy_object(
+        Bucket=BUCKET, Key=s3_key,
+        CopySource={'Bucket': BUCKET, 'Key': s3_key},
+        StorageClass='GLACIER_IR',
+        MetadataDirective='COPY'
+    )
+
+    # Buckets without versioning replace the object, there is no old version to delete
+    if copy_response.get('CopySourceVersionId'):
+        s3.delete_object(Bucket=BUCKET, Key=s3_key, VersionId=copy_response['CopySourceVersionId'])
+
+def dismiss_object(file: Dict) -> Dict:
+    """
+    Moves an object of the listing to GLACIER_IR and returns the outcome
+    ('dismissed', 'already_dismissed' or 'failed').
+    """
+    if file['StorageClass'] in ARCHIVED_STORAGE_CLASSES:
+        return {'key': file['Key'], 'status': 'already_dismissed'}
+    try:
+        update_object_to_glacier(file['Key'])
+    except ClientError as e:
+        print(f'ERROR en operación PATCH ({file["Key"]}): {e.response["Error"]}')
+        return {'key': file['Key'], 'status': 'failed', 'error': e.response['Error'].get('Code')}
+    return {'key': file['Key'], 'status': 'dismissed'}
+
+def list_chunk(contract_number: str, continuation_token: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Returns one page of the listing of a contract and the token of the next one (None if it's the last one).
+    """
+    list_kwargs = {'ContinuationToken': continuation_token} if continuation_token else {}
+    resp = cf.get_client('s3').list_objects_v2(
+        Bucket=BUCKET, Prefix=f'{contract_number}/', MaxKeys=DISMISS_PAGE_SIZE, **list_kwargs
     )
-    
-    s3.delete_object(Bucket=BUCKET, Key=s3_key, VersionId=s3_version_id)
+    return resp.get('Contents', []), resp.get('NextContinuationToken')
+
+def process_chunk(job: Dict, objects: List[Dict], next_token: Optional[str]):
+    """
+    Dismisses the objects of a chunk concurrently and saves the checkpoint of the job.
+    Chunks are idempotent: if an invocation dies before saving its checkpoint, the next one
+    repeats the chunk and finds its objects already dismissed.
+    """
+    start = time.perf_counter()
+    outcomes = list(cf.run_concurrently(dismiss_object, objects, DISMISS_WORKERS))
+    dismissed_keys = [outcome['key'] for outcome in outcomes if outcome['status'] == 'dismissed']
+    failed_objects = [
+        {'key': outcome['key'], 'error': outcome['error']} for outcome in outcomes if outcome['status'] == 'failed'
+    ]
+    if dismissed_keys:
+        cf.set_storage_class_in_manifest(job['contract_number'], dismissed_keys, 'GLACIER_IR')
 
+    job['chunks'] += 1
+    job['processed'] += len(outcomes)
+    job['dismissed'] += len(dismissed_keys)
+    job['failed'] += len(failed_objects)
+    job['already_dismissed'] += len(outcomes) - len(dismissed_keys) - len(failed_objects)
+    job['failed_objects'] = (job['failed_objects'] + failed_objects)[:cf.JOB_MAX_FAILED_OBJECTS]
+    job['continuation_token'] = next_token
+    if not next_token:
+        job['status'] = 'completed'
+    job['processing_seconds'] += time.perf_counter() - start
+    cf.save_dismiss_job(job)
+
+def run_job(job: Dict, deadline: float, chunks_done: int=0):
+    """
+    Processes chunks of a job while there is time for another one (judging by how long the
+    previous ones took), and hands the rest of the job over to a new invocation.
+    Every invocation processes at least one chunk, so the job always moves on.
+    """
+    chunk_seconds = job['processing_seconds'] / job['chunks'] if job['chunks'] else 0
+    while job['status'] == 'running' and (not chunks_done or time.time() + chunk_seconds * 1.5 < deadline):
+        objects, next_token = list_chunk(job['contract_number'], job['continuation_token'])
+        process_chunk(job, objects, next_token)
+        chunks_done += 1
+        chunk_seconds = job['processing_seconds'] / job['chunks']
+
+    print(json.dumps({'dismiss': cf.get_dismiss_job_status(job)}))
+    if job['status'] == 'running':
+        invoke_next_chunk(job)
+
+def invoke_next_chunk(job: Dict):
+    """
+    Invokes this function asynchronously to continue a job.
+    """
+    cf.get_client('lambda').invoke(
+        FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'], InvocationType='Event',
+        Payload=json.dumps({'dismiss_job_id': job['job_id'], 'chunks': job['chunks']})
+    )
+
+def get_deadline(context, time_budget: Optional[int]=None) -> float:
+    """
+    Returns the time (epoch seconds) when the invocation has to stop processing chunks.
+    """
+    if context is None:
+        # Local runs, without time limit
+        remaining = float('inf')
+    else:
+        remaining = context.get_remaining_time_in_millis() - DISMISS_TIME_MARGIN
+    if time_budget is not None:
+        remaining = min(remaining, time_budget)
+    return time.time() + remaining / 1000
 
+def continue_job(event: Dict, context):
+    """
+    Continues a job in an asynchronous invocation. Repeated deliveries of an invocation
+    (the checkpoint has moved on since it was sent) are ignored.
+    """
+    job = cf.load_dismiss_job(event['dismiss_job_id'])
+    if not job or job['status'] != 'running' or job['chunks'] != event.get('chunks'):
+        print(f'Dismiss job {event["dismiss_job_id"]} is not waiting for this invocation.')
+        return
+    run_job(job, get_deadline(context))
+
+
+@cf.track_clients_usage
 def lambda_handler(event, context):
+    if 'dismiss_job_id' in event:
+        return continue_job(event, context)
+
     if 'body' not in event:
         return {
             'statusCode': 400,
@@ -41,7 +150,7 @@ def lambda_handler(event, context):
                 'error': "A body in the request is required."
             })
         }
-    
+
     body = cf.get_body_dict_from_event(event)
     if not body:
         return {
@@ -57,47 +166,45 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': f'\'{", ".join(missing_parameters)}\' parameter(s) is/are missing.'
             })
-        }    
-    
-    
-    contract_number = body['contract_number']
+        }
 
-    s3_client = boto3.client('s3')
-    response = s3_client.list_objects_v2(
-        Bucket=BUCKET, Prefix=contract_number
-    )
 
-    if 'Contents' not in response:
+    contract_number = body['contract_number']
+    objects, next_token = list_chunk(contract_number, None)
+    if not objects:
         return {
                 'statusCode': 404,
                 'body': json.dumps({
                     'error': 'Contract number not found.'
                 })
             }
-    are_files_on_glacier = []
-    for file in response['Contents']:
-        if file['StorageClass'] in ['GLACIER', 'GLACIER_IR']:
-            are_files_on_glacier.append(True)
-            continue
-        are_files_on_glacier.append(False)
-        metadata_response = cf.key_exists_in_bucket(file['Key'])
-        try:
-            update_object_to_glacier(file['Key'], metadata_response['VersionId'])
-        except ClientError as e:
-            print(f'ERROR en operación PATCH: {e.response["Error"]}')
-            return {
-                'statusCode': 500,
-                'body': json.dumps({'error': 'Internal Server Error'})
-            }
-    
-    if all(are_files_on_glacier):
+
+    # Small contracts are dismissed before answering; bigger ones continue in the background
+    job = cf.new_dismiss_job(contract_number)
+    process_chunk(job, objects, next_token)
+    run_job(job, get_deadline(context, DISMISS_RESPONSE_TIME_BUDGET), chunks_done=1)
+
+    summary = {key: job[key] for key in ['job_id', 'status', 'dismissed', 'already_dismissed', 'failed']}
+    if job['status'] == 'running':
+        return {
+            'statusCode': 202,
+            'body': json.dumps({'message': 'Dismiss job started.', **summary})
+        }
+    if job['failed']:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'error': 'Internal Server Error', **summary, 'failed_objects': job['failed_objects']
+            })
+        }
+    if not job['dismissed']:
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'Files have already been dismissed.'})
-        }    
-        
-    
+        }
+
+
     return {
         'statusCode': 200,
-        'body': json.dumps({'message': 'Files dismissed succesfully.'})
+        'body': json.dumps({'message': 'Files dismissed succesfully.', **summary})
     }
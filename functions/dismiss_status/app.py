@@ -0,0 +1,58 @@
+import json, os
+
+import common_funcs as cf
+
+
+BUCKET = os.environ['BUCKET']
+
+
+@cf.track_clients_usage
+def lambda_handler(event, context):
+    if 'body' not in event:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "A body in the request is required."
+            })
+        }
+
+    body = cf.get_body_dict_from_event(event)
+    if not body:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "The body isn't formatted properly."
+            })
+        }
+    missing_parameters = cf.missing_parameters_from_file_dict(body, ['job_id'])
+    if missing_parameters:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f'\'{", ".join(missing_parameters)}\' parameter(s) is/are missing.'
+            })
+        }
+
+    # The job id is part of the key of the checkpoint
+    job_id = str(body['job_id'])
+    if not job_id.isalnum():
+        return {
+            'statusCode': 404,
+            'body': json.dumps({
+                'error': 'Job not found.'
+            })
+        }
+
+    job = cf.load_dismiss_job(job_id)
+    if not job:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({
+                'error': 'Job not found.'
+            })
+        }
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(cf.get_dismiss_job_status(job))
+    }
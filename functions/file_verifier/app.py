@@ -1,22 +1,33 @@
-import json, os
-from typing import Dict, List, Union
+import json, os, threading
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import quote, unquote, unquote_plus
 
-import boto3
 from botocore.exceptions import ClientError
 
 import common_funcs as cf
+import json_scanner
 
 
 TEMP_BUCKET = os.environ['TEMP_BUCKET']
 DESTINATION_BUCKET = os.environ['BUCKET']
 SNS_ARN = os.environ['SNS_ARN']
+# Size of the chunks read while an upload is validated
+READ_CHUNK_SIZE = 1024 * 1024
+# Uploads of a batch verified at the same time
+VERIFIER_WORKERS = int(os.environ.get('VERIFIER_WORKERS', 4))
+# Times an upload is verified when it's overwritten while it's verified
+VERIFY_ATTEMPTS = int(os.environ.get('VERIFY_ATTEMPTS', 3))
+# Uploads compressed at the same time. The compressed document is kept in memory until it's stored
+# (up to MAX_MB_SIZE_ALLOWED), and compressing takes most of the CPU of the function.
+VERIFIER_COMPRESSION_WORKERS = int(os.environ.get('VERIFIER_COMPRESSION_WORKERS', 1))
+_compression_slots = threading.BoundedSemaphore(VERIFIER_COMPRESSION_WORKERS)
 
 
 def send_email_sns(message: str, contract_number: str, filename: str):
     """
     Send email to the emails suscribed to the sns topic
     """
-    sns_client = boto3.client('sns')
+    sns_client = cf.get_client('sns')
     sns_client.publish(
         TopicArn=SNS_ARN,
         Message=message,
@@ -27,21 +38,93 @@ def delete_file_from_temp_bucket(s3_key: str):
     """
     Delete file from Temp bucket
     """
-    s3_client = boto3.client('s3')
+    s3_client = cf.get_client('s3')
     s3_client.delete_object(Bucket=TEMP_BUCKET, Key=s3_key) # Elimino archivo bucket temporal
 
-def lambda_handler(event, context):
-    s3_event = event['Records'][0]['s3']
-    s3_key = s3_event['object']['key']
-    
+def verify_upload(s3_key: str):
+    """
+    Validates an upload of the temp bucket and moves it to the bucket, or notifies why it isn't valid.
+    A presigned POST can be used again until it expires, so the upload may be overwritten while it's
+    verified: the copies only succeed if the object is still the one that was verified, and if it
+    changed it's verified again.
+    """
+    for attempt in range(VERIFY_ATTEMPTS):
+        try:
+            return verify_temp_object(s3_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'PreconditionFailed' or attempt == VERIFY_ATTEMPTS - 1:
+                raise
+            print(f'{s3_key} was overwritten while it was verified, verifying it again.')
+
+def compress_upload(s3_key: str, etag: str, size: int, filename: str, content_type: str) -> Optional[str]:
+    """
+    Stores a raw upload compressed and returns its digest, or None if compressing it isn't worth it.
+    The upload is read chunk by chunk while it's compressed, by VERIFIER_COMPRESSION_WORKERS
+    uploads at a time; the read fails (PreconditionFailed) if it isn't the upload that was verified.
+    """
+    with _compression_slots:
+        temp_response = cf.get_client('s3').get_object(Bucket=TEMP_BUCKET, Key=s3_key, IfMatch=etag)
+        try:
+            return cf.put_compressed_file(
+                s3_key, temp_response['Body'].iter_chunks(READ_CHUNK_SIZE), size, filename, content_type
+            )
+        finally:
+            temp_response['Body'].close()
+
+def verify_temp_object(s3_key: str):
+    """
+    Validates the current object of an upload and moves it to the bucket, or notifies why it isn't valid.
+    """
     contract_number, filename, version = s3_key.split('/')
     version = version.split('.')[0]
     
-    s3_client = boto3.client('s3')
-    temp_response = s3_client.get_object(Bucket=TEMP_BUCKET, Key=s3_key)
-    try:        
-        json_file = json.loads(temp_response['Body'].read().decode('utf-8'))
-    except:
+    s3_client = cf.get_client('s3')
+    try:
+        temp_response = s3_client.get_object(Bucket=TEMP_BUCKET, Key=s3_key)
+    except ClientError as e:
+        # Notifications can be delivered more than once, the upload was already verified
+        if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+            print(f'{s3_key} is not in the temp bucket, it was already verified.')
+            return
+        raise
+    metadata = cf.get_object_metadata(temp_response)
+    if cf.is_raw_format(metadata):
+        # The document was uploaded as it is, with its filename and content_type in the metadata
+        missing_parameters = cf.missing_parameters_from_file_dict(metadata, ['content_type', 'filename'])
+        if missing_parameters:
+            print(f'\'{", ".join(missing_parameters)}\' metadata is/are missing.')
+            error_message = f"""
+            The filename: {filename} of the contract number: {contract_number} 
+            has these metadata missing: '{", ".join(missing_parameters)}'
+            """
+            delete_file_from_temp_bucket(s3_key)
+            send_email_sns(error_message, contract_number, filename)
+            return
+        
+        filename_metadata, content_type = unquote(metadata['filename']), unquote(metadata['content_type'])
+        temp_response['Body'].close()
+        digest = None
+        if cf.should_compress(temp_response['ContentLength'], content_type):
+            digest = compress_upload(s3_key, temp_response['ETag'], temp_response['ContentLength'], filename_metadata, content_type)
+        if digest is None:
+            # Documents that aren't compressed are moved as they are, without downloading them
+            copy_kwargs = {'ContentType': content_type} if content_type.isascii() else {}
+            digest = cf.copy_file(
+                TEMP_BUCKET, s3_key, temp_response['ContentLength'],
+                cf.get_raw_file_metadata(filename_metadata, content_type),
+                ContentDisposition=f"inline; filename*=UTF-8''{quote(filename_metadata)}",
+                CopySourceIfMatch=temp_response['ETag'], **copy_kwargs
+            )
+        cf.add_key_to_manifest(s3_key, temp_response['ContentLength'], sha256=digest, file_format=cf.RAW_FORMAT)
+        delete_file_from_temp_bucket(s3_key)
+        print("ENVIO SUCCESFULL")
+        return
+    
+    # The json is validated while it's read, without keeping it in memory
+    try:
+        json_keys = json_scanner.scan_object_keys(temp_response['Body'].iter_chunks(READ_CHUNK_SIZE))
+    except json_scanner.JsonScanError as e:
+        print(e)
         error_message = f'''
         The filename: {filename} of the contract number: {contract_number} has invalid json format.
         '''
@@ -49,7 +132,7 @@ def lambda_handler(event, context):
         send_email_sns(error_message, contract_number, filename)
         return
     
-    missing_parameters = cf.missing_parameters_from_file_dict(json_file, ['content_type', 'filename', 'file'])
+    missing_parameters = cf.missing_parameters_from_file_dict(json_keys, ['content_type', 'filename', 'file'])
     if missing_parameters:
         print(f'\'{", ".join(missing_parameters)}\' parameter(s) is/are missing.')
         error_message = f"""
@@ -63,11 +146,61 @@ def lambda_handler(event, context):
         
     
     
-    s3_client.put_object(
-        Body=json.dumps(json_file), Bucket=DESTINATION_BUCKET, 
-        Key=s3_key, Metadata={"encoded_content_type": 'application/json'}
+    # The valid json is stored as it was uploaded, copied by S3 instead of uploaded again
+    digest = cf.copy_file(
+        TEMP_BUCKET, s3_key, temp_response['ContentLength'], {"encoded_content_type": cf.ENVELOPE_FORMAT},
+        CopySourceIfMatch=temp_response['ETag']
     )
+    cf.add_key_to_manifest(s3_key, temp_response['ContentLength'], sha256=digest, file_format=cf.ENVELOPE_FORMAT)
     delete_file_from_temp_bucket(s3_key)
     
     
-    print("ENVIO SUCCESFULL")
\ No newline at end of file
+    print("ENVIO SUCCESFULL")
+
+def get_upload_items(event: Dict) -> List[Tuple[Optional[str], str]]:
+    """
+    Returns the uploads (s3 keys) notified by an event and the id of the SQS message of each one.
+    The event is a batch of SQS messages with S3 notifications, or an S3 notification itself.
+    The keys of the notifications are url-encoded ('+' for the spaces).
+    """
+    items = []
+    for record in event.get('Records', []):
+        message_id = None
+        s3_records = [record]
+        if record.get('eventSource') == 'aws:sqs':
+            message_id = record['messageId']
+            try:
+                # The test event sent by S3 when the notification is configured has no records
+                s3_records = json.loads(record['body']).get('Records', [])
+            except ValueError:
+                print(f'Message {message_id} is not an S3 notification: {record["body"]}')
+                continue
+        for s3_record in s3_records:
+            items.append((message_id, unquote_plus(s3_record['s3']['object']['key'])))
+    return items
+
+def verify_item(item: Tuple[Optional[str], str]) -> Tuple[Optional[str], str, Optional[Exception]]:
+    """
+    Verifies an upload of a batch and returns the error, if it failed, instead of raising it.
+    """
+    message_id, s3_key = item
+    try:
+        verify_upload(s3_key)
+    except Exception as e:
+        print(f'ERROR verifying {s3_key}: {e!r}')
+        return message_id, s3_key, e
+    return message_id, s3_key, None
+
+@cf.track_clients_usage
+def lambda_handler(event, context):
+    items = get_upload_items(event)
+    failures = [result for result in cf.run_concurrently(verify_item, items, VERIFIER_WORKERS) if result[2]]
+    
+    if any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', [])):
+        # Only the messages of the failed uploads go back to the queue
+        return {
+            'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted({failure[0] for failure in failures})]
+        }
+    if failures:
+        # Direct S3 notifications are retried by Lambda when the invocation fails
+        raise failures[0][2]
@@ -1,14 +1,82 @@
 import json, os
+from typing import Dict, Optional
 
-import boto3
+from botocore.exceptions import ClientError
 
 import common_funcs as cf
 
 
 BUCKET = os.environ['BUCKET']
+# Versions never change, so the reads of an explicit version_id can be cached for a year.
+# The reads of the latest version have to be revalidated (If-None-Match) every time.
+IMMUTABLE_CACHE_CONTROL = os.environ.get('IMMUTABLE_CACHE_CONTROL', 'private, max-age=31536000, immutable')
+LATEST_CACHE_CONTROL = 'private, no-cache'
 
 
+def get_presigned_url_response(s3_key: str) -> Dict:
+    """
+    Returns the response for files too big to be returned inside the response body.
+    """
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'presigned_url': cf.get_presigned_get_url(s3_key)
+        })
+    }
+
+def use_presigned_url(content_length: int, metadata: Dict) -> bool:
+    """
+    Checks if a file is too big to be returned inside the response, so it's returned as a presigned url.
+    Compressed files are decompressed inside the response; the presigned url serves the object as
+    it's stored, with its Content-Encoding header.
+    """
+    return cf.get_inline_response_size(content_length, metadata) >= cf.MAX_INLINE_RESPONSE_SIZE
+
+def get_cache_headers(etag: str, immutable: bool) -> Dict:
+    """
+    Returns the headers that let the clients (browsers, CDNs) cache a file and revalidate it with its ETag.
+    """
+    return {
+        'ETag': etag,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else LATEST_CACHE_CONTROL
+    }
+
+def get_if_none_match(headers: Dict, body: Dict) -> Optional[str]:
+    """
+    Returns the ETag(s) of the file the client already has: the If-None-Match header,
+    or the 'etag' parameter of the body.
+    """
+    if headers.get('if-none-match'):
+        return headers['if-none-match']
+    if body.get('etag'):
+        return '"' + body['etag'].strip('"') + '"'
+    return None
+
+def get_not_modified_response(etag: str, immutable: bool) -> Dict:
+    return {
+        'statusCode': 304,
+        'headers': get_cache_headers(etag, immutable)
+    }
+
+def get_not_found_response() -> Dict:
+    return {
+        'statusCode': 404,
+        'body': json.dumps({
+            'error': 'File not found.'
+        })
+    }
+
+def get_glacier_response() -> Dict:
+    return {
+        'statusCode': 400,
+        'body': json.dumps({
+            'mensaje': 'File is in Glacier Storage, you must restore it first.'
+        })
+    }
+
+@cf.track_clients_usage
 def lambda_handler(event, context):
+    cf.start_phase('parse')
     if 'body' not in event:
         return {
             'statusCode': 400,
@@ -35,59 +103,54 @@ def lambda_handler(event, context):
             })
         }
         
+    cf.start_phase('resolve')
     version = body.get('version_id')
     contract_number = body['contract_number']
     filename_no_extension = body['filename'].split('.')[0]
-    if not version:
-        # si no existe version = false
-        if cf.folder_exists_and_not_empty(f"{contract_number}/{filename_no_extension}"):
-            version = cf.get_latest_version(contract_number, filename_no_extension)
-    
-    s3_key = f"{contract_number}/{filename_no_extension}/{version}.txt"
-    metadata_response = cf.key_exists_in_bucket(s3_key)
-    
-    if metadata_response:
-        if metadata_response.get('StorageClass') == 'GLACIER':
-            return {
-                'statusCode': 400,
-                'body': json.dumps({
-                    'mensaje': 'File is in Glacier Storage, you must restore it first.'
-                })
-            }
-        
-        if metadata_response['ContentLength'] >= 6290000: # 6291456 -> 6mb
-            s3 = boto3.client('s3')
-            presigned_url_response = s3.generate_presigned_url('get_object', Params={
-                'Bucket': BUCKET, 'Key': s3_key
-            }, ExpiresIn=300)
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'presigned_url': presigned_url_response
-                })
-            }
-    
-        s3_client = boto3.client('s3')
-        response = s3_client.get_object(Bucket=BUCKET, Key=s3_key)
-            
-        json_file = json.loads(response['Body'].read().decode('utf-8'))
-        filename = json_file['filename']
-        content_type = json_file['content_type']
-        file = json_file['file']
-        
-        return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'content_type': content_type,
-                    'filename': filename,
-                    'file': file
-                }),
-                'isBase64Encoded': False
-            }
-    
+    headers = event.get('headers') or {}
+    if_none_match = get_if_none_match(headers, body)
+    if version:
+        s3_key = f"{contract_number}/{filename_no_extension}/{version}.txt"
+    else:
+        # The listing of the latest version already tells if the file exists, its ETag, its size
+        # and its storage class, so there is no need of a HEAD request.
+        latest_object = cf.get_latest_version_object(contract_number, filename_no_extension, cached=True)
+        if not latest_object:
+            return get_not_found_response()
+        s3_key = latest_object['Key']
+        if latest_object['StorageClass'] == 'GLACIER':
+            return get_glacier_response()
+        if if_none_match and cf.etag_matches(if_none_match, latest_object['ETag']):
+            return get_not_modified_response(latest_object['ETag'], immutable=False)
+
+    # A single GET returns the size, the storage class, the metadata and the file. The clients
+    # that already have the file (If-None-Match) get a 304 from S3 without downloading it again.
+    cf.start_phase('fetch')
+    get_kwargs = {'IfNoneMatch': if_none_match} if if_none_match else {}
+    try:
+        response = cf.get_client('s3').get_object(Bucket=BUCKET, Key=s3_key, **get_kwargs)
+    except ClientError as e:
+        if e.response['ResponseMetadata'].get('HTTPStatusCode') == 304:
+            return get_not_modified_response(e.response['ResponseMetadata']['HTTPHeaders'].get('etag'), bool(version))
+        if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+            if not version:
+                # The cached latest version was deleted by another container
+                cf.invalidate_metadata_cache(f"{contract_number}/{filename_no_extension}/")
+            return get_not_found_response()
+        if e.response['Error']['Code'] == 'InvalidObjectState':
+            return get_glacier_response()
+        raise
+
+    # The body isn't read for big files, only the headers of the response
+    if use_presigned_url(response['ContentLength'], cf.get_object_metadata(response)):
+        response['Body'].close()
+        return get_presigned_url_response(s3_key)
+
+    # The body is read from S3 while it's encoded
+    cf.start_phase('serialize')
     return {
-            'statusCode': 404,
-            'body': json.dumps({
-                'error': 'File not found.'
-            })
+            'statusCode': 200,
+            'headers': get_cache_headers(response['ETag'], bool(version)),
+            'body': cf.get_response_body_from_s3_response(response),
+            'isBase64Encoded': False
         }
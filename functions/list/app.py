@@ -1,40 +1,45 @@
 import json, os
 from datetime import datetime
-from typing import Dict
-
-import boto3
+from typing import Dict, List
 
 import common_funcs as cf
 
 
 BUCKET = os.environ['BUCKET']
-DATETIME_FORMAT = '%Y%m%d_%H%M%S'
 
 
-def get_current_file_info(folder: str) -> Dict:
+def get_current_file_info(filename: str, file_entry: Dict) -> Dict:
     """
-    Returns the current file information.
+    Returns the current file information from the manifest entry of a file.
     """
-    s3 = boto3.client('s3')
-    resp = s3.list_objects_v2(Bucket=BUCKET, Prefix=folder, Delimiter='/')
+    latest_version = file_entry['versions'][file_entry['latest']]
+    is_archived = False
+    if latest_version['storage_class'] in ['GLACIER', 'GLACIER_IR']:
+        is_archived = True
+    last_modified = datetime.fromisoformat(latest_version['last_modified'])
+    latest_file_formatted = {
+        'filename': filename,
+        'size': latest_version['size'],
+        'last_modified': last_modified.strftime('%Y/%m/%d %H:%M%S'),
+        'archived': is_archived
+    }
     
-    if 'Contents' in resp:
-        files = resp['Contents']
-        latest_file = max(files, key=lambda x: datetime.strptime(x['Key'].split('/')[-1].replace('.txt', ''), DATETIME_FORMAT))
-        is_archived = False
-        print(latest_file)
-        if latest_file['StorageClass'] in ['GLACIER', 'GLACIER_IR']:
-            is_archived = True
-        latest_file_formatted = {
-            'filename': latest_file['Key'].split('/')[1],
-            'size': latest_file['Size'],
-            'last_modified': latest_file['LastModified'].strftime('%Y/%m/%d %H:%M%S'),
-            'archived': is_archived
-        }
-        
-        return latest_file_formatted
+    return latest_file_formatted
 
+def get_current_files_info(contract_number: str) -> List:
+    """
+    Returns the current file information of every file in a contract number, from the manifest
+    of the contract (a single GET while the manifest is fresh).
+    The files are sorted like their folders ({contract_number}/{filename}/) in a listing.
+    """
+    manifest = cf.get_manifest(contract_number, cached=True)
+    filenames = sorted(manifest['files'], key=lambda filename: f'{filename}/')
+    
+    return [get_current_file_info(filename, manifest['files'][filename]) for filename in filenames]
+
+@cf.track_clients_usage
 def lambda_handler(event, context):
+    cf.start_phase('parse')
     if 'body' not in event:
         return {
             'statusCode': 400,
@@ -60,14 +65,10 @@ def lambda_handler(event, context):
             })
         } 
         
-    filenames = cf.get_filenames_in_contract_number(body['contract_number'])
-    last_version_filenames = []
-    if filenames:
-        for filename in filenames:
-            latest_file = get_current_file_info(filename['Prefix'])
-            if latest_file:
-                last_version_filenames.append(latest_file)
-        
+    cf.start_phase('resolve')
+    last_version_filenames = get_current_files_info(body['contract_number'])
+    cf.start_phase('serialize')
+    if last_version_filenames:
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -6,7 +6,9 @@ import common_funcs as cf
 BUCKET = os.environ['BUCKET']
 
 
+@cf.track_clients_usage
 def lambda_handler(event, context):
+    cf.start_phase('parse')
     if 'body' not in event:
         return {
             'statusCode': 400,
@@ -32,17 +34,49 @@ def lambda_handler(event, context):
                 'error': f'\'{", ".join(missing_parameters)}\' parameter(s) is/are missing.'
             })
         } 
+    
+    limit = body.get('limit')
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "'limit' parameter must be a positive integer."
+            })
+        }
+    
     contract_number = body['contract_number']
     filename_no_extension = body['filename'].split('.')[0]
-    versions = cf.get_versions_of_file(contract_number, filename_no_extension)
+    start_after = body.get('start_after')
+    end_before = body.get('end_before')
     
-    if versions:
+    cf.start_phase('resolve')
+    manifest = cf.get_manifest(contract_number, cached=True)
+    if filename_no_extension not in manifest['files']:
         return {
-        'statusCode': 200,
-        'body': json.dumps({'versions': versions})
-    }    
+            'statusCode': 404,
+            'body': json.dumps({'error': 'Filename not found.'})
+        }
+    
+    latest_version_id = manifest['files'][filename_no_extension]['latest']
+    # One more version than the limit tells if there is a next page
+    versions = cf.get_file_versions_from_manifest(
+        manifest, filename_no_extension, start_after, end_before, limit + 1 if limit else None
+    )
+    has_more_versions = bool(limit) and len(versions) > limit
+    if has_more_versions:
+        versions = versions[:limit]
+    
+    cf.start_phase('serialize')
+    response_body = {
+        'versions': [
+            cf.format_file_version(version, is_latest=version.version_id == latest_version_id)
+            for version in versions
+        ]
+    }
+    if has_more_versions:
+        response_body['next_start_after'] = versions[-1].version_id
     
     return {
-        'statusCode': 404,
-        'body': json.dumps({'error': 'Filename not found.'})
+        'statusCode': 200,
+        'body': json.dumps(response_body)
     }
@@ -0,0 +1,150 @@
+import json, os
+from typing import Dict, List
+
+from botocore.exceptions import ClientError
+
+import common_funcs as cf
+
+
+BUCKET_TEMP = os.environ['BUCKET_TEMP']
+MAX_MB_SIZE_ALLOWED = int(os.environ.get('MAX_MB_SIZE_ALLOWED', 100))
+ACTIONS = ['complete', 'abort']
+
+
+def list_uploaded_parts(s3_key: str, upload_id: str) -> List[Dict]:
+    """
+    Returns the parts (PartNumber, ETag, Size) uploaded so far to a multipart upload.
+    """
+    paginator = cf.get_client('s3').get_paginator('list_parts')
+    parts = []
+    for page in paginator.paginate(Bucket=BUCKET_TEMP, Key=s3_key, UploadId=upload_id):
+        parts.extend(page.get('Parts', []))
+    return parts
+
+def get_missing_parts(parts: List[Dict], parts_count: int) -> List[int]:
+    """
+    Returns the numbers of the parts (from 1 to parts_count) that haven't been uploaded.
+    """
+    uploaded_parts = {part['PartNumber'] for part in parts}
+    return [part_number for part_number in range(1, parts_count + 1) if part_number not in uploaded_parts]
+
+def complete_upload(s3_key: str, upload_id: str, parts_count: int=None) -> Dict:
+    """
+    Assembles the uploaded parts into the object, which file_verifier then moves to the bucket.
+    """
+    s3_client = cf.get_client('s3')
+    parts = list_uploaded_parts(s3_key, upload_id)
+    if not parts:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': 'No parts have been uploaded.'
+            })
+        }
+    missing_parts = get_missing_parts(parts, parts_count) if parts_count else []
+    if missing_parts:
+        # The client only has to upload these parts again before completing the upload
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': 'Some parts have not been uploaded.',
+                'missing_parts': missing_parts
+            })
+        }
+    # The presigned urls of the parts can't limit their size, so it's checked here
+    if sum(part['Size'] for part in parts) > MAX_MB_SIZE_ALLOWED * 1048576:
+        s3_client.abort_multipart_upload(Bucket=BUCKET_TEMP, Key=s3_key, UploadId=upload_id)
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f"The file can't be bigger than {MAX_MB_SIZE_ALLOWED} MB."
+            })
+        }
+
+    s3_client.complete_multipart_upload(
+        Bucket=BUCKET_TEMP, Key=s3_key, UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in parts]}
+    )
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'File uploaded.',
+            'version_id': cf.get_version_id_from_key(s3_key)
+        })
+    }
+
+def abort_upload(s3_key: str, upload_id: str) -> Dict:
+    """
+    Cancels a multipart upload and deletes its uploaded parts.
+    """
+    cf.get_client('s3').abort_multipart_upload(Bucket=BUCKET_TEMP, Key=s3_key, UploadId=upload_id)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Upload aborted.'
+        })
+    }
+
+
+@cf.track_clients_usage
+def lambda_handler(event, context):
+    if 'body' not in event:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "A body in the request is required."
+            })
+        }
+
+    body = cf.get_body_dict_from_event(event)
+    if not body:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "The body isn't formatted properly."
+            })
+        }
+
+    missing_parameters = cf.missing_parameters_from_file_dict(
+        body, ['contract_number', 'filename', 'version_id', 'upload_id', 'action']
+    )
+    if missing_parameters:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f'\'{", ".join(missing_parameters)}\' parameter(s) is/are missing.'
+            })
+        }
+    if body['action'] not in ACTIONS:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f"'action' parameter must be one of: {', '.join(ACTIONS)}."
+            })
+        }
+
+    filename_no_extension = body['filename'].split('.')[0]
+    if '/' in filename_no_extension or '/' in body['version_id']:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': "A filename cant have '/' on it."
+            })
+        }
+    # The key is built again from the request, so only uploads of the contract can be completed
+    s3_key = f"{body['contract_number']}/{filename_no_extension}/{body['version_id']}.txt"
+
+    try:
+        if body['action'] == 'abort':
+            return abort_upload(s3_key, body['upload_id'])
+        parts_count = body.get('parts_count')
+        return complete_upload(s3_key, body['upload_id'], parts_count if isinstance(parts_count, int) else None)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['NoSuchUpload', '404']:
+            return {
+                'statusCode': 404,
+                'body': json.dumps({
+                    'error': 'Upload not found.'
+                })
+            }
+        raise
@@ -1,14 +1,63 @@
-import json, os
-
-import boto3
+import json, math, os
+from typing import Dict
 
 import common_funcs as cf
 
 
 BUCKET = os.environ['BUCKET']
 BUCKET_TEMP = os.environ['BUCKET_TEMP']
-MAX_MB_SIZE_ALLOWED = os.environ.get('MAX_MB_SIZE', 100)
+MAX_MB_SIZE_ALLOWED = int(os.environ.get('MAX_MB_SIZE_ALLOWED', 100))
+# Limits of the parts of a multipart upload (S3 requires parts of 5mb at least, except the last one)
+MULTIPART_MIN_PART_SIZE = 5 * 1048576
+MULTIPART_MAX_PARTS = 10000
+# Seconds the presigned urls of the parts are valid
+MULTIPART_URL_EXPIRATION = int(os.environ.get('MULTIPART_URL_EXPIRATION', 3600))
+
+
+def get_multipart_upload_error(body: Dict) -> str:
+    """
+    Validates the size of the file and the size of its parts for a multipart upload.
+    """
+    file_size, part_size = body.get('file_size'), body.get('part_size')
+    if not isinstance(file_size, int) or not isinstance(part_size, int) or file_size <= 0 or part_size <= 0:
+        return "'file_size' and 'part_size' parameters must be positive integers (bytes)."
+    if file_size > MAX_MB_SIZE_ALLOWED * 1048576:
+        return f"The file can't be bigger than {MAX_MB_SIZE_ALLOWED} MB."
+    if part_size < MULTIPART_MIN_PART_SIZE and part_size < file_size:
+        return f"'part_size' can't be smaller than {MULTIPART_MIN_PART_SIZE} bytes."
+    if math.ceil(file_size / part_size) > MULTIPART_MAX_PARTS:
+        return f"The file can't have more than {MULTIPART_MAX_PARTS} parts."
+    return ''
 
+def get_multipart_upload_response(s3_key: str, file_size: int, part_size: int, metadata: Dict) -> Dict:
+    """
+    Starts a multipart upload in the temp bucket and returns a presigned url for every part.
+    The parts can be uploaded in parallel (PUT of the bytes of the part to its url) and the failed
+    ones retried alone; then the upload is completed with /_multipart_upload, and file_verifier
+    receives the assembled object like any other upload.
+    """
+    s3_client = cf.get_client('s3')
+    upload = s3_client.create_multipart_upload(Bucket=BUCKET_TEMP, Key=s3_key, Metadata=metadata)
+    parts = []
+    for part_number in range(1, math.ceil(file_size / part_size) + 1):
+        parts.append({
+            'part_number': part_number,
+            'url': s3_client.generate_presigned_url('upload_part', Params={
+                'Bucket': BUCKET_TEMP, 'Key': s3_key, 'UploadId': upload['UploadId'], 'PartNumber': part_number
+            }, ExpiresIn=MULTIPART_URL_EXPIRATION)
+        })
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'upload_id': upload['UploadId'],
+            'version_id': cf.get_version_id_from_key(s3_key),
+            'part_size': part_size,
+            'parts': parts
+        })
+    }
+
+
+@cf.track_clients_usage
 def lambda_handler(event, context):
     if 'body' not in event:
         return {
@@ -43,9 +92,37 @@ def lambda_handler(event, context):
         
     s3_key = cf.get_new_s3_key(root_folder_s3)
         
-    s3_client = boto3.client('s3')
+    metadata = {}
+    if body.get('upload_format') == 'raw':
+        # The document is uploaded as it is (not inside a json), so its filename and
+        # content_type go in the metadata of the object.
+        if 'content_type' not in body:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({
+                    'error': "'content_type' parameter(s) is/are missing."
+                })
+            }
+        metadata = cf.get_raw_file_metadata(body['filename'], body['content_type'])
+    
+    if body.get('upload_mode') == 'multipart':
+        multipart_upload_error = get_multipart_upload_error(body)
+        if multipart_upload_error:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({
+                    'error': multipart_upload_error
+                })
+            }
+        return get_multipart_upload_response(s3_key, body['file_size'], body['part_size'], metadata)
+    
+    fields = {f'x-amz-meta-{key}': value for key, value in metadata.items()}
+    conditions = [["content-length-range", 1, MAX_MB_SIZE_ALLOWED * 1048576]] # 100mb
+    conditions += [{key: value} for key, value in fields.items()]
+    
+    s3_client = cf.get_client('s3')
     response = s3_client.generate_presigned_post(BUCKET_TEMP, s3_key, 
-            Conditions=[["content-length-range", 1, MAX_MB_SIZE_ALLOWED * 1048576]], # 100mb
+            Fields=fields, Conditions=conditions,
             ExpiresIn=300)
         
         
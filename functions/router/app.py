@@ -0,0 +1,63 @@
+import importlib, json, os
+from typing import Callable, Dict, Optional
+
+
+# Function (folder of functions/) that handles every route of the API. In the router deployment
+# (DeploymentMode=router) a single function serves all the routes, so they share its warm containers,
+# its clients and its caches.
+ROUTES = {
+    'POST /files/_create': 'create',
+    'POST /files/_batch_get': 'batch_get',
+    'POST /files/_bulk_delete': 'bulk_delete',
+    'POST /files/_delete': 'delete',
+    'PATCH /files/_dismiss': 'dismiss',
+    'POST /files/_dismiss_status': 'dismiss_status',
+    'POST /files/_get': 'get',
+    'GET /health': 'health',
+    'POST /files/_list': 'list',
+    'POST /files/_list_versions': 'list_versions',
+    'POST /files/_multipart_upload': 'multipart_upload',
+    'POST /files/_presigned_url': 'presigned_url',
+    'PUT /files/_update': 'update',
+}
+# Import the handlers of all the routes in the init phase, instead of in their first request
+ROUTER_PRELOAD = os.environ.get('ROUTER_PRELOAD', 'true').lower() == 'true'
+
+_handlers = {}
+
+
+def get_handler(function_name: str) -> Callable:
+    """
+    Returns the lambda_handler of a function, importing its app module the first time.
+    """
+    handler = _handlers.get(function_name)
+    if handler is None:
+        handler = importlib.import_module(f'{function_name}.app').lambda_handler
+        _handlers[function_name] = handler
+    return handler
+
+def get_function_name(event: Dict) -> Optional[str]:
+    """
+    Returns the function of an event: the one of its route, or dismiss for the asynchronous
+    invocations that continue a dismiss job (dismiss invokes the function it runs in).
+    """
+    if 'dismiss_job_id' in event:
+        return 'dismiss'
+    return ROUTES.get(event.get('routeKey'))
+
+def lambda_handler(event, context):
+    function_name = get_function_name(event)
+    if not function_name:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({
+                'error': f"Route {event.get('routeKey')} not found."
+            })
+        }
+    return get_handler(function_name)(event, context)
+
+
+# INIT PHASE
+if ROUTER_PRELOAD:
+    for route_function_name in sorted(set(ROUTES.values())):
+        get_handler(route_function_name)
@@ -1,14 +1,54 @@
 import json, logging, os
+from typing import Dict, Optional
+from urllib.parse import unquote
 
-import boto3
+from botocore.exceptions import ClientError
 
 import common_funcs as cf
 
 BUCKET = os.environ['BUCKET']
+ARCHIVED_STORAGE_CLASSES = ['GLACIER', 'GLACIER_IR', 'DEEP_ARCHIVE']
 logger = logging.getLogger()
 logger.setLevel(logging.WARNING)
 
 
+def get_identical_latest_version(manifest: Dict, filename: str, digest: str, file_dict: Dict) -> Optional[str]:
+    """
+    Returns the latest version of a file if it has the same content, filename and content_type
+    as the new one, or None.
+    The digest of the latest version is in the manifest, so different contents are detected without
+    any request; the version is only read (HEAD) when the digests match, to compare the filename and
+    the content_type of its metadata, or when the manifest doesn't have its digest.
+    """
+    file_entry = manifest['files'][filename]
+    latest_version_id = file_entry['latest']
+    latest_version = file_entry['versions'][latest_version_id]
+    # Archived versions can't be read, so they are always replaced by a new one
+    if latest_version['storage_class'] in ARCHIVED_STORAGE_CLASSES:
+        return None
+    if latest_version.get('sha256') and latest_version['sha256'] != digest:
+        return None
+    
+    try:
+        resp = cf.get_client('s3').head_object(
+            Bucket=BUCKET, Key=f"{manifest['contract_number']}/{filename}/{latest_version_id}.txt", ChecksumMode='ENABLED'
+        )
+    except ClientError as e:
+        print(e.response['Error'])
+        return None
+    if cf.get_object_digest(resp) != digest:
+        return None
+    # The digest of an envelope already covers its filename and content_type
+    metadata = cf.get_object_metadata(resp)
+    if cf.is_raw_format(metadata) and (
+        unquote(metadata.get('filename', '')) != file_dict['filename']
+        or unquote(metadata.get('content_type', '')) != file_dict['content_type']
+    ):
+        return None
+    return latest_version_id
+
+
+@cf.track_clients_usage
 def lambda_handler(event, context):
     if 'body' not in event or event['body'] == '':
         return {
@@ -43,7 +83,9 @@ def lambda_handler(event, context):
     contract_number = json_file['contract_number']
     root_folder_s3 = f"{contract_number}/{filename_no_extension}"
     
-    if not cf.folder_exists_and_not_empty(root_folder_s3):
+    # The manifest answers both if the file exists and the digest of its latest version
+    manifest = cf.get_manifest(contract_number)
+    if filename_no_extension not in manifest['files']:
         return {
             'statusCode': 404,
             'body': json.dumps({
@@ -51,13 +93,20 @@ def lambda_handler(event, context):
             })
         }
     
+    stored_document = cf.get_stored_document(json_file)
+    latest_version_id = get_identical_latest_version(manifest, filename_no_extension, stored_document.sha256, json_file)
+    if latest_version_id:
+        # Saving the same file again doesn't create a new version
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'File not modified.',
+                'version_id': latest_version_id
+            })
+        }
     
-    s3_key = cf.get_new_s3_key(root_folder_s3)
-    file_encoded = json.dumps(json_file)
-    s3 = boto3.resource('s3')
-    s3.Object(BUCKET, s3_key).put(
-        Body=file_encoded, Metadata={'encoded_content_type': 'application/json'}
-    )
+    s3_key, stored_size, digest = cf.put_new_version(root_folder_s3, json_file, stored_document)
+    cf.add_key_to_manifest(s3_key, stored_size, sha256=digest, file_format=stored_document.file_format)
     
     
     return {
@@ -1,61 +1,474 @@
-import os, json, base64, re
-from datetime import datetime
-from typing import Dict, List, Union
+import os, json, base64, binascii, bisect, hashlib, random, threading, time, uuid, zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import quote, unquote
 
-import boto3
-from botocore.exceptions import ClientError
-from requests_toolbelt.multipart import decoder
+import botocore.session
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+import json_scanner
+import multipart_parser
 
 BUCKET = os.environ['BUCKET']
+# Version ids are the time the version was stored. Legacy ids have seconds (DATETIME_FORMAT) and
+# the new ones microseconds (VERSION_ID_FORMAT); both sort lexicographically, and a legacy id sorts
+# before the new ids of the same second ('{version}.txt' < '{version}_{microseconds}.txt').
 DATETIME_FORMAT = '%Y%m%d_%H%M%S'
+VERSION_ID_FORMAT = '%Y%m%d_%H%M%S_%f'
+# Attempts to store a new version when its version id was taken by another writer
+VERSION_WRITE_ATTEMPTS = int(os.environ.get('VERSION_WRITE_ATTEMPTS', 5))
 
+# Formats of the stored files, saved in the 'encoded_content_type' metadata key of the objects:
+# - ENVELOPE_FORMAT (legacy): a json with the filename, the content_type and the file in base64.
+# - RAW_FORMAT: the document itself, with the filename and the content_type in the metadata.
+ENVELOPE_FORMAT = 'application/json'
+RAW_FORMAT = 'application/octet-stream'
+# Max size of a file returned inside the response of _get, bigger files are returned as presigned urls
+MAX_INLINE_RESPONSE_SIZE = 6290000 # 6291456 -> 6mb
+# Seconds the presigned urls of the files are valid
+PRESIGNED_URL_EXPIRATION = 300
+# Max size of an object copied with a single CopyObject request, bigger ones are copied in parts
+MAX_COPY_OBJECT_SIZE = 5 * 1024**3 # 5gb
+COPY_PART_SIZE = 512 * 1024**2
 
-# CREATE - UPDATE FILES
-def decode_dict(d: Dict) -> Dict:
+# Compression of the documents stored in RAW_FORMAT ('gzip', 'zstd' or '' to disable it).
+# The encoding is saved in the ContentEncoding of the object and in its 'content_encoding' metadata key.
+COMPRESSION_ALGORITHM = os.environ.get('COMPRESSION_ALGORITHM', '')
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 8192)) # bytes
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# Compressed documents are only stored if they save at least this ratio of the size
+COMPRESSION_MIN_SAVING = float(os.environ.get('COMPRESSION_MIN_SAVING', 0.1))
+# Content types that are already compressed
+INCOMPRESSIBLE_CONTENT_TYPES = ['image/', 'video/', 'audio/', 'application/zip', 'application/gzip',
+                                'application/zstd', 'application/x-7z-compressed', 'application/x-rar-compressed']
+
+# Per-contract manifests (index of the files and versions of a contract)
+MANIFEST_PREFIX = os.environ.get('MANIFEST_PREFIX', '_manifests')
+MANIFEST_SCHEMA_VERSION = 1
+MANIFEST_MAX_AGE = int(os.environ.get('MANIFEST_MAX_AGE', 86400)) # seconds
+MANIFEST_UPDATE_ATTEMPTS = int(os.environ.get('MANIFEST_UPDATE_ATTEMPTS', 8))
+# Concurrent HEAD requests that read the details (size, digest, format) of the versions a rebuilt manifest doesn't have
+MANIFEST_REBUILD_WORKERS = int(os.environ.get('MANIFEST_REBUILD_WORKERS', 8))
+# Max versions whose details are read by a read of the manifest, so the reads stay short
+MANIFEST_FILL_BATCH = int(os.environ.get('MANIFEST_FILL_BATCH', 32))
+# Max wait (seconds) before retrying a manifest update that lost against another writer
+MANIFEST_RETRY_MAX_DELAY = float(os.environ.get('MANIFEST_RETRY_MAX_DELAY', 1))
+CONDITIONAL_WRITE_ERRORS = ['PreconditionFailed', 'ConditionalRequestConflict']
+
+# Checkpoints of the dismiss jobs (JOBS_PREFIX/dismiss/{job_id}.json)
+JOBS_PREFIX = os.environ.get('JOBS_PREFIX', '_jobs')
+# Max failed objects recorded in a checkpoint (the rest are only counted)
+JOB_MAX_FAILED_OBJECTS = int(os.environ.get('JOB_MAX_FAILED_OBJECTS', 1000))
+
+# In-process cache of the metadata lookups of the read endpoints (manifests and latest versions) of a warm container
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', 1024))
+# Seconds a lookup is cached (0 disables the cache)
+METADATA_CACHE_TTL = float(os.environ.get('METADATA_CACHE_TTL', 5))
+
+# Configuration of the clients shared by all the invocations of a container
+CLIENT_MAX_POOL_CONNECTIONS = int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', 10))
+CLIENT_TCP_KEEPALIVE = os.environ.get('CLIENT_TCP_KEEPALIVE', 'true').lower() == 'true'
+CLIENT_RETRY_MODE = os.environ.get('CLIENT_RETRY_MODE', 'standard')
+CLIENT_MAX_ATTEMPTS = int(os.environ.get('CLIENT_MAX_ATTEMPTS', 3))
+# Clients built while the module is imported (init phase), comma separated
+INIT_CLIENTS = [service_name for service_name in os.environ.get('INIT_CLIENTS', 's3').split(',') if service_name]
+# Metrics record (CloudWatch Embedded Metric Format) logged after every invocation
+INVOCATION_METRICS = os.environ.get('INVOCATION_METRICS', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ApiVisor')
+
+
+# CLIENTS
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_created = {'count': 0}
+# botocore session of the clients. The clients are built with botocore, not boto3: boto3 imports
+# s3transfer (and its dependencies) when it's loaded, and only the copies of big objects need it
+_session = {}
+# Last version id returned in this container, so the new ones are always greater
+_last_version_id = {'version_id': ''}
+_version_id_lock = threading.Lock()
+
+def get_client_config() -> Config:
     """
-    Decodes a dictionary with bytes as keys/values
+    Returns the botocore configuration used by the shared clients.
     """
-    decoded_dict = {}
-    for key, value in d.items():
-        if isinstance(key, bytes):
-            key = key.decode()
-        if isinstance(value, bytes):
-            value = value.decode()
-        elif isinstance(value, dict):
-            value = decode_dict(value)
-        decoded_dict.update({key: value})
-    return decoded_dict
+    return Config(
+        max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=CLIENT_TCP_KEEPALIVE,
+        retries={'mode': CLIENT_RETRY_MODE, 'max_attempts': CLIENT_MAX_ATTEMPTS}
+    )
 
-def get_multipart_key(string: str, key: str) -> str:
+def get_client(service_name: str):
     """
-    Searchs and returns a value inside a multipart key (key=value)
+    Returns the client of a service. The client (and its connection pool) is built
+    the first time it's requested and then reused by all the invocations of the container.
     """
-    regex = f'({key}=)"([^"]*)"'
-    value = re.search(regex, string)
-    
-    return value.groups()[1]
+    client = _clients.get(service_name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(service_name)
+            if client is None:
+                if 'session' not in _session:
+                    _session['session'] = botocore.session.get_session()
+                client = _session['session'].create_client(service_name, config=get_client_config())
+                if INVOCATION_METRICS:
+                    register_metrics_hooks(client)
+                _clients[service_name] = client
+                _clients_created['count'] += 1
+    return client
+
+def init_clients(service_names: List[str]):
+    """
+    Builds the clients of some services in advance. Errors are only logged, the clients are
+    built again the first time they are requested.
+    """
+    for service_name in service_names:
+        try:
+            get_client(service_name)
+        except (BotoCoreError, ValueError) as e:
+            print(f'The {service_name} client could not be built in advance: {e}')
+
+def get_connections_stats(client) -> Dict:
+    """
+    Returns how many connections have been opened and how many requests have been sent
+    through the connection pools of a client.
+    """
+    stats = {'connections': 0, 'requests': 0}
+    try:
+        pools = client._endpoint.http_session._manager.pools
+        for pool_key in pools.keys():
+            pool = pools[pool_key]
+            stats['connections'] += pool.num_connections
+            stats['requests'] += pool.num_requests
+    except (AttributeError, KeyError):
+        # The pools are internal to botocore/urllib3, don't fail if they change.
+        pass
+    return stats
+
+def get_clients_usage() -> Dict:
+    """
+    Returns a snapshot of the clients created and the connections opened by the container.
+    """
+    usage = {'clients': _clients_created['count'], 'connections': 0, 'requests': 0}
+    for client in list(_clients.values()):
+        stats = get_connections_stats(client)
+        usage['connections'] += stats['connections']
+        usage['requests'] += stats['requests']
+    return usage
+
+def track_clients_usage(handler: Callable) -> Callable:
+    """
+    Decorator for the lambda handlers. Logs how many clients and connections were created
+    during the invocation, how many requests reused an already opened connection, and the
+    counters of the metadata cache of the container. With INVOCATION_METRICS they are logged
+    inside the metrics record of the invocation.
+    """
+    @wraps(handler)
+    def wrapper(event, context):
+        usage_before = get_clients_usage()
+        metrics = InvocationMetrics() if INVOCATION_METRICS else None
+        _invocation['metrics'] = metrics
+        response = None
+        try:
+            response = handler(event, context)
+            return response
+        finally:
+            _invocation['metrics'] = None
+            usage_after = get_clients_usage()
+            new_connections = usage_after['connections'] - usage_before['connections']
+            requests = usage_after['requests'] - usage_before['requests']
+            usage = {'clients_usage': {
+                'clients_created': usage_after['clients'] - usage_before['clients'],
+                'clients_total': usage_after['clients'],
+                'connections_created': new_connections,
+                'connections_reused': max(requests - new_connections, 0),
+                'requests': requests
+            }, 'metadata_cache': get_metadata_cache_stats()}
+            if metrics:
+                # The route tells the requests apart when a single function serves all of them (router mode)
+                route = event.get('routeKey') if isinstance(event, dict) else None
+                usage = metrics.get_record(context, response, {'route': route, **usage})
+            print(json.dumps(usage))
+    return wrapper
+
+
+# INVOCATION METRICS
+# Calls to AWS and phases of the invocation being run. A container runs one invocation at a time,
+# but its calls may be sent from several threads (e.g. run_concurrently).
+_invocation = {'metrics': None}
+# Names of the services in the metrics
+METRICS_SERVICE_NAMES = {'s3': 'S3', 'sns': 'SNS', 'lambda': 'Lambda'}
+
+
+class InvocationMetrics:
+    """
+    Counters of an invocation: the calls to AWS by operation (count, retries, errors, milliseconds
+    and bytes sent and received) and the milliseconds of every phase of the handler.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.calls = {}
+        self.phases = {}
+        self.phase = None
+        self.phase_start = self.start
+        self.lock = threading.Lock()
+
+    def add_call(self, operation: str, milliseconds: float, bytes_sent: int, bytes_received: int, error: bool, retries: int=0):
+        with self.lock:
+            call = self.calls.setdefault(operation, {
+                'count': 0, 'retries': 0, 'errors': 0, 'milliseconds': 0.0, 'bytes_sent': 0, 'bytes_received': 0
+            })
+            call['count'] += 1
+            call['retries'] += retries
+            call['errors'] += error
+            call['milliseconds'] += milliseconds
+            call['bytes_sent'] += bytes_sent
+            call['bytes_received'] += bytes_received
+
+    def start_phase(self, phase: Optional[str]):
+        now = time.perf_counter()
+        if self.phase:
+            self.phases[self.phase] = self.phases.get(self.phase, 0) + (now - self.phase_start) * 1000
+        self.phase, self.phase_start = phase, now
+
+    def get_record(self, context, response: Optional[Dict], properties: Dict) -> Dict:
+        """
+        Returns the record of the invocation in CloudWatch Embedded Metric Format: the totals by
+        service and the phases are metrics, the calls by operation are only properties of the log.
+        """
+        self.start_phase(None)
+        values = {
+            'Duration': (time.perf_counter() - self.start) * 1000, 'BytesSent': 0, 'BytesReceived': 0,
+            'AWSCallRetries': 0, 'AWSCallErrors': 0
+        }
+        units = {
+            'Duration': 'Milliseconds', 'BytesSent': 'Bytes', 'BytesReceived': 'Bytes',
+            'AWSCallRetries': 'Count', 'AWSCallErrors': 'Count'
+        }
+        for operation, call in self.calls.items():
+            service = METRICS_SERVICE_NAMES.get(operation.split('.')[0], operation.split('.')[0])
+            values[f'{service}Calls'] = values.get(f'{service}Calls', 0) + call['count']
+            values[f'{service}Milliseconds'] = values.get(f'{service}Milliseconds', 0) + call['milliseconds']
+            units[f'{service}Calls'], units[f'{service}Milliseconds'] = 'Count', 'Milliseconds'
+            values['BytesSent'] += call['bytes_sent']
+            values['BytesReceived'] += call['bytes_received']
+            values['AWSCallRetries'] += call['retries']
+            values['AWSCallErrors'] += call['errors']
+        for phase, milliseconds in self.phases.items():
+            name = phase.title().replace('_', '') + 'Milliseconds'
+            values[name], units[name] = milliseconds, 'Milliseconds'
 
-def get_file_dict_from_multipart_body(encoded_body: bytes, content_type: str) -> Dict:
+        function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in values]
+                }]
+            },
+            'FunctionName': function_name,
+            **{name: round(value, 3) for name, value in values.items()},
+            'request_id': getattr(context, 'aws_request_id', None),
+            'status_code': response.get('statusCode') if isinstance(response, dict) else None,
+            'aws_calls': {
+                operation: {**call, 'milliseconds': round(call['milliseconds'], 3)}
+                for operation, call in self.calls.items()
+            },
+            **properties
+        }
+
+def start_phase(phase: str):
+    """
+    Ends the current phase of the handler (if any) and starts another one, e.g. parse, resolve, fetch
+    or serialize. The last phase ends with the invocation.
+    """
+    metrics = _invocation['metrics']
+    if metrics:
+        metrics.start_phase(phase)
+
+def get_request_body_size(body) -> int:
+    """
+    Returns the bytes of the body of a request to AWS (bytes, str or a seekable file-like object).
+    """
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return len(body)
+    if isinstance(body, str):
+        return len(body) if body.isascii() else len(body.encode('utf-8'))
+    try:
+        position = body.tell()
+        size = body.seek(0, 2) - position
+        body.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+def record_call_start(context: Dict, params: Dict=None, **kwargs):
+    if _invocation['metrics']:
+        context['metrics_start'] = time.perf_counter()
+        context['metrics_bytes_sent'] = get_request_body_size((params or {}).get('body'))
+
+def record_attempt(attempts: int, request_dict: Dict, **kwargs):
+    # needs-retry is emitted after every attempt of a call, before the retry handler decides;
+    # the context of the request is the one of before-call and after-call
+    context = request_dict.get('context')
+    if _invocation['metrics'] and context is not None and 'metrics_start' in context:
+        context['metrics_attempts'] = attempts
+
+def record_call_end(event_name: str, context: Dict, model=None, http_response=None, exception=None, **kwargs):
+    metrics = _invocation['metrics']
+    if not metrics or 'metrics_start' not in context:
+        return
+    milliseconds = (time.perf_counter() - context.pop('metrics_start')) * 1000
+    bytes_received = 0
+    # The Content-Length of a HEAD is the size of the object, not of the response
+    if http_response is not None and (model is None or model.http.get('method') != 'HEAD'):
+        bytes_received = int(http_response.headers.get('content-length') or 0)
+    error = exception is not None or (http_response is not None and http_response.status_code >= 400)
+    # after-call.{service}.{operation}
+    operation = '.'.join(event_name.split('.')[1:3])
+    retries = context.pop('metrics_attempts', 1) - 1
+    metrics.add_call(operation, milliseconds, context.pop('metrics_bytes_sent', 0), bytes_received, error, retries)
+
+def register_metrics_hooks(client):
+    """
+    Times and counts every call of a client for the metrics of the invocation. A call is counted
+    once, its milliseconds include the attempts it was retried and their backoff, and its retries
+    are counted apart (the attempts after the first one).
+    """
+    client.meta.events.register('before-call', record_call_start, unique_id='metrics-before-call')
+    client.meta.events.register('needs-retry', record_attempt, unique_id='metrics-needs-retry')
+    client.meta.events.register('after-call', record_call_end, unique_id='metrics-after-call')
+    client.meta.events.register('after-call-error', record_call_end, unique_id='metrics-after-call-error')
+
+
+# CONCURRENCY
+def run_concurrently(function: Callable, items: Iterable, workers: int) -> Iterator[Any]:
+    """
+    Lazily yields the results of calling a function with every item, using a pool of threads.
+    Items are consumed as the workers are free (at most two per worker are waiting), so a long
+    paginated listing is never loaded at once. The results are yielded as they finish.
+    The shared clients are thread-safe, but workers shouldn't exceed CLIENT_MAX_POOL_CONNECTIONS.
+    """
+    workers = max(1, workers)
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(function, item))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+# METADATA CACHE
+class MetadataCache:
+    """
+    Bounded LRU cache of metadata lookups, shared by the invocations of a warm container.
+    Entries are keyed by (bucket, lookup, path) and expire after their own TTL. The cached
+    values are shared, so they must not be modified.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple[str, str, str]) -> Tuple[bool, Any]:
+        """
+        Returns whether the key is cached (and not expired) and its value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: Tuple[str, str, str], value: Any, ttl: float):
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, bucket: str, prefix: str=''):
+        """
+        Removes the entries of a bucket whose path starts with a prefix.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == bucket and key[2].startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations
+            }
+
+_metadata_cache = MetadataCache(METADATA_CACHE_MAX_ENTRIES)
+
+def cached_metadata(lookup: str, path: str, load: Callable[[], Any],
+                    ttl: Callable[[Any], float]=lambda value: METADATA_CACHE_TTL) -> Any:
+    """
+    Returns the cached result of a metadata lookup of BUCKET, or loads it and caches it for ttl(result) seconds.
+    """
+    key = (BUCKET, lookup, path)
+    found, value = _metadata_cache.get(key)
+    if not found:
+        value = load()
+        _metadata_cache.set(key, value, ttl(value))
+    return value
+
+def invalidate_metadata_cache(prefix: str=''):
+    """
+    Forgets the cached lookups under a prefix of BUCKET (e.g. after a write to a contract number).
+    """
+    _metadata_cache.invalidate(BUCKET, prefix)
+
+def get_metadata_cache_stats() -> Dict:
+    return _metadata_cache.stats()
+
+
+# CREATE - UPDATE FILES
+def get_file_dict_from_multipart_body(encoded_body: Union[bytes, str], content_type: str) -> Dict:
     """
     Obtains a dictionary with all the data from a multipart body. 
+    The file is returned as a memoryview of the body (its raw bytes, not encoded in base64).
     """
-    # Get all the parts from the multipart encoded body
-    multi_part = decoder.MultipartDecoder(encoded_body, content_type).parts
+    if isinstance(encoded_body, str):
+        encoded_body = encoded_body.encode('utf-8')
     file_dict = {}
-    for part in multi_part:
-        # Get the header dictionary decoded
-        decoded_headers = decode_dict(part.headers)
-        # Get the value of multipart key 'name'
-        multipart_key = get_multipart_key(decoded_headers['Content-Disposition'], 'name')
-        
-        if multipart_key == 'file':
+    for part in multipart_parser.iter_multipart_parts(encoded_body, content_type):
+        if part.name == 'file':
             # If the part value is the file, get all the information from it
-            filename = get_multipart_key(decoded_headers['Content-Disposition'], 'filename')
-            file_dict['filename'] = filename
-            file_dict['content_type'] = decoded_headers['Content-Type']
-            file_dict[multipart_key] = base64.b64encode(part.content).decode()
+            file_dict['filename'] = part.filename
+            file_dict['content_type'] = part.content_type or 'application/octet-stream'
+            file_dict['file'] = part.content
         else:
-            file_dict[multipart_key] = part.content.decode()
+            file_dict[part.name] = part.content.tobytes().decode()
             
     return file_dict
 
@@ -76,22 +489,435 @@ def get_file_dict_from_event(event: Dict) -> Dict:
             print(e)
             return {}
     elif event['headers']['content-type'].startswith('multipart/form-data'):
-        file_dict = get_file_dict_from_multipart_body(body, event['headers']['content-type'])
+        try:
+            file_dict = get_file_dict_from_multipart_body(body, event['headers']['content-type'])
+        except multipart_parser.MultipartError as e:
+            print(e)
+            return {}
         
     return file_dict
 
+# STORED FILES
+def decode_file(file_dict: Dict) -> Optional[bytes]:
+    """
+    Returns the document of a file dictionary, or None if it isn't valid base64.
+    The 'file' is encoded in base64, unless it comes from a multipart body (a buffer with the document).
+    """
+    if isinstance(file_dict['file'], (bytes, bytearray, memoryview)):
+        return file_dict['file']
+    try:
+        return base64.b64decode(file_dict['file'], validate=True)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+def get_raw_file_metadata(filename: str, content_type: str) -> Dict:
+    """
+    Returns the metadata of a file stored in RAW_FORMAT. Metadata values have to be ascii,
+    so they are url-encoded.
+    """
+    return {
+        'encoded_content_type': RAW_FORMAT,
+        'filename': quote(filename),
+        'content_type': quote(content_type)
+    }
+
+class StoredDocument(NamedTuple):
+    """
+    The bytes a file dictionary is stored as: the document itself (RAW_FORMAT) or, if the file
+    isn't valid base64, the json it was received as (ENVELOPE_FORMAT); and their digest.
+    """
+    document: Union[bytes, memoryview]
+    is_raw: bool
+    sha256: str
+
+    @property
+    def file_format(self) -> str:
+        return RAW_FORMAT if self.is_raw else ENVELOPE_FORMAT
+
+def get_stored_document(file_dict: Dict) -> StoredDocument:
+    document = decode_file(file_dict)
+    if document is None:
+        envelope = json.dumps(file_dict).encode('utf-8')
+        return StoredDocument(envelope, False, get_digest(envelope))
+    return StoredDocument(document, True, get_digest(document))
+
+def get_digest(document: Union[bytes, memoryview]) -> str:
+    """
+    Returns the SHA-256 digest (hex) of the content of a version, saved in the 'sha256' metadata key.
+    """
+    return hashlib.sha256(document).hexdigest()
+
+def get_object_digest(response: Dict) -> Optional[str]:
+    """
+    Returns the digest of a stored version from a head_object/get_object response: its 'sha256'
+    metadata or, for the versions copied from the temp bucket, the SHA-256 checksum computed by S3
+    (only returned with ChecksumMode='ENABLED'). Checksums of multipart objects ('...-N') are
+    checksums of the parts, not of the content, so they are ignored.
+    """
+    digest = get_object_metadata(response).get('sha256')
+    if digest:
+        return digest
+    checksum = response.get('ChecksumSHA256')
+    if checksum and '-' not in checksum:
+        return base64.b64decode(checksum).hex()
+    return None
+
+def put_file(s3_key: str, file_dict: Dict, stored_document: Optional[StoredDocument] = None, **condition) -> Tuple[int, str]:
+    """
+    Stores a file dictionary (filename, content_type and file in base64) and returns the size
+    of the stored object and the digest of its content.
+    The document is stored in RAW_FORMAT; if the file isn't valid base64 it's stored as it was
+    received, in ENVELOPE_FORMAT, so _get returns exactly what was sent.
+    `stored_document` is the result of get_stored_document, if the caller already has it, and
+    `condition` the conditional headers of the put (e.g. IfNoneMatch='*').
+    """
+    document, is_raw, digest = stored_document or get_stored_document(file_dict)
+    if not is_raw:
+        get_client('s3').put_object(
+            Bucket=BUCKET, Key=s3_key, Body=document,
+            Metadata={'encoded_content_type': ENVELOPE_FORMAT, 'sha256': digest},
+            **condition
+        )
+        return len(document), digest
+    
+    put_raw_file(s3_key, document, file_dict['filename'], file_dict['content_type'], digest, **condition)
+    return len(document), digest
+
+def put_raw_file(s3_key: str, document: Union[bytes, memoryview], filename: str, content_type: str,
+                 sha256: Optional[str] = None, **condition) -> str:
+    """
+    Stores a document in RAW_FORMAT, compressed if it's worth it, and returns its digest
+    (`sha256`, if the caller already has it).
+    Buffers are uploaded through a reader, without copying them.
+    """
+    metadata = get_raw_file_metadata(filename, content_type)
+    # The digest is the one of the document, even if it's stored compressed
+    metadata['sha256'] = sha256 or get_digest(document)
+    put_kwargs = {}
+    if content_type.isascii():
+        put_kwargs['ContentType'] = content_type
+    compressed_document, content_encoding = compress_document(document, content_type)
+    if content_encoding:
+        metadata['content_encoding'] = content_encoding
+        metadata['uncompressed_size'] = str(len(document))
+        put_kwargs['ContentEncoding'] = content_encoding
+        document = compressed_document
+    if isinstance(document, memoryview):
+        document = multipart_parser.BufferReader(document)
+    get_client('s3').put_object(
+        Bucket=BUCKET, Key=s3_key, Body=document,
+        Metadata=metadata,
+        ContentDisposition=f"inline; filename*=UTF-8''{quote(filename)}",
+        **put_kwargs, **condition
+    )
+    return metadata['sha256']
+
+def put_compressed_file(s3_key: str, chunks: Iterable[bytes], size: int, filename: str, content_type: str,
+                        algorithm: Optional[str] = None) -> Optional[str]:
+    """
+    Stores a document in RAW_FORMAT, compressed while its chunks are read (e.g. the body of a
+    get_object response), and returns its digest. Only the compressed document is kept in memory.
+    Returns None, without storing anything, if compressing it doesn't save COMPRESSION_MIN_SAVING.
+    """
+    compressor, content_encoding = get_compressor(COMPRESSION_ALGORITHM if algorithm is None else algorithm)
+    if not compressor:
+        return None
+    digest = hashlib.sha256()
+    compressed_document = bytearray()
+    for chunk in chunks:
+        digest.update(chunk)
+        compressed_document += compressor.compress(chunk)
+        if len(compressed_document) > size * (1 - COMPRESSION_MIN_SAVING):
+            return None
+    compressed_document += compressor.flush()
+    if len(compressed_document) > size * (1 - COMPRESSION_MIN_SAVING):
+        return None
+    
+    metadata = get_raw_file_metadata(filename, content_type)
+    metadata.update({
+        'sha256': digest.hexdigest(), 'content_encoding': content_encoding, 'uncompressed_size': str(size)
+    })
+    put_kwargs = {'ContentType': content_type} if content_type.isascii() else {}
+    get_client('s3').put_object(
+        Bucket=BUCKET, Key=s3_key, Body=multipart_parser.BufferReader(memoryview(compressed_document)),
+        Metadata=metadata, ContentEncoding=content_encoding,
+        ContentDisposition=f"inline; filename*=UTF-8''{quote(filename)}",
+        **put_kwargs
+    )
+    return metadata['sha256']
+
+def get_zstandard():
+    """
+    Returns the zstandard module, or None if it isn't installed (it's an optional dependency).
+    """
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+def copy_file(source_bucket: str, s3_key: str, size: int, metadata: Dict, **copy_kwargs) -> Optional[str]:
+    """
+    Copies an object of another bucket to the same key of BUCKET, replacing its metadata, and
+    returns the digest of its content. `copy_kwargs` may have the conditions of the source
+    (e.g. CopySourceIfMatch), a PreconditionFailed error is raised if they fail.
+    The copy is done by S3 (the bytes never go through the function), which also computes the
+    SHA-256 checksum of the copy; objects bigger than 5gb are copied with a multipart copy,
+    whose checksum isn't a digest of the content, so None is returned for them.
+    """
+    copy_source = {'Bucket': source_bucket, 'Key': s3_key}
+    copy_kwargs.update({'Metadata': metadata, 'MetadataDirective': 'REPLACE', 'ChecksumAlgorithm': 'SHA256'})
+    if size <= MAX_COPY_OBJECT_SIZE:
+        resp = get_client('s3').copy_object(CopySource=copy_source, Bucket=BUCKET, Key=s3_key, **copy_kwargs)
+        return get_object_digest(resp.get('CopyObjectResult', {}))
+    managed_copy(copy_source, BUCKET, s3_key, copy_kwargs,
+                 multipart_threshold=MAX_COPY_OBJECT_SIZE, multipart_chunksize=COPY_PART_SIZE)
+    return None
+
+def managed_copy(copy_source: Dict, bucket: str, s3_key: str, extra_args: Dict, **transfer_config):
+    """
+    Copies an object with a managed transfer (a multipart copy for big objects), like the copy of
+    boto3's clients. s3transfer is imported here, the first time it's needed, instead of when the
+    module is loaded.
+    """
+    from s3transfer.manager import TransferConfig, TransferManager
+    
+    with TransferManager(get_client('s3'), TransferConfig(**transfer_config)) as manager:
+        manager.copy(copy_source, bucket, s3_key, extra_args=extra_args).result()
+
+def is_compressible(content_type: str) -> bool:
+    return not any(content_type.startswith(incompressible) for incompressible in INCOMPRESSIBLE_CONTENT_TYPES)
+
+def should_compress(size: int, content_type: str, algorithm: Optional[str] = None) -> bool:
+    """
+    Checks if a document would be compressed: compression enabled, big enough and not already compressed.
+    """
+    algorithm = COMPRESSION_ALGORITHM if algorithm is None else algorithm
+    return bool(algorithm) and size >= COMPRESSION_MIN_SIZE and is_compressible(content_type)
+
+def compress_document(document: Union[bytes, memoryview], content_type: str,
+                      algorithm: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Returns the compressed document and its encoding, or (None, None) if the document shouldn't be
+    compressed (compression disabled, small or already compressed documents, or not enough saving).
+    """
+    algorithm = COMPRESSION_ALGORITHM if algorithm is None else algorithm
+    if not should_compress(len(document), content_type, algorithm):
+        return None, None
+    
+    if algorithm == 'zstd' and get_zstandard():
+        compressed_document = get_zstandard().ZstdCompressor(level=COMPRESSION_LEVEL).compress(document)
+    else:
+        compressor, algorithm = get_compressor(algorithm)
+        if not compressor:
+            return None, None
+        compressed_document = compressor.compress(document) + compressor.flush()
+    
+    if len(compressed_document) > len(document) * (1 - COMPRESSION_MIN_SAVING):
+        return None, None
+    return compressed_document, algorithm
+
+def get_compressor(algorithm: str) -> Tuple[Any, Optional[str]]:
+    """
+    Returns an object with the compress and flush methods (like zlib's compressobj) for an
+    algorithm and the encoding it produces (gzip if zstandard isn't installed), or (None, None)
+    if the algorithm is unknown.
+    """
+    if algorithm == 'zstd':
+        zstandard = get_zstandard()
+        if zstandard:
+            return zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compressobj(), 'zstd'
+        print('zstandard is not installed, the document is compressed with gzip.')
+        algorithm = 'gzip'
+    if algorithm == 'gzip':
+        return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31), 'gzip'
+    print(f'Unknown compression algorithm: {algorithm}')
+    return None, None
+
+def get_decompressor(content_encoding: str):
+    """
+    Returns an object with the decompress method (like zlib's decompressobj) for an encoding.
+    """
+    if content_encoding == 'gzip':
+        return zlib.decompressobj(31)
+    if content_encoding == 'zstd':
+        zstandard = get_zstandard()
+        if not zstandard:
+            raise RuntimeError('zstandard is required to read documents compressed with zstd.')
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f'Unknown content encoding: {content_encoding}')
+
+def read_document(response: Dict, metadata: Dict) -> bytes:
+    """
+    Reads the document of a get_object response, decompressing it chunk by chunk if it was compressed.
+    """
+    content_encoding = metadata.get('content_encoding')
+    if not content_encoding:
+        return response['Body'].read()
+    
+    decompressor = get_decompressor(content_encoding)
+    document = bytearray()
+    for chunk in response['Body'].iter_chunks(1024 * 1024):
+        document += decompressor.decompress(chunk)
+    if hasattr(decompressor, 'flush'):
+        document += decompressor.flush()
+    return bytes(document)
+
+def get_object_metadata(response: Dict) -> Dict:
+    """
+    Returns the user metadata of a head_object/get_object response. Some S3 implementations
+    return the underscores of the metadata keys as hyphens, so they are normalized.
+    """
+    return {key.replace('-', '_'): value for key, value in response.get('Metadata', {}).items()}
+
+def is_raw_format(metadata: Dict) -> bool:
+    """
+    Checks if the metadata of an object belongs to a file stored in RAW_FORMAT.
+    """
+    return metadata.get('encoded_content_type') == RAW_FORMAT
+
+def get_inline_response_size(content_length: int, metadata: Dict) -> int:
+    """
+    Returns the approximate size of a stored file once it's encoded inside a _get response.
+    Files in RAW_FORMAT grow by a third when they are encoded in base64
+    (compressed files are decompressed before).
+    """
+    if is_raw_format(metadata):
+        return (get_document_size(content_length, metadata) + 2) // 3 * 4
+    return content_length
+
+def get_document_size(content_length: int, metadata: Dict) -> int:
+    """
+    Returns the size of the document of a stored object (the size of the manifests): the size it
+    had before it was compressed, or the size of the object itself.
+    """
+    if metadata.get('uncompressed_size'):
+        return int(metadata['uncompressed_size'])
+    return content_length
+
+def get_presigned_get_url(s3_key: str) -> str:
+    """
+    Returns a presigned url to download a stored file, for files too big to be returned inside a response.
+    """
+    return get_client('s3').generate_presigned_url('get_object', Params={
+        'Bucket': BUCKET, 'Key': s3_key
+    }, ExpiresIn=PRESIGNED_URL_EXPIRATION)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Checks if an If-None-Match header (a list of ETags, weak or strong, or '*') matches the ETag of an object.
+    """
+    for client_etag in if_none_match.split(','):
+        client_etag = client_etag.strip()
+        if client_etag.startswith('W/'):
+            client_etag = client_etag[2:]
+        if client_etag == '*' or client_etag.strip('"') == etag.strip('"'):
+            return True
+    return False
+
+def get_file_response_body(filename: str, content_type: str, file: Union[bytes, str]) -> str:
+    """
+    Returns the same body json.dumps would for a _get response ({content_type, filename, file}),
+    without serializing the file again: the file (ascii base64) is only concatenated.
+    """
+    if isinstance(file, bytes):
+        file = file.decode('ascii')
+    return ''.join([
+        '{"content_type": ', json.dumps(content_type), ', "filename": ', json.dumps(filename),
+        ', "file": "', file, '"}'
+    ])
+
+def get_envelope_file_span(envelope: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Returns where the value of the file starts and ends inside an envelope, or None if it
+    can't be sliced as it is (it's not a string, or it has escaped characters).
+    Only the "file" key of the envelope itself is sliced, not the keys with the same name of nested objects.
+    """
+    try:
+        span = json_scanner.get_string_value_span(envelope, 'file')
+    except json_scanner.JsonScanError:
+        return None
+    if not span or envelope.find(b'\\', *span) != -1:
+        return None
+    return span
+
+def get_response_body_from_s3_response(response: Dict) -> str:
+    """
+    Returns the body of a _get response from a get_object response.
+    The file is never parsed nor serialized as json: raw files are only encoded in base64 and the
+    file of an envelope is sliced from the stored bytes (only the rest of the envelope is parsed).
+    """
+    metadata = get_object_metadata(response)
+    if is_raw_format(metadata):
+        return get_file_response_body(
+            unquote(metadata.get('filename', '')), unquote(metadata.get('content_type', '')),
+            base64.b64encode(read_document(response, metadata))
+        )
+    
+    body = response['Body'].read()
+    
+    span = get_envelope_file_span(body)
+    if span:
+        start, end = span
+        try:
+            file = str(memoryview(body)[start:end], 'ascii')
+            json_file = json.loads(body[:start] + body[end:])
+            return get_file_response_body(json_file['filename'], json_file['content_type'], file)
+        except (ValueError, KeyError):
+            pass
+    
+    # Envelopes that can't be sliced
+    json_file = json.loads(body.decode('utf-8'))
+    return json.dumps({
+        'content_type': json_file['content_type'],
+        'filename': json_file['filename'],
+        'file': json_file['file']
+    })
+
 # ---
 
+def get_new_version_id() -> str:
+    """
+    Returns a new version id (VERSION_ID_FORMAT) from the current time. The ids returned by a
+    container are strictly increasing, even if the clock goes back or many are asked in the same
+    microsecond; the writers of different containers are kept apart by conditional writes.
+    """
+    with _version_id_lock:
+        version_id = datetime.now().strftime(VERSION_ID_FORMAT)
+        last_version_id = _last_version_id['version_id']
+        if version_id <= last_version_id:
+            version_id = (datetime.strptime(last_version_id, VERSION_ID_FORMAT) + timedelta(microseconds=1)).strftime(VERSION_ID_FORMAT)
+        _last_version_id['version_id'] = version_id
+    return version_id
+
 def get_new_s3_key(root_folder_s3: str) -> str:
     """
     Returns a new s3 key version, based on the root folder and the current time
     (which is composed by the contract and the filename.)
     """
-    version = datetime.now().strftime(DATETIME_FORMAT)
+    version = get_new_version_id()
 
     s3_key = f"{root_folder_s3}/{version}.txt"
     return s3_key
 
+def put_new_version(root_folder_s3: str, file_dict: Dict,
+                    stored_document: Optional[StoredDocument] = None) -> Tuple[str, int, str]:
+    """
+    Stores a file dictionary as a new version of a file and returns its s3 key, its size and its digest.
+    The version is written only if its key doesn't exist yet (If-None-Match: *), so concurrent
+    writers never overwrite each other: if another one took the version id, a new one is tried.
+    """
+    stored_document = stored_document or get_stored_document(file_dict)
+    for attempt in range(VERSION_WRITE_ATTEMPTS):
+        s3_key = get_new_s3_key(root_folder_s3)
+        try:
+            stored_size, digest = put_file(s3_key, file_dict, stored_document, IfNoneMatch='*')
+            return s3_key, stored_size, digest
+        except ClientError as e:
+            if e.response['Error']['Code'] not in CONDITIONAL_WRITE_ERRORS or attempt == VERSION_WRITE_ATTEMPTS - 1:
+                raise
+            print(f'{s3_key} was stored by another writer, trying a new version id.')
+
 def get_body_dict_from_event(event: Dict) -> Union[Dict, bool]:
     """
     Get the dictionary of the request body.
@@ -121,81 +947,531 @@ def folder_exists_and_not_empty(path:str) -> bool:
     """
     Check that a folder exists and is not empty
     """
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     if not path.endswith('/'):
         path = path + '/' 
-    print(f"-------EL BUCKET ES:{BUCKET}")
     resp = s3.list_objects(Bucket=BUCKET, Prefix=path, Delimiter='/', MaxKeys=1)
     return 'Contents' in resp
 
-def get_versions_of_file(contract_number: str, filename: str, max_index: bool=False) -> List:
+def get_version_id_from_key(s3_key: str) -> str:
     """
-    Return all the versions of an object.
+    Returns the version of a file from its s3 key ({contract_number}/{filename}/{version}.txt).
     """
-    s3_client = boto3.client('s3')
-    prefix = f"{contract_number}/{filename}/"
-    response = s3_client.list_objects_v2(
-        Bucket=BUCKET, Prefix=prefix
-    )
-    versions = []
-    dates = []
-    
-    if 'Contents' not in response:
-        return False
+    return s3_key.split('/')[-1].split('.')[0]
 
-    for i, version in enumerate(response['Contents']):
-        version_id = version['Key'].split('/')[-1].split('.')[0]
-        is_archived = False
-        if version['StorageClass'] in ['GLACIER', 'GLACIER_IR']:
-            is_archived = True
-        version = {
-            'version_id': version_id,
-            'last_modified': version['LastModified'].strftime('%Y-%m-%d %H:%M:%S'),
-            'archived': is_archived,
-            'size': version['Size'],
-            'is_latest': False
-        }
-        dates.append([i, datetime.strptime(version_id, DATETIME_FORMAT)])
-        versions.append(version)
-    
-    # Obtener el index de la fecha máxima
-    latest_index = max(dates, key=lambda x: x[1])[0]
-    # Modificar el parametro del archivo con la versión más reciente
-    versions[latest_index]['is_latest'] = True
-    
-    if max_index:
-        return versions, latest_index
-        
-    return versions
+class FileVersion(NamedTuple):
+    """
+    Compact record of a version of a file.
+    """
+    version_id: str
+    last_modified: datetime
+    size: int
+    storage_class: str
+    sha256: Optional[str] = None
 
-def get_latest_version(contract_number: str, filename: str) -> str:
+def format_file_version(version: FileVersion, is_latest: bool=False) -> Dict:
     """
-    Get latest version of a file.
+    Returns the dictionary of a version of a file, as it's shown to the user.
     """
-    versions, max_index = get_versions_of_file(contract_number, filename, max_index=True)
-    latest_version = versions[max_index]['version_id']
-    
-    return latest_version
+    return {
+        'version_id': version.version_id,
+        'last_modified': version.last_modified.strftime('%Y-%m-%d %H:%M:%S'),
+        'archived': version.storage_class in ['GLACIER', 'GLACIER_IR'],
+        'size': version.size,
+        'sha256': version.sha256,
+        'is_latest': is_latest
+    }
+
+def get_latest_version_object(contract_number: str, filename: str, cached: bool=False) -> Union[Dict, bool]:
+    """
+    Returns the listing entry (Key, Size, StorageClass, ...) of the latest version of a file,
+    or False if the file doesn't exist.
+    Version names (VERSION_ID_FORMAT or DATETIME_FORMAT) sort lexicographically and S3 lists keys in that order,
+    so the latest version is the last key listed: files with up to 1000 versions are resolved
+    with a single request, without parsing the dates of every version.
+    The listing of bigger files starts at the latest version of the manifest instead of paging
+    through all the versions (the versions stored after it are still found).
+    - cached: the result may be up to METADATA_CACHE_TTL seconds old (only for the reads,
+      never before a write or a delete).
+    """
+    if cached:
+        return cached_metadata(
+            'latest', f"{contract_number}/{filename}/", lambda: get_latest_version_object(contract_number, filename)
+        )
+    s3_client = get_client('s3')
+    prefix = f"{contract_number}/{filename}/"
+    list_kwargs = {'Bucket': BUCKET, 'Prefix': prefix, 'Delimiter': '/'}
+    resp = s3_client.list_objects_v2(**list_kwargs)
+    if not resp.get('Contents'):
+        return False
+    latest_object = resp['Contents'][-1]
+    if not resp.get('IsTruncated'):
+        return latest_object
+
+    file_entry = get_manifest(contract_number)['files'].get(filename)
+    if file_entry and file_entry['latest'] > get_version_id_from_key(latest_object['Key']):
+        # '{version}' is listed after the keys of the older versions and right before '{version}.txt'
+        skipped_resp = s3_client.list_objects_v2(**list_kwargs, StartAfter=f"{prefix}{file_entry['latest']}")
+        # If the version of the manifest was deleted, the versions before it are listed page by page
+        if skipped_resp.get('Contents'):
+            resp = skipped_resp
+            latest_object = resp['Contents'][-1]
+    while resp.get('IsTruncated'):
+        resp = s3_client.list_objects_v2(**list_kwargs, ContinuationToken=resp['NextContinuationToken'])
+        if resp.get('Contents'):
+            latest_object = resp['Contents'][-1]
+    return latest_object
 
 def key_exists_in_bucket(s3_key: str) -> Union[Dict, bool]:
     """
     Checks if a key exists in a bucket.
+    It's never cached: the versions can be deleted by other containers, and it's checked before
+    deleting them.
     """
-    s3_client = boto3.client('s3')
     try:
-        resp = s3_client.head_object(Bucket=BUCKET, Key=s3_key)
+        return get_client('s3').head_object(Bucket=BUCKET, Key=s3_key)
     except ClientError as e:
         print(e.response['Error'])
         return False
-    return resp
 
-def get_filenames_in_contract_number(contract_number:str) -> Union[Dict, bool]:
+def iter_objects_in_contract_number(contract_number: str, page_size: int=1000) -> Iterator[Dict]:
     """
-    Get filenames that are in a contract_number
+    Lazily yields the listing entries of every object stored under a contract number
+    (all the versions of all its files), using a single paginated listing.
     """
-    s3 = boto3.client('s3')
     if not contract_number.endswith('/'):
-        contract_number = contract_number + '/' 
-    resp = s3.list_objects_v2(Bucket=BUCKET, Prefix=contract_number, Delimiter='/')
+        contract_number = contract_number + '/'
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=BUCKET, Prefix=contract_number, PaginationConfig={'PageSize': page_size})
+    for page in pages:
+        yield from page.get('Contents', [])
+
+
+
+# MANIFESTS
+# Every contract has a manifest object (MANIFEST_PREFIX/{contract_number}.json) with all its files
+# and versions, so the read endpoints can answer with a single GET instead of listing the contract:
+# {
+#     "schema_version": 1,
+#     "contract_number": "C1",
+#     "updated_at": 1634560000.0,
+#     "rebuilt_at": 1634500000.0,
+#     "files": {
+#         "filename": {
+#             "latest": "20211018_120000",
+#             "versions": {
+#                 "20211018_120000": {"size": 1024, "storage_class": "STANDARD", "last_modified": "2021-10-18T12:00:00+00:00",
+#                                     "sha256": "9f86d0...", "format": "application/octet-stream"}
+#             }
+#         }
+#     }
+# }
+# The writers update it with conditional PUTs (If-Match the ETag that was read), and the readers
+# rebuild it from the listing of the contract when it's missing, has another schema or is stale
+# ("rebuilt_at" is only set by the rebuilds, so the manifests of busy contracts are rebuilt too).
+# The sizes are the ones of the documents (before they are compressed), and the digests ("sha256") and
+# the formats (RAW_FORMAT or ENVELOPE_FORMAT) are set by the writers. The listing has none of them, so a
+# rebuild keeps the ones of the previous manifest, and the versions it doesn't have get the size of the
+# stored object and no format until the next reads fill them in from their metadata (MANIFEST_FILL_BATCH
+# at a time). A rebuild is only a listing, so it's saved even for contracts with many versions.
+# The creates store the first version of a file before adding it to the manifest, so a version is
+# always in the listing before it's in the manifest, and a rebuild never loses a file that was created.
+def get_manifest_key(contract_number: str) -> str:
+    """
+    Returns the s3 key of the manifest of a contract number.
+    """
+    return f"{MANIFEST_PREFIX}/{contract_number}.json"
+
+def new_manifest(contract_number: str) -> Dict:
+    """
+    Returns an empty manifest.
+    """
+    return {
+        'schema_version': MANIFEST_SCHEMA_VERSION,
+        'contract_number': contract_number,
+        'updated_at': time.time(),
+        'rebuilt_at': time.time(),
+        'files': {}
+    }
+
+def add_version_to_manifest(manifest: Dict, filename: str, version_id: str, size: int,
+                            storage_class: str='STANDARD', last_modified: datetime=None, sha256: str=None,
+                            file_format: str=None):
+    """
+    Adds (or replaces) a version of a file in a manifest. Versions without `file_format` are
+    filled in by the next reads (fill_manifest_details).
+    """
+    last_modified = last_modified or datetime.now(timezone.utc)
+    file_entry = manifest['files'].setdefault(filename, {'latest': version_id, 'versions': {}})
+    file_entry['versions'][version_id] = {
+        'size': size,
+        'storage_class': storage_class,
+        'last_modified': last_modified.replace(microsecond=0).isoformat()
+    }
+    if sha256:
+        file_entry['versions'][version_id]['sha256'] = sha256
+    if file_format:
+        file_entry['versions'][version_id]['format'] = file_format
+    if version_id > file_entry['latest']:
+        file_entry['latest'] = version_id
+
+def remove_version_from_manifest(manifest: Dict, filename: str, version_id: str):
+    """
+    Removes a version of a file from a manifest. The file is removed when it has no versions left.
+    """
+    file_entry = manifest['files'].get(filename)
+    if not file_entry:
+        return
+    file_entry['versions'].pop(version_id, None)
+    if not file_entry['versions']:
+        del manifest['files'][filename]
+    elif file_entry['latest'] == version_id:
+        file_entry['latest'] = max(file_entry['versions'])
+
+def get_stored_version_details(s3_key: str) -> Optional[Tuple[str, int, Optional[str], str]]:
+    """
+    Returns the key of a stored version with the size of its document, its digest and its format,
+    read from its metadata; or None if it can't be read.
+    """
+    try:
+        resp = get_client('s3').head_object(Bucket=BUCKET, Key=s3_key)
+    except ClientError as e:
+        print(e.response['Error'])
+        return None
+    metadata = get_object_metadata(resp)
+    return (
+        s3_key, get_document_size(resp['ContentLength'], metadata), get_object_digest(resp),
+        metadata.get('encoded_content_type', ENVELOPE_FORMAT)
+    )
+
+def build_manifest_from_listing(contract_number: str, previous_manifest: Optional[Dict]=None) -> Dict:
+    """
+    Builds the manifest of a contract number from the listing of all its objects, without reading
+    any of them. The details (size, digest and format) of the versions are kept from the previous
+    manifest; the versions it doesn't have get the size of the stored object (compressed or not)
+    until fill_manifest_details reads their metadata.
+    """
+    manifest = new_manifest(contract_number)
+    previous_files = {}
+    if previous_manifest and previous_manifest.get('schema_version') == MANIFEST_SCHEMA_VERSION:
+        previous_files = previous_manifest['files']
+    for s3_object in iter_objects_in_contract_number(contract_number):
+        key_parts = s3_object['Key'].split('/')
+        # Only the versions ({contract_number}/{filename}/{version}.txt) are files
+        if len(key_parts) != 3:
+            continue
+        version_id = get_version_id_from_key(s3_object['Key'])
+        previous_version = previous_files.get(key_parts[1], {}).get('versions', {}).get(version_id, {})
+        add_version_to_manifest(
+            manifest, key_parts[1], version_id, previous_version.get('size', s3_object['Size']),
+            s3_object['StorageClass'], s3_object['LastModified'], previous_version.get('sha256'),
+            previous_version.get('format')
+        )
+    return manifest
+
+def fill_manifest_details(manifest: Dict) -> bool:
+    """
+    Reads the metadata (HEAD) of up to MANIFEST_FILL_BATCH versions of a manifest that have no
+    format (rebuilt from the listing) and sets their size, digest and format.
+    Returns whether the manifest changed.
+    """
+    s3_keys = []
+    for filename, file_entry in manifest['files'].items():
+        for version_id, version in file_entry['versions'].items():
+            if 'format' not in version:
+                s3_keys.append(f"{manifest['contract_number']}/{filename}/{version_id}.txt")
+                if len(s3_keys) >= MANIFEST_FILL_BATCH:
+                    break
+        if len(s3_keys) >= MANIFEST_FILL_BATCH:
+            break
+    changed = False
+    for details in run_concurrently(get_stored_version_details, s3_keys, MANIFEST_REBUILD_WORKERS):
+        if not details:
+            continue
+        s3_key, size, sha256, file_format = details
+        version = manifest['files'][s3_key.split('/')[1]]['versions'][get_version_id_from_key(s3_key)]
+        version.update({'size': size, 'format': file_format})
+        if sha256:
+            version['sha256'] = sha256
+        changed = True
+    return changed
+
+def manifest_is_stale(manifest: Dict) -> bool:
+    """
+    Checks if a manifest has to be rebuilt from the listing: it has another schema or it hasn't
+    been rebuilt in MANIFEST_MAX_AGE seconds (e.g. lifecycle rules changed the storage classes).
+    The writes don't refresh it, they only add what they changed.
+    """
+    if manifest.get('schema_version') != MANIFEST_SCHEMA_VERSION:
+        return True
+    return time.time() - manifest.get('rebuilt_at', 0) > MANIFEST_MAX_AGE
+
+def load_manifest(contract_number: str) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Returns the stored manifest of a contract number and its ETag, or (None, None) if it doesn't exist.
+    """
+    s3_client = get_client('s3')
+    try:
+        resp = s3_client.get_object(Bucket=BUCKET, Key=get_manifest_key(contract_number))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+            return None, None
+        raise
+    return json.loads(resp['Body'].read()), resp['ETag']
+
+def save_manifest(manifest: Dict, etag: Optional[str]) -> bool:
+    """
+    Stores a manifest only if it hasn't changed since it was read (its ETag is still `etag`),
+    or if it still doesn't exist when `etag` is None.
+    Returns False if another writer changed the manifest first.
+    """
+    s3_client = get_client('s3')
+    manifest['updated_at'] = time.time()
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3_client.put_object(
+            Bucket=BUCKET, Key=get_manifest_key(manifest['contract_number']),
+            Body=json.dumps(manifest, separators=(',', ':')), ContentType='application/json',
+            **condition
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] in CONDITIONAL_WRITE_ERRORS:
+            return False
+        raise
+    return True
+
+def load_fresh_manifest(contract_number: str) -> Tuple[Dict, Optional[str], bool]:
+    """
+    Returns the manifest of a contract number, its ETag and whether it was rebuilt from the listing
+    because the stored one was missing or stale.
+    """
+    manifest, etag = load_manifest(contract_number)
+    if manifest is None or manifest_is_stale(manifest):
+        return build_manifest_from_listing(contract_number, manifest), etag, True
+    return manifest, etag, False
+
+def get_manifest(contract_number: str, cached: bool=False) -> Dict:
+    """
+    Returns the manifest of a contract number. If it has to be rebuilt, or some of its versions were
+    filled in, it's stored for the next requests (unless another writer stores one first).
+    - cached: the manifest may be up to METADATA_CACHE_TTL seconds old (only for the reads, never
+      to update it or before a write). Cached manifests are shared, so they must not be modified.
+    """
+    if cached:
+        return cached_metadata('manifest', f"{contract_number}/", lambda: get_manifest(contract_number))
+    manifest, etag, rebuilt = load_fresh_manifest(contract_number)
+    filled = fill_manifest_details(manifest)
+    if (rebuilt and manifest['files']) or filled:
+        try:
+            save_manifest(manifest, etag)
+        except ClientError as e:
+            print(e.response['Error'])
+    return manifest
+
+def wait_before_manifest_retry(attempt: int):
+    """
+    Waits a random, growing time before retrying a manifest update that lost against another
+    writer, so many concurrent writers of a contract spread out instead of colliding again.
+    """
+    if attempt:
+        time.sleep(random.uniform(0, min(MANIFEST_RETRY_MAX_DELAY, 0.02 * 2**attempt)))
+
+def update_manifest(contract_number: str, update: Callable[[Dict], None]) -> bool:
+    """
+    Applies `update` to the manifest of a contract number and stores it, retrying if another
+    writer changes the manifest at the same time.
+    The files are already stored when this is called, so errors are logged instead of raised;
+    if the manifest can't be updated it's deleted, and the next reader rebuilds it.
+    Every write (create, update, delete, dismiss) updates the manifest, so the cached lookups
+    of the contract are forgotten here.
+    """
+    invalidate_metadata_cache(f'{contract_number}/')
+    try:
+        for attempt in range(MANIFEST_UPDATE_ATTEMPTS):
+            wait_before_manifest_retry(attempt)
+            manifest, etag, _ = load_fresh_manifest(contract_number)
+            update(manifest)
+            if save_manifest(manifest, etag):
+                return True
+        print(f'The manifest of {contract_number} could not be updated, it will be rebuilt.')
+        get_client('s3').delete_object(Bucket=BUCKET, Key=get_manifest_key(contract_number))
+    except ClientError as e:
+        print(e.response['Error'])
+    return False
+
+def add_key_to_manifest(s3_key: str, size: int, storage_class: str='STANDARD', sha256: str=None,
+                        file_format: str=None):
+    """
+    Adds a new stored version ({contract_number}/{filename}/{version}.txt) to the manifest of its contract.
+    """
+    contract_number, filename, _ = s3_key.split('/')
+    version_id = get_version_id_from_key(s3_key)
+    update_manifest(
+        contract_number,
+        lambda manifest: add_version_to_manifest(
+            manifest, filename, version_id, size, storage_class, sha256=sha256, file_format=file_format
+        )
+    )
+
+def add_new_file_to_manifest(s3_key: str, size: int, sha256: str=None, file_format: str=None,
+                             manifest: Optional[Dict]=None, etag: Optional[str]=None) -> Optional[bool]:
+    """
+    Adds the first version of a new file, already stored, to the manifest of its contract, which is
+    the marker of the files that exist. The manifest is saved with a conditional PUT, so if many
+    writers create the same file at the same time S3 accepts only one of them, and the others find
+    the file when they read the manifest again.
+    Returns False if the file has another version (the caller has to delete its own), or None if the
+    manifest couldn't be saved: it's deleted, and the next reader rebuilds it from the listing,
+    which already has the version.
+    - manifest, etag: the manifest the caller already loaded (load_fresh_manifest), for the first attempt.
+    """
+    contract_number, filename, _ = s3_key.split('/')
+    version_id = get_version_id_from_key(s3_key)
+    invalidate_metadata_cache(f'{contract_number}/')
+    try:
+        for attempt in range(MANIFEST_UPDATE_ATTEMPTS):
+            wait_before_manifest_retry(attempt)
+            if manifest is None:
+                manifest, etag, _ = load_fresh_manifest(contract_number)
+            # A manifest rebuilt from the listing may already have this version
+            if set(manifest['files'].get(filename, {}).get('versions', {})) - {version_id}:
+                return False
+            add_version_to_manifest(manifest, filename, version_id, size, sha256=sha256, file_format=file_format)
+            if save_manifest(manifest, etag):
+                return True
+            manifest = None
+        print(f'The manifest of {contract_number} could not be updated to create {filename}, it will be rebuilt.')
+        get_client('s3').delete_object(Bucket=BUCKET, Key=get_manifest_key(contract_number))
+    except ClientError as e:
+        print(e.response['Error'])
+    return None
+
+def remove_key_from_manifest(s3_key: str):
+    """
+    Removes a deleted version ({contract_number}/{filename}/{version}.txt) from the manifest of its contract.
+    """
+    contract_number, filename, _ = s3_key.split('/')
+    version_id = get_version_id_from_key(s3_key)
+    update_manifest(
+        contract_number,
+        lambda manifest: remove_version_from_manifest(manifest, filename, version_id)
+    )
+
+def remove_keys_from_manifest(contract_number: str, s3_keys: List[str]):
+    """
+    Removes many deleted versions of a contract from its manifest, with a single update.
+    """
+    def update(manifest: Dict):
+        for s3_key in s3_keys:
+            key_parts = s3_key.split('/')
+            if len(key_parts) == 3:
+                remove_version_from_manifest(manifest, key_parts[1], get_version_id_from_key(s3_key))
     
-    return resp.get('CommonPrefixes', False)
+    update_manifest(contract_number, update)
+
+def set_storage_class_in_manifest(contract_number: str, s3_keys: List[str], storage_class: str):
+    """
+    Updates the storage class of some versions of a contract in its manifest.
+    """
+    def update(manifest: Dict):
+        for s3_key in s3_keys:
+            key_parts = s3_key.split('/')
+            if len(key_parts) != 3:
+                continue
+            version = manifest['files'].get(key_parts[1], {}).get('versions', {}).get(get_version_id_from_key(s3_key))
+            if version:
+                version['storage_class'] = storage_class
+    
+    update_manifest(contract_number, update)
+
+def get_file_versions_from_manifest(manifest: Dict, filename: str, start_after: str=None,
+                                    end_before: str=None, limit: int=None) -> List[FileVersion]:
+    """
+    Returns the versions of a file in a manifest, from the oldest to the latest one.
+    - start_after: only versions after this version id (a VERSION_ID_FORMAT or legacy DATETIME_FORMAT timestamp).
+    - end_before: only versions before this version id (a VERSION_ID_FORMAT or legacy DATETIME_FORMAT timestamp).
+    - limit: maximum number of versions to return.
+    The page is sliced from the sorted version ids, so only its versions are converted. The whole
+    manifest is still read and parsed, so the cost of a page grows with the size of the contract.
+    """
+    file_entry = manifest['files'].get(filename)
+    if not file_entry:
+        return []
+    # The versions are added in order, so sorting them is a single pass
+    version_ids = sorted(file_entry['versions'])
+    start = bisect.bisect_right(version_ids, start_after) if start_after else 0
+    end = bisect.bisect_left(version_ids, end_before) if end_before else len(version_ids)
+    if limit is not None:
+        end = min(end, start + limit)
+    versions = []
+    for version_id in version_ids[start:end]:
+        version = file_entry['versions'][version_id]
+        versions.append(FileVersion(
+            version_id, datetime.fromisoformat(version['last_modified']), version['size'],
+            version['storage_class'], version.get('sha256')
+        ))
+    return versions
+
+# JOBS
+# A dismiss job archives a contract in chunks (one page of its listing each), possibly along many
+# invocations. After every chunk its checkpoint is saved with the continuation token of the listing:
+# {
+#     "job_id": "1f0c...", "contract_number": "C1", "status": "running",
+#     "continuation_token": "...", "chunks": 3, "processed": 3000,
+#     "dismissed": 2990, "already_dismissed": 5, "failed": 5, "failed_objects": [{"key": "...", "error": "..."}],
+#     "processing_seconds": 12.5, "created_at": 1634560000.0, "updated_at": 1634560012.5
+# }
+def get_dismiss_job_key(job_id: str) -> str:
+    return f'{JOBS_PREFIX}/dismiss/{job_id}.json'
+
+def new_dismiss_job(contract_number: str) -> Dict:
+    now = time.time()
+    return {
+        'job_id': uuid.uuid4().hex,
+        'contract_number': contract_number,
+        'status': 'running',
+        'continuation_token': None,
+        'chunks': 0,
+        'processed': 0,
+        'dismissed': 0,
+        'already_dismissed': 0,
+        'failed': 0,
+        'failed_objects': [],
+        'processing_seconds': 0.0,
+        'created_at': now,
+        'updated_at': now
+    }
+
+def load_dismiss_job(job_id: str) -> Optional[Dict]:
+    """
+    Returns the checkpoint of a dismiss job, or None if it doesn't exist.
+    """
+    try:
+        resp = get_client('s3').get_object(Bucket=BUCKET, Key=get_dismiss_job_key(job_id))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+            return None
+        raise
+    return json.loads(resp['Body'].read())
+
+def save_dismiss_job(job: Dict):
+    job['updated_at'] = time.time()
+    get_client('s3').put_object(
+        Bucket=BUCKET, Key=get_dismiss_job_key(job['job_id']),
+        Body=json.dumps(job, separators=(',', ':')), ContentType='application/json'
+    )
+
+def get_dismiss_job_status(job: Dict) -> Dict:
+    """
+    Returns the progress of a dismiss job, as it's shown to the clients.
+    """
+    status = {key: value for key, value in job.items() if key != 'continuation_token'}
+    status['objects_per_second'] = round(job['processed'] / job['processing_seconds'], 1) \
+        if job['processing_seconds'] else 0.0
+    return status
+
+
+# INIT PHASE
+# The clients are built while the module is imported, in the init phase of the container, instead
+# of during the first invocation that needs them
+init_clients(INIT_CLIENTS)
@@ -0,0 +1,270 @@
+"""
+Incremental scanner of JSON documents.
+The document is read chunk by chunk and validated without building it in memory: only the
+keys of the top-level object are kept, so uploads of any size are checked in bounded memory
+(the chunk being scanned plus, at most, a few bytes of the previous one).
+"""
+import codecs, json, re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Bytes that end the plain run of a string: its closing quote, an escape or a (forbidden) control character
+STRING_SPECIAL = re.compile(rb'["\\\x00-\x1f]')
+# Runs of a string longer than this are skipped with byte searches instead of STRING_SPECIAL
+SHORT_RUN_SIZE = 256
+CONTROL_CHARACTERS = bytes(range(0x20))
+# Bytes of a long run checked at once for control characters
+CONTROL_CHECK_BLOCK_SIZE = 64 * 1024
+SCALAR = re.compile(rb'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null')
+HEX_DIGITS = b'0123456789abcdefABCDEF'
+WHITESPACE = b' \t\n\r'
+ESCAPES = b'"\\/bfnrtu'
+# Bytes read ahead to match a number or a literal
+SCALAR_LOOKAHEAD = 1024
+# Longer keys are validated but not returned
+MAX_KEY_SIZE = 1024
+
+
+class JsonScanError(ValueError):
+    """
+    The document isn't valid JSON (or it isn't valid UTF-8).
+    """
+
+
+class JsonScanner:
+    """
+    Scanner over an iterable of byte chunks (e.g. the iter_chunks of a StreamingBody).
+    """
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = b''
+        self._position = 0
+        # Offset in the document of the start of the buffer
+        self._offset = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """
+        Appends the next chunk to the unread part of the buffer. Returns False at the end of the document.
+        """
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            try:
+                self._decoder.decode(chunk)
+            except UnicodeDecodeError as e:
+                raise JsonScanError(f'Invalid UTF-8: {e}')
+            self._offset += self._position
+            self._buffer = self._buffer[self._position:] + chunk
+            self._position = 0
+            return True
+        self._eof = True
+        try:
+            self._decoder.decode(b'', final=True)
+        except UnicodeDecodeError as e:
+            raise JsonScanError(f'Invalid UTF-8: {e}')
+        return False
+
+    def _peek(self) -> bytes:
+        """
+        Skips the whitespace and returns the next byte without consuming it (b'' at the end).
+        """
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position:self._position + 1]
+            if not self._fill():
+                return b''
+
+    def _read(self, size: int) -> bytes:
+        while len(self._buffer) - self._position < size:
+            if not self._fill():
+                raise JsonScanError('Unexpected end of the document.')
+        data = self._buffer[self._position:self._position + size]
+        self._position += size
+        return data
+
+    def _expect(self, expected: bytes):
+        found = self._peek()
+        if found != expected:
+            raise JsonScanError(f'Expected {expected.decode()} but found {found.decode(errors="replace") or "the end"}.')
+        self._position += 1
+
+    def _check_control_characters(self, start: int, end: int):
+        """
+        Raises JsonScanError if a part of the buffer has control characters (forbidden inside strings).
+        The part is checked in blocks, so it's never copied whole.
+        """
+        while start < end:
+            block = self._buffer[start:min(end, start + CONTROL_CHECK_BLOCK_SIZE)]
+            if len(block.translate(None, CONTROL_CHARACTERS)) != len(block):
+                raise JsonScanError('Control character inside a string.')
+            start += CONTROL_CHECK_BLOCK_SIZE
+
+    def _scan_string(self, keep: int=0) -> bytes:
+        """
+        Consumes a string (its opening quote included) and returns the first `keep` bytes of its raw content.
+        The plain runs of the string are skipped with searches, without looking at every byte in python.
+        """
+        self._expect(b'"')
+        kept = bytearray()
+        # Positions in the document (not in the buffer, which changes when it's filled) of the next
+        # quote, and of the end of the bytes already searched for it, so every byte is searched once
+        quote = -1
+        searched = 0
+        while True:
+            match = STRING_SPECIAL.search(self._buffer, self._position, self._position + SHORT_RUN_SIZE)
+            if match:
+                end = match.start()
+            else:
+                # Long runs (e.g. the base64 of a file) are found with byte searches, many times faster than the regex
+                if quote < self._offset + self._position:
+                    index = self._buffer.find(b'"', max(self._position, searched - self._offset))
+                    if index != -1:
+                        quote = self._offset + index
+                    else:
+                        quote = -1
+                        searched = self._offset + len(self._buffer)
+                end = quote - self._offset if quote != -1 else len(self._buffer)
+                backslash = self._buffer.find(b'\\', self._position, end)
+                if backslash != -1:
+                    end = backslash
+                self._check_control_characters(self._position, end)
+            if len(kept) < keep:
+                kept += self._buffer[self._position:min(end, self._position + keep - len(kept))]
+            self._position = end
+            if end == len(self._buffer):
+                if not self._fill():
+                    raise JsonScanError('Unterminated string.')
+                continue
+            special = self._buffer[end:end + 1]
+            if special == b'"':
+                self._position += 1
+                return bytes(kept)
+            if special != b'\\':
+                raise JsonScanError('Control character inside a string.')
+            escape = self._read(2)
+            if escape[1:] not in ESCAPES:
+                raise JsonScanError('Invalid escape inside a string.')
+            if escape == b'\\u':
+                escape += self._read(4)
+                if any(digit not in HEX_DIGITS for digit in escape[2:]):
+                    raise JsonScanError('Invalid unicode escape inside a string.')
+            if len(kept) < keep:
+                kept += escape
+
+    def _scan_scalar(self):
+        """
+        Consumes a number, true, false or null.
+        """
+        self._peek()
+        while len(self._buffer) - self._position < SCALAR_LOOKAHEAD and self._fill():
+            pass
+        match = SCALAR.match(self._buffer, self._position)
+        if not match:
+            raise JsonScanError('Invalid value.')
+        self._position = match.end()
+
+    def _scan_key(self) -> bytes:
+        """
+        Consumes a key of an object and its colon, and returns the raw key.
+        """
+        key = self._scan_string(MAX_KEY_SIZE + 1)
+        self._expect(b':')
+        return key
+
+    def _scan_value(self):
+        """
+        Consumes a value of any type. Nested objects and arrays are scanned iteratively,
+        so any depth of nesting is supported.
+        """
+        closers: List[bytes] = []
+        while True:
+            token = self._peek()
+            if token in [b'{', b'[']:
+                self._position += 1
+                closer = b'}' if token == b'{' else b']'
+                if self._peek() == closer:
+                    self._position += 1
+                else:
+                    closers.append(closer)
+                    if closer == b'}':
+                        self._scan_key()
+                    continue
+            elif token == b'"':
+                self._scan_string()
+            else:
+                self._scan_scalar()
+
+            # The value is complete: close the containers that end here, until one has another value
+            while closers:
+                token = self._peek()
+                if token == b',':
+                    self._position += 1
+                    if closers[-1] == b'}':
+                        self._scan_key()
+                    break
+                if token != closers[-1]:
+                    raise JsonScanError(f'Expected , or {closers[-1].decode()}.')
+                self._position += 1
+                closers.pop()
+            if not closers:
+                return
+
+    def scan_object(self) -> Dict[str, Optional[Tuple[int, int]]]:
+        """
+        Validates the whole document, which must be an object, and returns its top-level keys with
+        where the raw content of their value starts and ends in the document, for the values that
+        are strings (None for the other values).
+        """
+        keys = {}
+        self._expect(b'{')
+        if self._peek() == b'}':
+            self._position += 1
+        else:
+            while True:
+                raw_key = self._scan_key()
+                span = None
+                if self._peek() == b'"':
+                    start = self._offset + self._position + 1
+                    self._scan_string()
+                    span = (start, self._offset + self._position - 1)
+                else:
+                    self._scan_value()
+                if len(raw_key) <= MAX_KEY_SIZE:
+                    # As json.loads, the last value of a repeated key is the one kept
+                    keys[json.loads(b'"' + raw_key + b'"')] = span
+                token = self._peek()
+                self._position += 1
+                if token == b'}':
+                    break
+                if token != b',':
+                    raise JsonScanError('Expected , or }.')
+        if self._peek():
+            raise JsonScanError('Unexpected data after the document.')
+        return keys
+
+    def scan_object_keys(self) -> Set[str]:
+        """
+        Validates the whole document, which must be an object, and returns its top-level keys.
+        """
+        return set(self.scan_object())
+
+
+def scan_object_keys(chunks: Iterable[bytes]) -> Set[str]:
+    """
+    Validates a JSON document read in chunks, in bounded memory, and returns the keys of its top-level object.
+    Raises JsonScanError if the document isn't a valid JSON object.
+    """
+    return JsonScanner(chunks).scan_object_keys()
+
+def get_string_value_span(document: bytes, key: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns where the raw content (escapes included) of the string value of a top-level key of a
+    JSON object starts and ends, or None if the object has no such key or its value isn't a string.
+    Nested keys with the same name are ignored. Raises JsonScanError if the document isn't a valid JSON object.
+    """
+    return JsonScanner([document]).scan_object().get(key)
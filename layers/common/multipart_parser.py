@@ -0,0 +1,206 @@
+"""
+Parser of multipart/form-data bodies.
+The body is scanned once and the content of every part is returned as a memoryview slice of
+the body, so the files are never copied while they are parsed.
+"""
+import io
+from typing import Dict, Iterator, NamedTuple, Optional, Union
+
+
+class MultipartPart(NamedTuple):
+    """
+    A part of a multipart body. The content is a view of the body, not a copy.
+    """
+    name: str
+    filename: Optional[str]
+    content_type: Optional[str]
+    content: memoryview
+
+
+class MultipartError(ValueError):
+    """
+    The body isn't a valid multipart/form-data body.
+    """
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only file object over a buffer (e.g. the memoryview of a part), so it can be uploaded
+    by boto3 without copying the whole buffer into a bytes object first.
+    """
+    def __init__(self, buffer: Union[bytes, memoryview]):
+        self._buffer = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int=io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._buffer) + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+        if position < 0:
+            raise ValueError('Negative seek position')
+        self._position = position
+        return position
+
+    def readinto(self, b) -> int:
+        chunk = self._buffer[self._position:self._position + len(b)]
+        size = len(chunk)
+        b[:size] = chunk
+        self._position += size
+        return size
+
+
+def get_boundary(content_type: str) -> bytes:
+    """
+    Returns the boundary of a multipart content type header
+    (e.g. 'multipart/form-data; boundary=----1234').
+    """
+    for parameter in content_type.split(';')[1:]:
+        key, _, value = parameter.strip().partition('=')
+        if key.lower() == 'boundary':
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            if value:
+                return value.encode('latin-1')
+    raise MultipartError('The content type has no boundary.')
+
+def parse_header_parameters(value: str) -> Dict:
+    """
+    Parses the parameters of a header like Content-Disposition
+    ('form-data; name="file"; filename="a.pdf"') into a dictionary.
+    Quoted values can have ';' and escaped quotes inside them.
+    """
+    parameters = {}
+    length = len(value)
+    i = value.find(';')
+    if i == -1:
+        return parameters
+    while i < length:
+        # Skip the ';' and the spaces before the key
+        i += 1
+        while i < length and value[i] in ' \t':
+            i += 1
+        equals = value.find('=', i)
+        semicolon = value.find(';', i)
+        if equals == -1 or (semicolon != -1 and semicolon < equals):
+            # Parameter without value
+            if semicolon == -1:
+                break
+            i = semicolon
+            continue
+        key = value[i:equals].strip().lower()
+        i = equals + 1
+        if i < length and value[i] == '"':
+            chars = []
+            i += 1
+            while i < length and value[i] != '"':
+                if value[i] == '\\' and i + 1 < length:
+                    i += 1
+                chars.append(value[i])
+                i += 1
+            parameters[key] = ''.join(chars)
+            semicolon = value.find(';', i)
+        else:
+            semicolon = value.find(';', i)
+            parameters[key] = value[i:semicolon if semicolon != -1 else length].strip()
+        if semicolon == -1:
+            break
+        i = semicolon
+    return parameters
+
+def parse_part_headers(headers_block: memoryview) -> Dict:
+    """
+    Parses the headers of a part into a dictionary with lowercase keys.
+    """
+    headers = {}
+    for line in bytes(headers_block).decode('utf-8', 'replace').split('\r\n'):
+        key, separator, value = line.partition(':')
+        if separator:
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+def skip_transport_padding(body: Union[bytes, bytearray], position: int) -> int:
+    """
+    Returns the position after the spaces and tabs that the senders can add after a delimiter (RFC 2046).
+    """
+    while body[position:position + 1] in (b' ', b'\t'):
+        position += 1
+    return position
+
+def find_delimiter(body: Union[bytes, bytearray], delimiter: bytes, start: int) -> int:
+    """
+    Returns the position of the next delimiter of the body from start, or -1 if there isn't any.
+    The boundary text can also be the beginning of a longer line of a part (e.g. '--boundary-2'),
+    so only the matches followed by a line break, the transport padding or '--' are delimiters.
+    """
+    position = body.find(delimiter, start)
+    while position != -1:
+        end = position + len(delimiter)
+        if body[end:end + 2] == b'--':
+            return position
+        end = skip_transport_padding(body, end)
+        if body[end:end + 2] == b'\r\n':
+            return position
+        position = body.find(delimiter, position + 1)
+    return -1
+
+def iter_multipart_parts(body: Union[bytes, bytearray], content_type: str) -> Iterator[MultipartPart]:
+    """
+    Lazily yields the parts of a multipart/form-data body.
+    """
+    delimiter = b'--' + get_boundary(content_type)
+    # Every delimiter but the first one comes after a line break
+    next_delimiter = b'\r\n' + delimiter
+    view = memoryview(body)
+
+    position = body.find(delimiter)
+    if position == -1:
+        raise MultipartError('The body has no parts.')
+    position += len(delimiter)
+    while True:
+        if body[position:position + 2] == b'--':
+            # Closing delimiter
+            return
+        position = skip_transport_padding(body, position)
+        if body[position:position + 2] != b'\r\n':
+            raise MultipartError('Malformed delimiter.')
+        headers_start = position + 2
+        if body[headers_start:headers_start + 2] == b'\r\n':
+            # Part without headers
+            headers_end = headers_start
+            content_start = headers_start + 2
+        else:
+            headers_end = body.find(b'\r\n\r\n', headers_start)
+            if headers_end == -1:
+                raise MultipartError('Malformed part headers.')
+            content_start = headers_end + 4
+        content_end = find_delimiter(body, next_delimiter, content_start)
+        if content_end == -1:
+            raise MultipartError('The body has no closing delimiter.')
+
+        headers = parse_part_headers(view[headers_start:headers_end])
+        disposition = parse_header_parameters(headers.get('content-disposition', ''))
+        yield MultipartPart(
+            name=disposition.get('name', ''),
+            filename=disposition.get('filename'),
+            content_type=headers.get('content-type'),
+            content=view[content_start:content_end]
+        )
+        position = content_end + len(next_delimiter)
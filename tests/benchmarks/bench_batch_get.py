@@ -0,0 +1,55 @@
+"""
+Benchmark of the /_batch_get endpoint.
+Compares opening a contract with one /_get request per file against a single /_batch_get
+request, with a simulated S3 round trip.
+
+    python tests/benchmarks/bench_batch_get.py --files 10 25 --size-kb 50 --latency-ms 20
+"""
+import argparse, json, os, time
+
+from benchmark_utils import S3CallCounter, S3Latency, load_handler, make_api_event, put_file_versions, start_mock_aws
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 25])
+    parser.add_argument('--size-kb', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    start_mock_aws()
+    get_app = load_handler('get')
+    batch_get_app = load_handler('batch_get')
+    batch_get_app.BATCH_GET_MAX_ITEMS = max(args.files)
+    counter = S3CallCounter()
+    latency = S3Latency(0)
+    results = []
+    for files in args.files:
+        contract_number = f'bench-batch-get-{files}'
+        filenames = [f'file{i:05d}' for i in range(files)]
+        for filename in filenames:
+            put_file_versions(contract_number, filename, 1, os.urandom(args.size_kb * 1024))
+        runs = {
+            'get per file': lambda: [
+                get_app.lambda_handler(make_api_event({'contract_number': contract_number, 'filename': filename}), None)
+                for filename in filenames
+            ],
+            'batch_get': lambda: batch_get_app.lambda_handler(
+                make_api_event({'contract_number': contract_number, 'items': [{'filename': filename} for filename in filenames]}), None
+            )
+        }
+        for name, run in runs.items():
+            latency.latency = args.latency_ms / 1000
+            counter.reset()
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            latency.latency = 0
+            results.append({
+                'files': files, 'implementation': name, 's3_calls': counter.total,
+                'seconds': round(elapsed, 2)
+            })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark of the /_bulk_delete endpoint.
+Compares deleting every version of a contract with one /_delete request per version against a
+single /_bulk_delete request (by items and by the whole contract), with a simulated S3 round trip.
+
+    python tests/benchmarks/bench_bulk_delete.py --files 20 100 --versions 10 --latency-ms 20
+"""
+import argparse, json, time
+
+from benchmark_utils import S3CallCounter, S3Latency, load_handler, make_api_event, put_file_versions, start_mock_aws
+
+
+def put_contract(contract_number: str, files: int, versions: int) -> list:
+    """
+    Stores a contract and returns its (filename, version_id) pairs.
+    """
+    items = []
+    for i in range(files):
+        filename = f'file{i:05d}'
+        items.extend({'filename': filename, 'version_id': version_id}
+                     for version_id in put_file_versions(contract_number, filename, versions))
+    return items
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, nargs='+', default=[20, 100])
+    parser.add_argument('--versions', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    start_mock_aws()
+    delete_app = load_handler('delete')
+    bulk_delete_app = load_handler('bulk_delete')
+    counter = S3CallCounter()
+    latency = S3Latency(0)
+    results = []
+    for files in args.files:
+        runs = {
+            'delete per version': lambda contract_number, items: [
+                delete_app.lambda_handler(make_api_event({'contract_number': contract_number, **item}), None)
+                for item in items
+            ],
+            'bulk_delete items': lambda contract_number, items: bulk_delete_app.lambda_handler(
+                make_api_event({'contract_number': contract_number, 'items': items}), None
+            ),
+            'bulk_delete all_files': lambda contract_number, items: bulk_delete_app.lambda_handler(
+                make_api_event({'contract_number': contract_number, 'all_files': True}), None
+            )
+        }
+        for name, run in runs.items():
+            contract_number = f'bench-bulk-delete-{files}-{name.replace(" ", "-")}'
+            items = put_contract(contract_number, files, args.versions)
+            latency.latency = args.latency_ms / 1000
+            counter.reset()
+            start = time.perf_counter()
+            run(contract_number, items)
+            elapsed = time.perf_counter() - start
+            latency.latency = 0
+            results.append({
+                'versions': len(items), 'implementation': name, 's3_calls': counter.total,
+                'seconds': round(elapsed, 2)
+            })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
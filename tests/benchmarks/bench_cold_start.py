@@ -0,0 +1,203 @@
+"""
+Benchmark of the cold starts of every function in template.yaml.
+Every cold start is a new process (a new container), which measures:
+- import: the time to import the app module of the function (the init phase of the container).
+- first invocation: the latency of the first request of the container, and of the second one (warm).
+The functions use a moto server (another process), like they use S3 from Lambda, so nothing is
+imported or built before their cold start.
+With --compare-ref the same is measured for the functions of another commit (e.g. the previous one),
+so the cold starts before and after a change can be compared.
+
+    python tests/benchmarks/bench_cold_start.py --runs 5 --compare-ref HEAD~1
+"""
+import argparse, base64, copy, importlib.util, json, os, socket, statistics, subprocess, sys, tarfile, tempfile, time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List
+from urllib.request import Request, urlopen
+
+import yaml
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+CONTRACT_NUMBER = 'bench-cold-start'
+FILENAME = 'file'
+VERSION_ID = '20210101_000000'
+UPLOAD_KEY = f'{CONTRACT_NUMBER}/upload/{VERSION_ID}.txt'
+
+
+def make_api_event(body: Dict) -> Dict:
+    return {'isBase64Encoded': 'false', 'headers': {'content-type': 'application/json'}, 'body': json.dumps(body)}
+
+def make_file(document: bytes, contract_number: str=CONTRACT_NUMBER, filename: str=FILENAME) -> Dict:
+    return {
+        'contract_number': contract_number, 'filename': f'{filename}.txt', 'content_type': 'text/plain',
+        'file': base64.b64encode(document).decode()
+    }
+
+# Request of every function (by its CodeUri), on the data stored by seed_data
+EVENTS = {
+    'create': make_api_event(make_file(b'new file', filename='new-file')),
+    'update': make_api_event(make_file(b'updated file')),
+    'get': make_api_event({'contract_number': CONTRACT_NUMBER, 'filename': FILENAME}),
+    'batch_get': make_api_event({'contract_number': CONTRACT_NUMBER, 'items': [{'filename': FILENAME}]}),
+    'list': make_api_event({'contract_number': CONTRACT_NUMBER}),
+    'list_versions': make_api_event({'contract_number': CONTRACT_NUMBER, 'filename': FILENAME}),
+    'delete': make_api_event({'contract_number': CONTRACT_NUMBER, 'filename': FILENAME, 'version_id': VERSION_ID}),
+    'bulk_delete': make_api_event({
+        'contract_number': CONTRACT_NUMBER, 'items': [{'filename': FILENAME, 'version_id': VERSION_ID}]
+    }),
+    'dismiss': make_api_event({'contract_number': CONTRACT_NUMBER}),
+    'dismiss_status': make_api_event({'job_id': 'bench-cold-start'}),
+    'presigned_url': make_api_event({'contract_number': CONTRACT_NUMBER, 'filename': FILENAME}),
+    'multipart_upload': make_api_event({
+        'contract_number': CONTRACT_NUMBER, 'filename': FILENAME, 'version_id': VERSION_ID,
+        'upload_id': 'bench-cold-start', 'action': 'abort'
+    }),
+    'file_verifier': {'Records': [{'s3': {'object': {'key': UPLOAD_KEY}}}]},
+    'health': make_api_event({}),
+    'router': {**make_api_event({'contract_number': CONTRACT_NUMBER, 'filename': FILENAME}), 'routeKey': 'POST /files/_get'},
+}
+
+
+def load_app(root: Path, function_dir: str):
+    sys.path.insert(0, str(root / 'layers' / 'common'))
+    # The router imports the app modules of the other functions as packages
+    sys.path.insert(0, str(root / 'functions'))
+    spec = importlib.util.spec_from_file_location(f'{function_dir}_app', root / 'functions' / function_dir / 'app.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def seed_data(endpoint_url: str):
+    """
+    Clears the moto server and stores a file and an upload, for the next cold start.
+    """
+    import botocore.session
+    urlopen(Request(f'{endpoint_url}/moto-api/reset', method='POST')).read()
+    session = botocore.session.get_session()
+    s3_client = session.create_client('s3', endpoint_url=endpoint_url)
+    s3_client.create_bucket(Bucket=os.environ['BUCKET'])
+    s3_client.put_bucket_versioning(Bucket=os.environ['BUCKET'], VersioningConfiguration={'Status': 'Enabled'})
+    s3_client.create_bucket(Bucket=os.environ['TEMP_BUCKET'])
+    session.create_client('sns', endpoint_url=endpoint_url).create_topic(Name=os.environ['SNS_ARN'].split(':')[-1])
+    envelope = json.dumps(make_file(b'benchmark'))
+    s3_client.put_object(
+        Bucket=os.environ['BUCKET'], Key=f'{CONTRACT_NUMBER}/{FILENAME}/{VERSION_ID}.txt',
+        Body=envelope, Metadata={'encoded_content_type': 'application/json'}
+    )
+    s3_client.put_object(Bucket=os.environ['TEMP_BUCKET'], Key=UPLOAD_KEY, Body=envelope)
+
+def run_cold_start_child(root: Path, function_dir: str) -> Dict:
+    """
+    Imports the function in a clean process, as the init phase of a container does, and measures
+    its first and second invocations.
+    """
+    start = time.perf_counter()
+    app = load_app(root, function_dir)
+    import_ms = (time.perf_counter() - start) * 1000
+    latencies, responses = [], []
+    for _ in range(2):
+        start = time.perf_counter()
+        responses.append(app.lambda_handler(copy.deepcopy(EVENTS[function_dir]), None))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        'import_ms': import_ms, 'first_invocation_ms': latencies[0], 'warm_invocation_ms': latencies[1],
+        # Of the first invocation (the second one may find the changes of the first, e.g. a created file)
+        'status_code': (responses[0] or {}).get('statusCode')
+    }
+
+def get_template_functions(root: Path) -> Dict[str, Dict]:
+    """
+    Returns the functions of the template of a tree: {function_dir: environment}, with only the
+    plain variables of the environment (references to other resources are replaced by the benchmark ones).
+    """
+    class TemplateLoader(yaml.SafeLoader):
+        pass
+    TemplateLoader.add_multi_constructor('!', lambda loader, suffix, node: None)
+    with open(root / 'template.yaml') as template_file:
+        template = yaml.load(template_file, Loader=TemplateLoader)
+
+    functions = {}
+    for resource in template['Resources'].values():
+        if resource['Type'] != 'AWS::Serverless::Function':
+            continue
+        properties = resource['Properties']
+        variables = (properties.get('Environment') or {}).get('Variables') or {}
+        # functions/get/ + app.lambda_handler, or functions/ + router/app.lambda_handler
+        handler_module = properties['Handler'].rsplit('.', 1)[0]
+        function_dir = Path(properties['CodeUri'].strip('/'), handler_module).parent.name
+        functions[function_dir] = {key: str(value) for key, value in variables.items() if value is not None}
+    return functions
+
+def export_tree(ref: str, directory: str) -> Path:
+    """
+    Extracts the functions, the layers and the template of a commit into a directory.
+    """
+    archive = subprocess.run(
+        ['git', '-C', str(ROOT_PATH), 'archive', ref, 'functions', 'layers', 'template.yaml'],
+        capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return Path(directory)
+
+def run_child(root: Path, function_dir: str, environment: Dict) -> Dict:
+    seed_data(environment['AWS_ENDPOINT_URL'])
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', str(root), function_dir],
+        capture_output=True, text=True, env={**os.environ, **environment}
+    )
+    if output.returncode:
+        return {'error': output.stderr.strip().splitlines()[-1]}
+    # The last line is the result, the previous ones are the logs of the handler
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def benchmark_tree(name: str, root: Path, runs: int, only: List[str], endpoint_url: str) -> List[Dict]:
+    from benchmark_utils import DEFAULT_ENVIRONMENT
+
+    results = []
+    for function_dir, environment in get_template_functions(root).items():
+        if only and function_dir not in only:
+            continue
+        environment = {**environment, **DEFAULT_ENVIRONMENT, 'AWS_ENDPOINT_URL': endpoint_url}
+        measures = [run_child(root, function_dir, environment) for _ in range(runs)]
+        errors = [measure['error'] for measure in measures if 'error' in measure]
+        if errors:
+            results.append({'function': function_dir, 'tree': name, 'error': errors[0]})
+            continue
+        result = {'function': function_dir, 'tree': name, 'status_code': measures[-1]['status_code']}
+        for key in ['import_ms', 'first_invocation_ms', 'warm_invocation_ms']:
+            result[key] = round(statistics.median(measure[key] for measure in measures), 1)
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=3, help='Cold starts measured per function (the median is reported)')
+    parser.add_argument('--compare-ref', help='Commit whose functions are also measured, e.g. HEAD~1')
+    parser.add_argument('--functions', nargs='*', default=[], help='Only these functions (folders of functions/)')
+    parser.add_argument('--child', nargs=2, metavar=('ROOT', 'FUNCTION'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run_cold_start_child(Path(args.child[0]), args.child[1])))
+        return
+
+    from moto.server import ThreadedMotoServer
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        port = free_socket.getsockname()[1]
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    endpoint_url = f'http://127.0.0.1:{port}'
+    try:
+        results = benchmark_tree('current', ROOT_PATH, args.runs, args.functions, endpoint_url)
+        if args.compare_ref:
+            with tempfile.TemporaryDirectory() as directory:
+                root = export_tree(args.compare_ref, directory)
+                results += benchmark_tree(args.compare_ref, root, args.runs, args.functions, endpoint_url)
+    finally:
+        server.stop()
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
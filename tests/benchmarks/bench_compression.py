@@ -0,0 +1,85 @@
+"""
+Benchmark of the compression of the stored documents.
+Reports, per content type and algorithm, the compression ratio and the time spent compressing
+the document on the writes and decompressing it (chunk by chunk, like _get does) on the reads.
+
+    python tests/benchmarks/bench_compression.py --size 2 --levels 1 6 9
+"""
+import argparse, io, json, os, random, time
+
+from botocore.response import StreamingBody
+
+from benchmark_utils import cf
+
+WORDS = ['contrato', 'cliente', 'importe', 'fecha', 'clausula', 'pago', 'vigencia', 'firma',
+         'documento', 'anexo', 'garantia', 'poliza', 'monto', 'plazo', 'domicilio', 'RFC']
+
+
+def make_text(size: int, rng: random.Random) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS) if rng.random() > 0.2 else str(rng.randint(0, 10**6))
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+def make_documents(size: int) -> dict:
+    """
+    Returns sample documents of the content types stored in the contracts.
+    """
+    rng = random.Random(0)
+    lines = [make_text(80, rng) for _ in range(size // 80)]
+    xml = '<contrato>' + ''.join(f'<clausula id="{i}">{line}</clausula>' for i, line in enumerate(lines)) + '</contrato>'
+    records = [{'id': i, 'descripcion': line, 'importe': rng.randint(0, 10**6)} for i, line in enumerate(lines)]
+    pdf = '%PDF-1.4\n' + ''.join(f'BT /F1 12 Tf 72 {i % 700} Td ({line}) Tj ET\n' for i, line in enumerate(lines))
+    return {
+        'application/pdf': pdf.encode()[:size],
+        'application/xml': xml.encode()[:size],
+        'application/json': json.dumps(records).encode()[:size],
+        'image/jpeg': os.urandom(size),
+        'application/octet-stream': os.urandom(size)
+    }
+
+def measure(document: bytes, content_type: str, algorithm: str, repeat: int) -> dict:
+    compress_times, decompress_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compressed_document, content_encoding = cf.compress_document(document, content_type, algorithm)
+        compress_times.append(time.perf_counter() - start)
+        if not content_encoding:
+            return {'stored': 'uncompressed', 'ratio': 1.0, 'compress_ms': round(min(compress_times) * 1000, 2)}
+
+        response = {'Body': StreamingBody(io.BytesIO(compressed_document), len(compressed_document))}
+        start = time.perf_counter()
+        assert cf.read_document(response, {'content_encoding': content_encoding}) == document
+        decompress_times.append(time.perf_counter() - start)
+    return {
+        'stored': content_encoding,
+        'ratio': round(len(document) / len(compressed_document), 2),
+        'compress_ms': round(min(compress_times) * 1000, 2),
+        'decompress_ms': round(min(decompress_times) * 1000, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=float, default=2, help='Size of the documents in MB')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    algorithms = ['gzip'] + (['zstd'] if cf.get_zstandard() else [])
+    cf.COMPRESSION_MIN_SAVING = 0
+    results = []
+    for content_type, document in make_documents(int(args.size * 2**20)).items():
+        for algorithm in algorithms:
+            for level in args.levels:
+                cf.COMPRESSION_LEVEL = level
+                results.append({
+                    'content_type': content_type, 'algorithm': algorithm, 'level': level,
+                    **measure(document, content_type, algorithm, args.repeat)
+                })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
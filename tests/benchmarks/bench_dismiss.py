@@ -0,0 +1,75 @@
+"""
+Benchmark of the /_dismiss endpoint.
+Compares the previous serial implementation (HEAD, managed copy and delete per object, one page
+of the listing) against the concurrent one, with a simulated S3 round trip, for several worker counts.
+
+    python tests/benchmarks/bench_dismiss.py --objects 100 500 --workers 1 4 8 16 --latency-ms 20
+"""
+import argparse, json, time
+
+from benchmark_utils import S3CallCounter, S3Latency, cf, load_handler, make_api_event, put_file_versions, start_mock_aws
+
+
+def legacy_dismiss(contract_number: str):
+    """
+    Previous implementation of /_dismiss (without the manifest update).
+    """
+    s3 = cf.get_client('s3')
+    response = s3.list_objects_v2(Bucket=cf.BUCKET, Prefix=contract_number)
+    for file in response['Contents']:
+        if file['StorageClass'] in ['GLACIER', 'GLACIER_IR']:
+            continue
+        metadata_response = cf.key_exists_in_bucket(file['Key'])
+        cf.managed_copy({'Bucket': cf.BUCKET, 'Key': file['Key']}, cf.BUCKET, file['Key'],
+                        {'StorageClass': 'GLACIER_IR', 'MetadataDirective': 'COPY'})
+        s3.delete_object(Bucket=cf.BUCKET, Key=file['Key'], VersionId=metadata_response['VersionId'])
+
+def put_contract(contract_number: str, objects: int, versions: int=5):
+    for i in range(objects // versions):
+        put_file_versions(contract_number, f'file{i:05d}', versions)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--objects', type=int, nargs='+', default=[100, 500])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    start_mock_aws()
+    dismiss_app = load_handler('dismiss')
+    counter = S3CallCounter()
+    latency = S3Latency(0)
+    results = []
+    for objects in args.objects:
+        contract_number = f'bench-dismiss-legacy-{objects}'
+        put_contract(contract_number, objects)
+        latency.latency = args.latency_ms / 1000
+        counter.reset()
+        start = time.perf_counter()
+        legacy_dismiss(contract_number)
+        elapsed = time.perf_counter() - start
+        latency.latency = 0
+        results.append({
+            'objects': objects, 'implementation': 'legacy', 's3_calls': counter.total,
+            'seconds': round(elapsed, 2), 'objects_per_second': round(objects / elapsed, 1)
+        })
+
+        for workers in args.workers:
+            contract_number = f'bench-dismiss-{objects}-{workers}'
+            put_contract(contract_number, objects)
+            dismiss_app.DISMISS_WORKERS = workers
+            latency.latency = args.latency_ms / 1000
+            counter.reset()
+            start = time.perf_counter()
+            response = dismiss_app.lambda_handler(make_api_event({'contract_number': contract_number}), None)
+            elapsed = time.perf_counter() - start
+            latency.latency = 0
+            assert json.loads(response['body'])['dismissed'] == objects
+            results.append({
+                'objects': objects, 'implementation': f'{workers} workers', 's3_calls': counter.total,
+                'seconds': round(elapsed, 2), 'objects_per_second': round(objects / elapsed, 1)
+            })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
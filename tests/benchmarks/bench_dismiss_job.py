@@ -0,0 +1,93 @@
+"""
+Local driver of the dismiss jobs.
+Starts a dismiss job through the handler and runs its chunks in-process: the asynchronous
+invocations that continue a job are queued and run one after the other, every one with a
+simulated Lambda time limit. Reports the invocations, chunks and objects per second of the job.
+
+Against moto (default):
+    python tests/benchmarks/bench_dismiss_job.py --objects 5000 --timeout-ms 3000 --latency-ms 5
+Against a minio (or any S3 compatible) stand-in, whose buckets are created if they don't exist:
+    python tests/benchmarks/bench_dismiss_job.py --endpoint-url http://localhost:9000 --objects 5000
+"""
+import argparse, collections, json, os, time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--objects', type=int, default=5000)
+parser.add_argument('--versions', type=int, default=5, help='Versions per file')
+parser.add_argument('--workers', type=int, default=8)
+parser.add_argument('--page-size', type=int, default=250)
+parser.add_argument('--timeout-ms', type=int, default=3000, help='Simulated time limit of every invocation')
+parser.add_argument('--latency-ms', type=float, default=0, help='Simulated S3 round trip (moto only)')
+parser.add_argument('--endpoint-url', help='S3 compatible endpoint (e.g. minio) instead of moto')
+args = parser.parse_args()
+if args.endpoint_url:
+    # Has to be set before the clients are created
+    os.environ['AWS_ENDPOINT_URL_S3'] = args.endpoint_url
+
+from benchmark_utils import S3Latency, cf, load_handler, make_api_event, put_file_versions, start_mock_aws
+
+
+class LambdaContext:
+    """
+    Minimal stand-in of the Lambda context: only the remaining time of the invocation.
+    """
+    def __init__(self, timeout_ms: int):
+        self.deadline = time.time() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.deadline - time.time()) * 1000)
+
+
+def create_buckets():
+    s3 = cf.get_client('s3')
+    existing_buckets = [bucket['Name'] for bucket in s3.list_buckets()['Buckets']]
+    if cf.BUCKET not in existing_buckets:
+        s3.create_bucket(Bucket=cf.BUCKET)
+        s3.put_bucket_versioning(Bucket=cf.BUCKET, VersioningConfiguration={'Status': 'Enabled'})
+
+def main():
+    if args.endpoint_url:
+        create_buckets()
+    else:
+        start_mock_aws()
+    dismiss_app = load_handler('dismiss')
+    dismiss_app.DISMISS_WORKERS = args.workers
+    dismiss_app.DISMISS_PAGE_SIZE = args.page_size
+    dismiss_app.DISMISS_TIME_MARGIN = 200
+
+    contract_number = f'bench-dismiss-job-{int(time.time())}'
+    for i in range(args.objects // args.versions):
+        put_file_versions(contract_number, f'file{i:05d}', args.versions)
+    S3Latency(args.latency_ms)
+
+    # The asynchronous invocations are queued instead of sent to Lambda
+    invocations = collections.deque()
+    dismiss_app.invoke_next_chunk = lambda job: invocations.append(
+        {'dismiss_job_id': job['job_id'], 'chunks': job['chunks']}
+    )
+
+    start = time.perf_counter()
+    response = dismiss_app.lambda_handler(
+        make_api_event({'contract_number': contract_number}), LambdaContext(args.timeout_ms)
+    )
+    first_response = {'statusCode': response['statusCode'], **json.loads(response['body'])}
+    invocations_count = 1
+    while invocations:
+        dismiss_app.lambda_handler(invocations.popleft(), LambdaContext(args.timeout_ms))
+        invocations_count += 1
+    elapsed = time.perf_counter() - start
+
+    job = cf.get_dismiss_job_status(cf.load_dismiss_job(first_response['job_id']))
+    assert job['status'] == 'completed' and job['dismissed'] == args.objects
+    print(json.dumps({
+        'first_response': first_response,
+        'objects': args.objects,
+        'invocations': invocations_count,
+        'chunks': job['chunks'],
+        'seconds': round(elapsed, 2),
+        'objects_per_second': round(args.objects / elapsed, 1),
+        'processing_objects_per_second': job['objects_per_second']
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of file_verifier with uploads (json envelopes) of several sizes.
+Compares the wall time and the peak RSS of validating and moving an upload with the streaming
+validation and the server-side copy against the previous implementation (read, json.loads,
+json.dumps and put_object of the whole upload).
+Every run is measured in a new process, so the memory of a run doesn't hide the next one.
+moto keeps the objects in the same process, so the copies done by S3 are included in the RSS of both.
+
+    python tests/benchmarks/bench_file_verifier.py --sizes 10 50 100
+"""
+import argparse, base64, json, os, subprocess, sys, time
+
+from benchmark_utils import RSSSampler, cf, get_rss, load_handler, start_mock_aws
+
+
+def legacy_verify(s3_key: str):
+    """
+    Previous implementation of file_verifier for json envelopes.
+    """
+    s3_client = cf.get_client('s3')
+    temp_response = s3_client.get_object(Bucket=os.environ['TEMP_BUCKET'], Key=s3_key)
+    json_file = json.loads(temp_response['Body'].read().decode('utf-8'))
+    assert not cf.missing_parameters_from_file_dict(json_file, ['content_type', 'filename', 'file'])
+    file_encoded = json.dumps(json_file)
+    s3_client.put_object(
+        Body=file_encoded, Bucket=os.environ['BUCKET'],
+        Key=s3_key, Metadata={"encoded_content_type": cf.ENVELOPE_FORMAT}
+    )
+    s3_client.delete_object(Bucket=os.environ['TEMP_BUCKET'], Key=s3_key)
+
+def streaming_verify(s3_key: str):
+    load_handler('file_verifier').lambda_handler({'Records': [{'s3': {'object': {'key': s3_key}}}]}, None)
+
+def run_child(implementation: str, size_mb: float):
+    """
+    Uploads an envelope to the temp bucket and measures a single verification of it.
+    """
+    start_mock_aws()
+    s3_key = 'bench-file-verifier/file/20210101_000000.txt'
+    document = base64.b64encode(os.urandom(int(size_mb * 2**20 * 3 / 4))).decode()
+    cf.get_client('s3').put_object(
+        Bucket=os.environ['TEMP_BUCKET'], Key=s3_key,
+        Body=json.dumps({'filename': 'bench.pdf', 'content_type': 'application/pdf', 'file': document})
+    )
+    del document
+    verify = legacy_verify if implementation == 'legacy' else streaming_verify
+    load_handler('file_verifier')
+
+    rss_before = get_rss()
+    sampler = RSSSampler()
+    sampler.start()
+    start = time.perf_counter()
+    verify(s3_key)
+    elapsed = time.perf_counter() - start
+    peak = sampler.stop()
+    print(json.dumps({
+        'size_mb': size_mb, 'implementation': implementation,
+        'seconds': round(elapsed, 3), 'peak_rss_increase_mb': round((peak - rss_before) / 2**20, 1)
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[10, 50, 100], help='Sizes of the uploads in MB')
+    parser.add_argument('--child', nargs=2, metavar=('IMPLEMENTATION', 'SIZE_MB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.child[0], float(args.child[1]))
+
+    results = []
+    for size in args.sizes:
+        for implementation in ['legacy', 'streaming']:
+            output = subprocess.run(
+                [sys.executable, __file__, '--child', implementation, str(size)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            # The last line is the result, the previous ones are the logs of the handler
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
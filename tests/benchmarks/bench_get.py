@@ -0,0 +1,85 @@
+"""
+Benchmark of the body of the /_get responses.
+Compares the CPU time and the peak memory of building the response from the stored bytes
+against the previous implementation (json.loads of the whole object and json.dumps of the file again).
+
+    python tests/benchmarks/bench_get.py --sizes 1 3 4.5 --repeat 5
+"""
+import argparse, base64, io, json, os, time, tracemalloc
+
+from benchmark_utils import cf
+
+
+def legacy_response_body(response: dict) -> str:
+    """
+    Previous implementation: the whole file dictionary is parsed and serialized again.
+    """
+    body = response['Body'].read()
+    metadata = cf.get_object_metadata(response)
+    if cf.is_raw_format(metadata):
+        json_file = {
+            'filename': metadata['filename'],
+            'content_type': metadata['content_type'],
+            'file': base64.b64encode(body).decode()
+        }
+    else:
+        json_file = json.loads(body.decode('utf-8'))
+    return json.dumps({
+        'content_type': json_file['content_type'],
+        'filename': json_file['filename'],
+        'file': json_file['file']
+    })
+
+def make_responses(size: int) -> dict:
+    """
+    Returns the stored bytes and the metadata of a file in every format, so every run gets
+    a new get_object response.
+    """
+    document = os.urandom(size)
+    envelope = json.dumps({
+        'filename': 'bench.pdf', 'content_type': 'application/pdf',
+        'file': base64.b64encode(document).decode()
+    }).encode()
+    return {
+        'envelope': (envelope, {'encoded_content_type': cf.ENVELOPE_FORMAT}),
+        'raw': (document, cf.get_raw_file_metadata('bench.pdf', 'application/pdf'))
+    }
+
+def measure(build_body, stored: bytes, metadata: dict, repeat: int) -> dict:
+    """
+    Returns the best time and the peak of memory allocated while building the body.
+    """
+    def run():
+        return build_body({'Body': io.BytesIO(stored), 'Metadata': metadata})
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ms': round(min(times) * 1000, 2), 'peak_memory_mb': round(peak / 2**20, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 3, 4.5], help='Sizes of the document in MB')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for stored_format, (stored, metadata) in make_responses(int(size * 2**20)).items():
+            legacy_body = legacy_response_body({'Body': io.BytesIO(stored), 'Metadata': metadata})
+            new_body = cf.get_response_body_from_s3_response({'Body': io.BytesIO(stored), 'Metadata': metadata})
+            assert json.loads(legacy_body) == json.loads(new_body)
+            results.append({
+                'size_mb': size, 'format': stored_format,
+                'legacy': measure(legacy_response_body, stored, metadata, args.repeat),
+                'new': measure(cf.get_response_body_from_s3_response, stored, metadata, args.repeat)
+            })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
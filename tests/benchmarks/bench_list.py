@@ -0,0 +1,73 @@
+"""
+Benchmark of the /_list endpoint.
+Compares the S3 requests and the latency of the manifest of the contract (the first request
+builds it from the listing, without reading the versions) against the previous
+implementation, which listed the folders and then every file (N+1).
+
+    python tests/benchmarks/bench_list.py --files 10 100 500 --versions 3
+"""
+import argparse, json, time
+from datetime import datetime
+
+from benchmark_utils import S3CallCounter, cf, load_handler, make_api_event, put_file_versions, start_mock_aws
+
+
+def legacy_list(contract_number: str) -> list:
+    """
+    Previous implementation of /_list: one listing of the folders plus one listing per file.
+    """
+    s3_client = cf.get_client('s3')
+    filenames = s3_client.list_objects_v2(Bucket=cf.BUCKET, Prefix=f'{contract_number}/', Delimiter='/').get('CommonPrefixes')
+    items = []
+    for filename in filenames or []:
+        resp = s3_client.list_objects_v2(Bucket=cf.BUCKET, Prefix=filename['Prefix'], Delimiter='/')
+        latest_file = max(resp['Contents'], key=lambda x: datetime.strptime(
+            x['Key'].split('/')[-1].replace('.txt', ''), cf.DATETIME_FORMAT
+        ))
+        items.append({
+            'filename': latest_file['Key'].split('/')[1],
+            'size': latest_file['Size'],
+            'last_modified': latest_file['LastModified'].strftime('%Y/%m/%d %H:%M%S'),
+            'archived': latest_file['StorageClass'] in ['GLACIER', 'GLACIER_IR']
+        })
+    return items
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--versions', type=int, default=3)
+    args = parser.parse_args()
+
+    start_mock_aws()
+    list_app = load_handler('list')
+    counter = S3CallCounter()
+    results = []
+    for files in args.files:
+        contract_number = f'bench-list-{files}'
+        for i in range(files):
+            put_file_versions(contract_number, f'file{i:05d}', args.versions)
+
+        counter.reset()
+        start = time.perf_counter()
+        legacy_items = legacy_list(contract_number)
+        legacy_time, legacy_calls = time.perf_counter() - start, counter.total
+
+        # The first request builds the manifest of the contract, the next ones only read it
+        measures = []
+        for _ in range(2):
+            counter.reset()
+            start = time.perf_counter()
+            response = list_app.lambda_handler(make_api_event({'contract_number': contract_number}), None)
+            measures.append((time.perf_counter() - start, counter.total))
+            assert json.loads(response['body'])['filename_items'] == legacy_items
+        (rebuild_time, rebuild_calls), (new_time, new_calls) = measures
+        results.append({
+            'files': files, 'objects': files * args.versions,
+            'legacy_s3_calls': legacy_calls, 'rebuild_s3_calls': rebuild_calls, 's3_calls': new_calls,
+            'legacy_ms': round(legacy_time * 1000, 1), 'rebuild_ms': round(rebuild_time * 1000, 1),
+            'ms': round(new_time * 1000, 1)
+        })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
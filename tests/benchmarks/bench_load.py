@@ -0,0 +1,288 @@
+"""
+End-to-end load benchmark of the API handlers.
+Builds synthetic contracts in the in-memory S3 (--contracts, --files, --versions, --size-kb),
+replays a mix of requests (--mix) with --workers concurrent clients and reports, per endpoint,
+the p50/p95/p99 latency, the throughput, the status codes, the S3 calls per request and the peak memory.
+The requests are generated in advance from --seed, so two runs (e.g. of two commits) replay the same ones.
+The S3 calls and the memory are only attributed to the endpoints with a single worker: with more
+workers the requests share the client and the process at the same time, and only the totals are reported.
+The results are saved with --output, and compared with a previous output with --compare.
+
+    python tests/benchmarks/bench_load.py --mix read_heavy --requests 500 --output before.json
+    python tests/benchmarks/bench_load.py --mix read_heavy --requests 500 --compare before.json
+"""
+import argparse, base64, contextlib, json, math, os, random, subprocess, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from benchmark_utils import (
+    ROOT_PATH, RSSSampler, S3CallCounter, S3Latency, get_rss, load_handler, make_api_event, put_file_versions,
+    start_mock_aws
+)
+
+# Weight of every endpoint in the requests of a mix
+MIXES = {
+    'read_heavy': {
+        'get': 40, 'list': 15, 'list_versions': 15, 'batch_get': 10, 'presigned_url': 5, 'update': 10, 'create': 5
+    },
+    'write_heavy': {'update': 40, 'create': 15, 'delete': 10, 'bulk_delete': 5, 'get': 20, 'list': 10},
+    'balanced': {
+        'get': 1, 'batch_get': 1, 'list': 1, 'list_versions': 1, 'presigned_url': 1,
+        'create': 1, 'update': 1, 'delete': 1, 'bulk_delete': 1
+    },
+}
+BATCH_GET_ITEMS = 10
+BULK_DELETE_ITEMS = 5
+# Metrics compared with --compare, and if their increase is a regression
+COMPARED_METRICS = {
+    'p50_ms': True, 'p95_ms': True, 'p99_ms': True, 'throughput_rps': False,
+    's3_calls_per_request': True, 'peak_rss_increase_mb': True
+}
+
+
+def make_file(document: bytes, contract_number: str, filename: str) -> Dict:
+    return {
+        'contract_number': contract_number, 'filename': f'{filename}.txt', 'content_type': 'text/plain',
+        'file': base64.b64encode(document).decode()
+    }
+
+def build_contracts(contracts: int, files: int, versions: int, size: int, rng: random.Random) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Stores the synthetic contracts and returns their files and versions: {contract: {filename: [version_ids]}}.
+    """
+    stored = {}
+    for c in range(contracts):
+        contract_number = f'bench-load-{c:03d}'
+        stored[contract_number] = {
+            f'file{f:05d}': put_file_versions(contract_number, f'file{f:05d}', versions, rng.randbytes(size))
+            for f in range(files)
+        }
+    return stored
+
+def make_requests(mix: str, count: int, contracts: Dict[str, Dict[str, List[str]]], size: int, seed: int) -> List[Tuple[str, Dict]]:
+    """
+    Returns the requests to replay: (endpoint, event). Only the old versions of a file are deleted,
+    and each of them once, so every file keeps its latest version. Deletes are replaced by gets
+    once there are no old versions left.
+    """
+    rng = random.Random(seed)
+    endpoints, weights = zip(*MIXES[mix].items())
+    deletable = {
+        (contract_number, filename): list(version_ids[:-1])
+        for contract_number, files in contracts.items() for filename, version_ids in files.items()
+    }
+    requests = []
+    for i in range(count):
+        endpoint = rng.choices(endpoints, weights)[0]
+        contract_number = rng.choice(sorted(contracts))
+        filenames = sorted(contracts[contract_number])
+        filename = rng.choice(filenames)
+        if endpoint in ['delete', 'bulk_delete']:
+            candidates = [key for key, version_ids in sorted(deletable.items()) if version_ids]
+            if not candidates:
+                endpoint = 'get'
+            else:
+                contract_number, filename = rng.choice(candidates)
+
+        if endpoint in ['get', 'list_versions']:
+            body = {'contract_number': contract_number, 'filename': filename}
+        elif endpoint == 'list':
+            body = {'contract_number': contract_number}
+        elif endpoint == 'batch_get':
+            items = rng.sample(filenames, min(BATCH_GET_ITEMS, len(filenames)))
+            body = {'contract_number': contract_number, 'items': [{'filename': item} for item in items]}
+        elif endpoint == 'presigned_url':
+            body = {'contract_number': contract_number, 'filename': f'{filename}.txt', 'content_type': 'text/plain'}
+        elif endpoint == 'create':
+            body = make_file(rng.randbytes(size), contract_number, f'new{i:06d}')
+        elif endpoint == 'update':
+            body = make_file(rng.randbytes(size), contract_number, filename)
+        elif endpoint == 'delete':
+            version_id = deletable[(contract_number, filename)].pop(0)
+            body = {'contract_number': contract_number, 'filename': filename, 'version_id': version_id}
+        else:
+            version_ids = deletable[(contract_number, filename)]
+            items = [{'filename': filename, 'version_id': version_ids.pop(0)} for _ in range(min(BULK_DELETE_ITEMS, len(version_ids)))]
+            body = {'contract_number': contract_number, 'items': items}
+        requests.append((endpoint, make_api_event(body)))
+    return requests
+
+
+class Replay:
+    """
+    Runs the requests against the handlers and keeps a measure of each one.
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.counter = S3CallCounter()
+        self.sampler = RSSSampler()
+        self.measures = []
+
+    def run_request(self, request: Tuple[str, Dict]) -> Dict:
+        endpoint, event = request
+        handler = load_handler(endpoint).lambda_handler
+        attributed = self.workers == 1
+        if attributed:
+            self.counter.reset()
+            rss_before = self.sampler.reset()
+        start = time.perf_counter()
+        response = handler(event, None)
+        measure = {
+            'endpoint': endpoint, 'ms': (time.perf_counter() - start) * 1000,
+            'status_code': (response or {}).get('statusCode')
+        }
+        if attributed:
+            measure['s3_calls'] = dict(self.counter.calls)
+            measure['peak_rss'] = self.sampler.peak
+            measure['peak_rss_increase'] = max(measure['peak_rss'] - rss_before, 0)
+        return measure
+
+    def run(self, requests: List[Tuple[str, Dict]], warmup: int) -> Dict:
+        """
+        Replays the requests (the first `warmup` ones aren't measured) and returns the totals of the run.
+        """
+        self.sampler.start()
+        # The handlers log every invocation, which would hide the results
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for request in requests[:warmup]:
+                self.run_request(request)
+            self.counter.reset()
+            rss_before = self.sampler.reset()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                self.measures = list(executor.map(self.run_request, requests[warmup:]))
+            seconds = time.perf_counter() - start
+        peak = self.sampler.stop()
+        if self.workers == 1:
+            # The counter and the sampler are reset by every request
+            s3_calls = sum(sum(measure['s3_calls'].values()) for measure in self.measures)
+            peak = max([peak] + [measure['peak_rss'] for measure in self.measures])
+        else:
+            s3_calls = self.counter.total
+        return {
+            'requests': len(self.measures), 'seconds': round(seconds, 3),
+            'throughput_rps': round(len(self.measures) / seconds, 1),
+            **get_latency_percentiles([measure['ms'] for measure in self.measures]),
+            's3_calls_per_request': round(s3_calls / max(len(self.measures), 1), 2),
+            'peak_rss_increase_mb': round((peak - rss_before) / 2**20, 1)
+        }
+
+    def summarize(self, seconds: float) -> Dict[str, Dict]:
+        """
+        Returns the metrics of every endpoint.
+        """
+        endpoints = {}
+        for endpoint in sorted({measure['endpoint'] for measure in self.measures}):
+            measures = [measure for measure in self.measures if measure['endpoint'] == endpoint]
+            status_codes = {}
+            for measure in measures:
+                status_codes[str(measure['status_code'])] = status_codes.get(str(measure['status_code']), 0) + 1
+            summary = {
+                'requests': len(measures), 'throughput_rps': round(len(measures) / seconds, 1),
+                'status_codes': status_codes, **get_latency_percentiles([measure['ms'] for measure in measures])
+            }
+            if self.workers == 1:
+                operations = {}
+                for measure in measures:
+                    for operation, calls in measure['s3_calls'].items():
+                        operations[operation] = operations.get(operation, 0) + calls
+                summary['s3_calls_per_request'] = round(sum(operations.values()) / len(measures), 2)
+                summary['s3_calls_by_operation'] = {
+                    operation: round(calls / len(measures), 2) for operation, calls in sorted(operations.items())
+                }
+                summary['peak_rss_increase_mb'] = round(max(measure['peak_rss_increase'] for measure in measures) / 2**20, 1)
+            endpoints[endpoint] = summary
+        return endpoints
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile.
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+def get_latency_percentiles(latencies: List[float]) -> Dict:
+    if not latencies:
+        return {}
+    return {
+        'p50_ms': round(percentile(latencies, 50), 2), 'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2), 'max_ms': round(max(latencies), 2)
+    }
+
+def get_commit() -> Optional[str]:
+    """
+    Returns the commit of the tree being measured (with -dirty if it has changes), None outside of git.
+    """
+    try:
+        return subprocess.run(
+            ['git', '-C', str(ROOT_PATH), 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: Dict, baseline: Dict) -> Dict:
+    """
+    Returns the change of the compared metrics of every endpoint (and of the totals) against a previous output.
+    """
+    sections = {'total': (results['total'], baseline['total'])}
+    for endpoint, metrics in results['endpoints'].items():
+        if endpoint in baseline['endpoints']:
+            sections[endpoint] = (metrics, baseline['endpoints'][endpoint])
+    comparison = {}
+    for section, (metrics, baseline_metrics) in sections.items():
+        comparison[section] = {}
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            if metrics.get(metric) is None or baseline_metrics.get(metric) is None:
+                continue
+            before, after = baseline_metrics[metric], metrics[metric]
+            change = round((after - before) / before * 100, 1) if before else None
+            comparison[section][metric] = {
+                'before': before, 'after': after, 'change_pct': change,
+                'regression': change is not None and (change > 0 if higher_is_worse else change < 0)
+            }
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--contracts', type=int, default=5)
+    parser.add_argument('--files', type=int, default=20, help='Files per contract')
+    parser.add_argument('--versions', type=int, default=5, help='Versions per file')
+    parser.add_argument('--size-kb', type=float, default=20, help='Size of the documents')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='read_heavy')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20, help='Requests replayed before measuring')
+    parser.add_argument('--workers', type=int, default=1, help='Concurrent requests')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Simulated round trip of every S3 request')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='File where the results are saved (json)')
+    parser.add_argument('--compare', help='Results of a previous run (json) to compare with')
+    args = parser.parse_args()
+
+    start_mock_aws()
+    S3Latency(args.latency_ms)
+    size = int(args.size_kb * 1024)
+    rng = random.Random(args.seed)
+    contracts = build_contracts(args.contracts, args.files, args.versions, size, rng)
+    requests = make_requests(args.mix, args.warmup + args.requests, contracts, size, args.seed)
+    for endpoint in MIXES[args.mix]:
+        load_handler(endpoint)
+
+    replay = Replay(args.workers)
+    rss_before_run = get_rss()
+    total = replay.run(requests, args.warmup)
+    results = {
+        'commit': get_commit(), 'config': vars(args),
+        'total': {**total, 'rss_before_mb': round(rss_before_run / 2**20, 1)},
+        'endpoints': replay.summarize(total['seconds'])
+    }
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            results['comparison'] = compare(results, json.load(baseline_file))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
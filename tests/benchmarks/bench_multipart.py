@@ -0,0 +1,87 @@
+"""
+Benchmark of the multipart parsing of /_create and /_update.
+Compares the throughput and the peak memory of the zero-copy parser against the previous
+implementation (requests_toolbelt MultipartDecoder and the file re-encoded to base64).
+
+    python tests/benchmarks/bench_multipart.py --sizes 1 5 10 --repeat 5
+"""
+import argparse, base64, json, os, time, tracemalloc
+
+from requests_toolbelt.multipart import decoder
+
+from benchmark_utils import cf
+
+BOUNDARY = '----ApiVisorBenchmarkBoundary'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def make_multipart_body(document: bytes) -> bytes:
+    """
+    Returns a multipart body like the ones sent to /_create.
+    """
+    return b''.join([
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="contract_number"\r\n\r\nbench\r\n'.encode(),
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="bench.pdf"\r\n'.encode(),
+        b'Content-Type: application/pdf\r\n\r\n',
+        document,
+        f'\r\n--{BOUNDARY}--\r\n'.encode()
+    ])
+
+def legacy_parse(body: bytes) -> bytes:
+    """
+    Previous implementation: toolbelt parts, the file encoded to base64 and decoded again before the upload.
+    """
+    file_dict = {}
+    for part in decoder.MultipartDecoder(body, CONTENT_TYPE).parts:
+        disposition = part.headers[b'Content-Disposition'].decode()
+        name = disposition.split('name="')[1].split('"')[0]
+        if name == 'file':
+            file_dict['file'] = base64.b64encode(part.content).decode()
+        else:
+            file_dict[name] = part.text
+    return base64.b64decode(file_dict['file'])
+
+def new_parse(body: bytes) -> memoryview:
+    file_dict = cf.get_file_dict_from_multipart_body(body, CONTENT_TYPE)
+    return cf.decode_file(file_dict)
+
+def measure(parse, body: bytes, repeat: int) -> dict:
+    """
+    Returns the best time and the peak of memory allocated while parsing the body.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(body)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    parse(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(times)
+    return {
+        'ms': round(best * 1000, 2),
+        'mb_per_s': round(len(body) / best / 2**20, 1),
+        'peak_memory_mb': round(peak / 2**20, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10], help='Sizes of the file in MB')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        document = os.urandom(size * 2**20)
+        body = make_multipart_body(document)
+        assert legacy_parse(body) == document == new_parse(body)
+        results.append({
+            'size_mb': size,
+            'legacy': measure(legacy_parse, body, args.repeat),
+            'new': measure(new_parse, body, args.repeat)
+        })
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmark of the cold starts of the two deployment modes of template.yaml (DeploymentMode):
+a function per route, or the router function for all the routes.
+A mixed traffic (a trace of requests, or a synthetic one: Poisson arrivals of the routes of
+TRAFFIC_MIX at every rate of --rates) is replayed against a model of the containers of Lambda: a request runs
+in an idle container of its function, or starts a new one (a cold start), and the containers are
+reclaimed after --idle-minutes without requests. The init time of every function (and of the router,
+which imports all the handlers) is measured by importing its app in a new process.
+
+    python tests/benchmarks/bench_routing.py --rates 0.5 5 50 --hours 24
+    python tests/benchmarks/bench_routing.py --trace requests.jsonl
+
+A trace has a request per line: {"time": seconds, "routeKey": "POST /files/_get", "duration_ms": 80}
+(duration_ms is optional, --duration-ms by default).
+"""
+import argparse, json, os, random, statistics, subprocess, sys, time
+from typing import Dict, List
+
+from bench_cold_start import ROOT_PATH, get_template_functions, load_app
+
+# Weight of every route in the synthetic traffic
+TRAFFIC_MIX = {
+    'POST /files/_get': 35, 'POST /files/_list': 15, 'POST /files/_presigned_url': 10, 'PUT /files/_update': 10,
+    'POST /files/_batch_get': 6, 'POST /files/_create': 5, 'POST /files/_multipart_upload': 4,
+    'POST /files/_list_versions': 4, 'GET /health': 4, 'POST /files/_delete': 3, 'POST /files/_dismiss_status': 2,
+    'POST /files/_bulk_delete': 1, 'PATCH /files/_dismiss': 1,
+}
+ROUTER = 'router'
+
+
+def get_routes() -> Dict[str, str]:
+    """
+    Returns the function of every route ({routeKey: folder of functions/}), from the router.
+    """
+    # Only the routes, without importing the handlers (nor their init phase)
+    os.environ['ROUTER_PRELOAD'] = 'false'
+    sys.path.insert(0, str(ROOT_PATH / 'functions'))
+    from router.app import ROUTES
+    del os.environ['ROUTER_PRELOAD']
+    return ROUTES
+
+def measure_init_ms(function_dir: str, environment: Dict, runs: int) -> float:
+    """
+    Returns the median time to import the app of a function in a new process (its init phase).
+    """
+    from benchmark_utils import DEFAULT_ENVIRONMENT
+
+    measures = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', function_dir], capture_output=True, text=True, check=True,
+            env={**os.environ, **environment, **DEFAULT_ENVIRONMENT}
+        ).stdout
+        measures.append(json.loads(output.strip().splitlines()[-1])['import_ms'])
+    return statistics.median(measures)
+
+def make_traffic(rate_per_minute: float, hours: float, duration_ms: float, seed: int) -> List[Dict]:
+    """
+    Returns a synthetic trace: Poisson arrivals with the weights of TRAFFIC_MIX.
+    """
+    rng = random.Random(seed)
+    routes, weights = zip(*TRAFFIC_MIX.items())
+    requests, now = [], 0.0
+    while True:
+        now += rng.expovariate(rate_per_minute / 60)
+        if now > hours * 3600:
+            return requests
+        requests.append({'time': now, 'routeKey': rng.choices(routes, weights)[0], 'duration_ms': duration_ms})
+
+def load_trace(path: str, duration_ms: float) -> List[Dict]:
+    with open(path) as trace_file:
+        requests = [json.loads(line) for line in trace_file if line.strip()]
+    for request in requests:
+        request.setdefault('duration_ms', duration_ms)
+    return sorted(requests, key=lambda request: request['time'])
+
+
+def replay(requests: List[Dict], function_of_route, init_ms: Dict[str, float], idle_seconds: float) -> Dict:
+    """
+    Replays the requests against the containers of the functions and returns the cold starts.
+    Every container runs a request at a time; a request takes the idle container used last
+    (the warmest one), or starts a new container, which runs the init phase of its function first.
+    """
+    # Time every container of a function is busy until
+    containers: Dict[str, List[float]] = {}
+    routes: Dict[str, Dict] = {}
+    cold_starts, init_total_ms = 0, 0.0
+    for request in requests:
+        function_dir = function_of_route(request['routeKey'])
+        now, duration = request['time'], request['duration_ms'] / 1000
+        pool = [busy_until for busy_until in containers.get(function_dir, []) if now <= busy_until + idle_seconds]
+        idle = [busy_until for busy_until in pool if busy_until <= now]
+        route = routes.setdefault(request['routeKey'], {'requests': 0, 'cold_starts': 0})
+        route['requests'] += 1
+        if idle:
+            pool.remove(max(idle))
+            pool.append(now + duration)
+        else:
+            cold_starts += 1
+            route['cold_starts'] += 1
+            init_total_ms += init_ms[function_dir]
+            pool.append(now + init_ms[function_dir] / 1000 + duration)
+        containers[function_dir] = pool
+    return {
+        'requests': len(requests), 'cold_starts': cold_starts,
+        'cold_start_rate': round(cold_starts / max(len(requests), 1), 4),
+        # Latency added by the init phases, spread over all the requests
+        'init_ms_per_request': round(init_total_ms / max(len(requests), 1), 2),
+        'routes': routes
+    }
+
+def compare_modes(requests: List[Dict], routes: Dict[str, str], init_ms: Dict[str, float], idle_seconds: float) -> Dict:
+    functions = replay(requests, lambda route: routes[route], init_ms, idle_seconds)
+    router = replay(requests, lambda route: ROUTER, init_ms, idle_seconds)
+    route_keys = sorted(functions['routes'], key=lambda route: -functions['routes'][route]['requests'])
+    return {
+        'requests': len(requests),
+        'functions': {key: value for key, value in functions.items() if key != 'routes'},
+        'router': {key: value for key, value in router.items() if key != 'routes'},
+        'routes': {
+            route: {
+                'requests': functions['routes'][route]['requests'],
+                'functions_cold_start_rate': round(
+                    functions['routes'][route]['cold_starts'] / functions['routes'][route]['requests'], 4
+                ),
+                'router_cold_start_rate': round(
+                    router['routes'][route]['cold_starts'] / router['routes'][route]['requests'], 4
+                ),
+            }
+            for route in route_keys
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rates', type=float, nargs='+', default=[0.5, 5, 50], help='Requests per minute of the synthetic traffic')
+    parser.add_argument('--hours', type=float, default=24, help='Duration of the synthetic traffic')
+    parser.add_argument('--trace', help='Trace to replay instead of the synthetic traffic (json lines)')
+    parser.add_argument('--duration-ms', type=float, default=100, help='Duration of the requests (warm)')
+    parser.add_argument('--idle-minutes', type=float, default=10, help='Time an idle container is kept')
+    parser.add_argument('--init-runs', type=int, default=3, help='Imports measured per function (the median is used)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--child', metavar='FUNCTION', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        start = time.perf_counter()
+        load_app(ROOT_PATH, args.child)
+        print(json.dumps({'import_ms': (time.perf_counter() - start) * 1000}))
+        return
+
+    routes = get_routes()
+    environments = get_template_functions(ROOT_PATH)
+    init_ms = {
+        function_dir: round(measure_init_ms(function_dir, environments[function_dir], args.init_runs), 1)
+        for function_dir in sorted(set(routes.values()) | {ROUTER})
+    }
+    idle_seconds = args.idle_minutes * 60
+    if args.trace:
+        traffics = [('trace', load_trace(args.trace, args.duration_ms))]
+    else:
+        traffics = [
+            (rate, make_traffic(rate, args.hours, args.duration_ms, args.seed)) for rate in args.rates
+        ]
+    results = [
+        {'rate_per_minute': rate, **compare_modes(requests, routes, init_ms, idle_seconds)}
+        for rate, requests in traffics
+    ]
+    print(json.dumps({'init_ms': init_ms, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
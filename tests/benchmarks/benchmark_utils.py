@@ -0,0 +1,162 @@
+"""
+Helpers shared by the benchmarks.
+The lambda handlers are imported in-process and run against an in-memory S3 (moto),
+so neither an AWS account nor `sam local` are needed.
+"""
+import base64, collections, importlib.util, json, os, sys, threading, time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+DEFAULT_ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'BUCKET': 'benchmark-bucket',
+    'BUCKET_TEMP': 'benchmark-temp-bucket',
+    'TEMP_BUCKET': 'benchmark-temp-bucket',
+    'SNS_ARN': 'arn:aws:sns:us-east-1:123456789012:benchmark-topic',
+}
+for env_key, env_value in DEFAULT_ENVIRONMENT.items():
+    os.environ.setdefault(env_key, env_value)
+sys.path.insert(0, str(ROOT_PATH / 'layers' / 'common'))
+
+# moto has to be imported before any client is created
+from moto import mock_aws
+
+import common_funcs as cf
+
+
+def start_mock_aws():
+    """
+    Starts the in-memory AWS and creates the buckets and the topic used by the functions.
+    """
+    mock = mock_aws()
+    mock.start()
+    s3_client = cf.get_client('s3')
+    s3_client.create_bucket(Bucket=os.environ['BUCKET'])
+    s3_client.put_bucket_versioning(
+        Bucket=os.environ['BUCKET'], VersioningConfiguration={'Status': 'Enabled'}
+    )
+    s3_client.create_bucket(Bucket=os.environ['TEMP_BUCKET'])
+    cf.get_client('sns').create_topic(Name=os.environ['SNS_ARN'].split(':')[-1])
+    return mock
+
+def load_handler(function_name: str):
+    """
+    Imports the app module of a function (functions/{function_name}/app.py).
+    """
+    module_name = f'{function_name}_app'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(
+        module_name, ROOT_PATH / 'functions' / function_name / 'app.py'
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def make_api_event(body: Dict, content_type: str='application/json', headers: Dict=None) -> Dict:
+    """
+    Returns an API Gateway event with a json body.
+    """
+    event_headers = {'content-type': content_type}
+    event_headers.update(headers or {})
+    return {
+        'isBase64Encoded': 'false',
+        'headers': event_headers,
+        'body': body if isinstance(body, str) else json.dumps(body)
+    }
+
+def make_version_ids(versions: int) -> List[str]:
+    """
+    Returns `versions` consecutive version ids, one per second.
+    """
+    first_version = 1609459200 # 2021-01-01 00:00:00
+    return [
+        time.strftime(cf.DATETIME_FORMAT, time.gmtime(first_version + i)) for i in range(versions)
+    ]
+
+def put_file_versions(contract_number: str, filename: str, versions: int, document: bytes=b'benchmark') -> List[str]:
+    """
+    Stores `versions` versions of a file and returns their version ids.
+    """
+    s3_client = cf.get_client('s3')
+    file_encoded = json.dumps({
+        'filename': filename, 'content_type': 'text/plain',
+        'file': base64.b64encode(document).decode()
+    })
+    version_ids = make_version_ids(versions)
+    for version_id in version_ids:
+        s3_client.put_object(
+            Bucket=os.environ['BUCKET'], Key=f'{contract_number}/{filename}/{version_id}.txt',
+            Body=file_encoded, Metadata={'encoded_content_type': 'application/json'}
+        )
+    return version_ids
+
+
+class S3CallCounter:
+    """
+    Counts the requests sent by the shared S3 client, by operation.
+    """
+    def __init__(self):
+        self.calls = collections.Counter()
+        cf.get_client('s3').meta.events.register('before-call.s3', self._count_call)
+
+    def _count_call(self, event_name: str, **kwargs):
+        self.calls[event_name.split('.')[-1]] += 1
+
+    def reset(self):
+        self.calls.clear()
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+class S3Latency:
+    """
+    Adds a fixed delay to every request sent by the shared S3 client, to simulate the round trip
+    to S3 that the in-memory moto doesn't have (so the concurrency of the handlers can be measured).
+    """
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        cf.get_client('s3').meta.events.register('before-send.s3', self._delay)
+
+    def _delay(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class RSSSampler(threading.Thread):
+    """
+    Samples the resident memory of the process until it's stopped, and keeps the peak.
+    """
+    def __init__(self, interval: float=0.002):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = get_rss()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, get_rss())
+            time.sleep(self.interval)
+
+    def reset(self) -> int:
+        """
+        Starts a new window: the peak is the current memory again, which is returned.
+        """
+        self.peak = get_rss()
+        return self.peak
+
+    def stop(self) -> int:
+        self._stopped.set()
+        self.join()
+        return self.peak
+
+def get_rss() -> int:
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
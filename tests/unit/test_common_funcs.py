@@ -0,0 +1,61 @@
+import io, json, os, sys
+
+# The common layer is tested without sam local: it only needs a bucket name to be imported
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'layers', 'common'))
+os.environ.setdefault('BUCKET', 'unit-tests')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('INIT_CLIENTS', '')
+import common_funcs as cf
+
+FILE = 'UklHSFQ='
+
+
+def get_response(envelope: dict) -> dict:
+    """
+    A get_object response of an envelope (the files stored before RAW_FORMAT).
+    """
+    return {'Body': io.BytesIO(json.dumps(envelope).encode()), 'Metadata': {}}
+
+
+def test_envelope_file_span():
+    envelope = json.dumps({'filename': 'a.txt', 'content_type': 'text/plain', 'file': FILE}).encode()
+    start, end = cf.get_envelope_file_span(envelope)
+    assert envelope[start:end] == FILE.encode()
+
+def test_envelope_nested_file_key():
+    """
+    Only the "file" key of the envelope is sliced, not the "file" keys of nested objects.
+    """
+    envelopes = [
+        {'meta': {'file': 'WRONG'}, 'filename': 'a.txt', 'content_type': 'text/plain', 'file': FILE},
+        {'filename': 'a.txt', 'content_type': 'text/plain', 'files': [{'file': 'WRONG'}], 'file': FILE},
+        {'filename': 'a.txt', 'content_type': 'text/plain', 'note': '"file": "WRONG"', 'file': FILE},
+    ]
+    for envelope in envelopes:
+        body = json.loads(cf.get_response_body_from_s3_response(get_response(envelope)))
+        assert body == {'content_type': 'text/plain', 'filename': 'a.txt', 'file': FILE}
+
+def test_envelope_that_cant_be_sliced():
+    """
+    Files that aren't strings or have escaped characters are returned by parsing the whole envelope.
+    """
+    assert cf.get_envelope_file_span(b'{"file": 1}') is None
+    assert cf.get_envelope_file_span(b'{"file": "a\\/b"}') is None
+    assert cf.get_envelope_file_span(b'{"meta": {"file": "a"}}') is None
+
+    envelope = {'filename': 'a.txt', 'content_type': 'text/plain', 'file': 'a/b'}
+    body = get_response(envelope)
+    body['Body'] = io.BytesIO(json.dumps(envelope).replace('/', '\\/').encode())
+    assert json.loads(cf.get_response_body_from_s3_response(body)) == {
+        'content_type': 'text/plain', 'filename': 'a.txt', 'file': 'a/b'
+    }
+
+def test_document_size():
+    """
+    The size of a compressed document is the one it had before it was compressed, as the writers
+    record it in the manifests.
+    """
+    raw_metadata = cf.get_raw_file_metadata('a.txt', 'text/plain')
+    assert cf.get_document_size(96, raw_metadata) == 96
+    assert cf.get_document_size(96, {**raw_metadata, 'content_encoding': 'gzip', 'uncompressed_size': '24000'}) == 24000
+    assert cf.get_inline_response_size(96, {**raw_metadata, 'uncompressed_size': '24000'}) == 32000
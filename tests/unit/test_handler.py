@@ -1,4 +1,5 @@
-import json, time
+import base64, copy, json, time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Dict
 
 import pytest
@@ -13,14 +14,25 @@ def get_statuscode_and_body_from_response(response: Dict) -> Tuple[int, Dict]:
     return_response_body = json.loads(return_response.get('body', '{}'))
     return return_response_status, return_response_body
 
+def invoke_function(lambda_client, request: Dict, function_name: str, body: Dict) -> Tuple[int, Dict]:
+    """
+    Invokes a function with a copy of the request and a body, so it can be called from many threads.
+    """
+    request = copy.deepcopy(request)
+    request['body'] = json.dumps(body)
+    response = lambda_client.invoke(FunctionName=function_name, 
+        Payload=bytes(json.dumps(request), encoding='utf-8')
+    )
+    return get_statuscode_and_body_from_response(response)
+
 @pytest.mark.common_errors
 def test_no_body(request_no_body: Dict, lambda_client):
     """
     Test endpoints that require a body in the request. They should respond with an 400 error.
     """
     functions_with_body_required = [
-        'CreateFunction', 'DeleteFunction', 'DismissFunction', 'GetFunction',
-        'ListFunction', 'ListVersionsFunction', 'PresignedUrlFunction', 
+        'BatchGetFunction', 'BulkDeleteFunction', 'CreateFunction', 'DeleteFunction', 'DismissFunction', 'DismissStatusFunction', 'GetFunction',
+        'ListFunction', 'ListVersionsFunction', 'MultipartUploadFunction', 'PresignedUrlFunction', 
         'UpdateFunction',
     ]
 
@@ -137,6 +149,29 @@ def test_update(request_no_body: Dict, lambda_client):
     assert status_code_resp == 201
     assert body_resp.get('message') == 'File updated.'
 
+@pytest.mark.normal_flow
+def test_update_not_modified(request_no_body: Dict, lambda_client):
+    """
+    Test the /_update endpoint, it tries to update a file with the same file of its latest version.
+    It should respond with a 200 code and without creating a new version.
+    """
+    test_file = DefaultTestValues().load_test_current_file()
+
+    test_file['filename'] = DefaultTestValues.filename
+    test_file['contract_number'] = DefaultTestValues.contract_number
+
+    request_no_body['headers']['content-type'] = 'application/json'
+    request_no_body['body'] = json.dumps(test_file)
+
+    response = lambda_client.invoke(FunctionName="UpdateFunction", 
+        Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+    )
+    
+    status_code_resp, body_resp = get_statuscode_and_body_from_response(response)
+    assert status_code_resp == 200
+    assert body_resp.get('message') == 'File not modified.'
+    assert 'version_id' in body_resp
+
 @pytest.mark.normal_flow
 def test_list_files(request_no_body: Dict, lambda_client):
     """
@@ -196,6 +231,7 @@ def test_list_versions(request_no_body: Dict, lambda_client):
         assert 'last_modified' in version
         assert 'is_latest' in version
         assert 'size' in version
+        assert len(version['sha256']) == 64
         assert version['archived'] == False
 
         if version['is_latest'] == True:
@@ -287,6 +323,68 @@ def test_get_versioned_file(request_no_body: Dict, lambda_client):
     assert body_resp['file'] == expected_file['file']
     assert body_resp['content_type'] == expected_file['content_type']
 
+@pytest.mark.normal_flow
+def test_get_versioned_file_not_modified(request_no_body: Dict, lambda_client):
+    """
+    Test the /_get endpoint, it tries to get a version file that the client already has (its ETag).
+    It should respond with a 304 code and without the file.
+    """
+    test_data = DefaultTestValues().load_data()
+
+    body = {
+        'contract_number': DefaultTestValues.contract_number,
+        'filename': DefaultTestValues.filename,
+        'version_id': test_data['versioned_file_version']
+    }
+    request_no_body['body'] = json.dumps(body)
+
+    response = lambda_client.invoke(FunctionName="GetFunction", 
+        Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+    )
+    etag = json.loads(response['Payload'].read().decode())['headers']['ETag']
+
+    request_no_body['headers']['if-none-match'] = etag
+    response = lambda_client.invoke(FunctionName="GetFunction", 
+        Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+    )
+
+    status_code_resp, body_resp = get_statuscode_and_body_from_response(response)    
+
+    assert status_code_resp == 304
+    assert body_resp == {}
+
+@pytest.mark.normal_flow
+def test_batch_get_files(request_no_body: Dict, lambda_client):
+    """
+    Test the /_batch_get endpoint, it tries to get both versions of the file with a single request.
+    It should respond with a 200 code and with both files inline, in the order of the request.
+    """
+    test_data = DefaultTestValues().load_data()
+
+    body = {
+        'contract_number': DefaultTestValues.contract_number,
+        'items': [
+            {'filename': DefaultTestValues.filename, 'version_id': test_data['versioned_file_version']},
+            {'filename': DefaultTestValues.filename, 'version_id': test_data['current_file_version']}
+        ]
+    }
+    request_no_body['body'] = json.dumps(body)
+
+    # load the files which are expected to return
+    expected_files = [DefaultTestValues().load_test_versioned_file(), DefaultTestValues().load_test_current_file()]
+
+    response = lambda_client.invoke(FunctionName="BatchGetFunction", 
+        Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+    )
+
+    status_code_resp, body_resp = get_statuscode_and_body_from_response(response)    
+
+    assert status_code_resp == 200
+    for item, expected_file in zip(body_resp['items'], expected_files):
+        assert item['status'] == 'inline'
+        assert item['filename'] == DefaultTestValues.filename
+        assert item['file'] == expected_file['file']
+
 @pytest.mark.normal_flow
 def test_dismiss_contract_number(request_no_body: Dict, lambda_client):
     """
@@ -307,6 +405,19 @@ def test_dismiss_contract_number(request_no_body: Dict, lambda_client):
     assert status_code_resp == 200
     assert body_resp.get('message') == 'Files dismissed succesfully.'
 
+    # The dismiss job of the contract is recorded as completed
+    request_no_body['body'] = json.dumps({'job_id': body_resp['job_id']})
+    response = lambda_client.invoke(FunctionName="DismissStatusFunction", 
+        Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+    )
+
+    status_code_resp, body_resp = get_statuscode_and_body_from_response(response)    
+
+    assert status_code_resp == 200
+    assert body_resp.get('status') == 'completed'
+    assert body_resp.get('contract_number') == DefaultTestValues.contract_number
+    assert body_resp.get('failed') == 0
+
 @pytest.mark.normal_flow
 def test_dismiss_already_dismissed_contract_number(request_no_body: Dict, lambda_client):
     """
@@ -381,6 +492,104 @@ def test_delete_already_deleted_files(request_no_body: Dict, lambda_client):
         assert status_code_resp == 404
         assert body_resp.get('error') == 'File not found.'
 
+@pytest.mark.normal_flow
+def test_bulk_delete_already_deleted_files(request_no_body: Dict, lambda_client):
+    """
+    Test the /_bulk_delete endpoint, it tries to delete the versions already deleted by /_delete.
+    It should respond with a 404 code and with the result of every version.
+    """
+    test_data = DefaultTestValues().load_data()
+    versions = [test_data[version] for version in ['versioned_file_version', 'current_file_version']]
+    body = {
+        'contract_number': DefaultTestValues.contract_number,
+        'items': [{'filename': DefaultTestValues.filename, 'version_id': version} for version in versions]
+    }
+    request_no_body['body'] = json.dumps(body)
+
+    response = lambda_client.invoke(FunctionName="BulkDeleteFunction", 
+        Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+    )
+
+    status_code_resp, body_resp = get_statuscode_and_body_from_response(response)    
+
+    assert status_code_resp == 404
+    assert body_resp.get('error') == 'File not found.'
+    assert [result['status'] for result in body_resp['results']] == ['not_found', 'not_found']
+
+@pytest.mark.concurrency
+def test_concurrent_updates(request_no_body: Dict, lambda_client):
+    """
+    Test the /_update endpoint, it fires hundreds of parallel updates (with different files) at one file.
+    Every update should respond with a 201 code and store its own version, none overwritten by another.
+    """
+    concurrent_updates = 200
+    contract_number = f'{DefaultTestValues.contract_number}Concurrency'
+    test_file = DefaultTestValues().load_test_current_file()
+    test_file['filename'] = DefaultTestValues.filename
+    test_file['contract_number'] = contract_number
+    request_no_body['headers']['content-type'] = 'application/json'
+
+    status_code_resp, _ = invoke_function(lambda_client, request_no_body, 'CreateFunction', test_file)
+    assert status_code_resp == 201
+
+    def update(index: int) -> Tuple[int, Dict]:
+        update_file = dict(test_file, file=base64.b64encode(f'Update number {index}'.encode()).decode())
+        return invoke_function(lambda_client, request_no_body, 'UpdateFunction', update_file)
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        responses = list(executor.map(update, range(concurrent_updates)))
+    assert [status_code for status_code, _ in responses] == [201] * concurrent_updates
+
+    status_code_resp, body_resp = invoke_function(lambda_client, request_no_body, 'ListVersionsFunction', {
+        'contract_number': contract_number, 'filename': DefaultTestValues.filename
+    })
+    assert status_code_resp == 200
+    version_ids = [version['version_id'] for version in body_resp['versions']]
+    assert len(set(version_ids)) == concurrent_updates + 1
+    assert version_ids == sorted(version_ids)
+
+    status_code_resp, _ = invoke_function(lambda_client, request_no_body, 'BulkDeleteFunction', {
+        'contract_number': contract_number, 'all_files': True
+    })
+    assert status_code_resp == 200
+
+@pytest.mark.concurrency
+def test_concurrent_creates(request_no_body: Dict, lambda_client):
+    """
+    Test the /_create endpoint, it fires many parallel creates of the same file.
+    Only one of them should respond with a 201 code, the others with the 400 error of an existing file.
+    """
+    concurrent_creates = 50
+    contract_number = f'{DefaultTestValues.contract_number}Concurrency'
+    test_file = DefaultTestValues().load_test_versioned_file()
+    test_file['filename'] = DefaultTestValues.filename
+    test_file['contract_number'] = contract_number
+    request_no_body['headers']['content-type'] = 'application/json'
+
+    def create(index: int) -> Tuple[int, Dict]:
+        create_file = dict(test_file, file=base64.b64encode(f'Create number {index}'.encode()).decode())
+        return invoke_function(lambda_client, request_no_body, 'CreateFunction', create_file)
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        responses = list(executor.map(create, range(concurrent_creates)))
+    status_codes = [status_code for status_code, _ in responses]
+    assert status_codes.count(201) == 1
+    assert status_codes.count(400) == concurrent_creates - 1
+    for status_code, body_resp in responses:
+        if status_code == 400:
+            assert body_resp.get('error') == 'A filename already exists in that contract_number.'
+
+    status_code_resp, body_resp = invoke_function(lambda_client, request_no_body, 'ListVersionsFunction', {
+        'contract_number': contract_number, 'filename': DefaultTestValues.filename
+    })
+    assert status_code_resp == 200
+    assert len(body_resp['versions']) == 1
+
+    status_code_resp, _ = invoke_function(lambda_client, request_no_body, 'BulkDeleteFunction', {
+        'contract_number': contract_number, 'all_files': True
+    })
+    assert status_code_resp == 200
+
 @pytest.mark.big_files_flow
 def test_create_wrong_big_file(request_no_body: Dict, lambda_client):
     """
@@ -446,6 +655,51 @@ def test_check_no_wrong_file_in_bucket(request_no_body: Dict, lambda_client):
     assert status_code_resp == 404
     assert body_resp.get('error') == 'Contract Number not found.'
     
+@pytest.mark.big_files_flow
+def test_multipart_upload_aborted(request_no_body: Dict, lambda_client):
+    """
+    Test the /_presigned_url endpoint in multipart mode, it uploads a part of a file and then
+    aborts the upload with the /_multipart_upload endpoint.
+    It should respond with a 200 code, and with a 404 code when the upload is aborted again.
+    """
+    big_file = json.dumps(DefaultTestValues().load_test_big_file()).encode()
+    body = {
+        'contract_number': DefaultTestValues.contract_number,
+        'filename': DefaultTestValues.filename,
+        'upload_mode': 'multipart',
+        'file_size': len(big_file),
+        'part_size': len(big_file)
+    }
+    request_no_body['body'] = json.dumps(body)
+
+    response = lambda_client.invoke(FunctionName="PresignedUrlFunction", 
+        Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+    )
+
+    status_code_resp, body_resp = get_statuscode_and_body_from_response(response)    
+
+    assert status_code_resp == 200
+    assert len(body_resp['parts']) == 1
+
+    upload_response = requests.put(body_resp['parts'][0]['url'], data=big_file)
+    assert upload_response.status_code == 200
+
+    body = {
+        'contract_number': DefaultTestValues.contract_number,
+        'filename': DefaultTestValues.filename,
+        'version_id': body_resp['version_id'],
+        'upload_id': body_resp['upload_id'],
+        'action': 'abort'
+    }
+    request_no_body['body'] = json.dumps(body)
+
+    for expected_status_code in [200, 404]:
+        response = lambda_client.invoke(FunctionName="MultipartUploadFunction", 
+            Payload=bytes(json.dumps(request_no_body), encoding='utf-8')
+        )
+        status_code_resp, body_resp = get_statuscode_and_body_from_response(response)    
+        assert status_code_resp == expected_status_code
+
 @pytest.mark.big_files_flow
 def test_create_big_file(request_no_body: Dict, lambda_client):
     """
@@ -0,0 +1,122 @@
+import json, os, sys
+from typing import Iterable, List
+
+import pytest
+
+# The scanner is a module of the common layer, it's tested without sam local
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'layers', 'common'))
+from json_scanner import JsonScanError, JsonScanner, get_string_value_span, scan_object_keys
+
+# Chunk sizes the documents are split in: every token can be cut between two chunks
+CHUNK_SIZES = [1, 2, 3, 7, 64, 1024 * 1024]
+
+VALID_DOCUMENTS = [
+    '{}',
+    '{"a": 1}',
+    ' {"a" : [] , "b":{} } \n',
+    '{"filename": "a.pdf", "content_type": "application/pdf", "file": "JVBERi0xLjQ="}',
+    '{"n": [0, -1, 2.5, -3e10, 4E-2, 1.0e+3], "t": true, "f": false, "z": null}',
+    '{"nested": {"a": [1, {"b": [[], {}]}], "c": "d"}, "e": [{"f": null}]}',
+    '{"long": "' + 'a' * 100000 + '", "after": 1}',
+    '{"escapes": "\\" \\\\ \\/ \\b \\f \\n \\r \\t \\u00e9 \\ud83d\\ude00"}',
+    '{"utf-8": "é 😀 ñ", "ключ": "значение"}',
+    '{"repeated": 1, "repeated": 2}',
+    '{"a\\"b": 1, "\\u0063": 2}',
+]
+
+INVALID_DOCUMENTS = [
+    '', ' ', '[]', '"a"', '1', 'null',
+    '{', '{"a"}', '{"a":}', '{"a": 1,}', '{"a": 1 "b": 2}', '{a: 1}', "{'a': 1}",
+    '{"a": [1, 2}', '{"a": {"b": 1]}', '{"a": 1}}', '{"a": 1} {}', '{"a": 1}x',
+    '{"a": tru}', '{"a": nul}', '{"a": 01}', '{"a": 1.}', '{"a": .5}', '{"a": +1}',
+    '{"a": "\\x"}', '{"a": "\\u12G4"}', '{"a": "\\u12"}', '{"a": "line\nbreak"}', '{"a": "tab\there"}',
+]
+
+
+def split(document: bytes, chunk_size: int) -> List[bytes]:
+    return [document[i:i + chunk_size] for i in range(0, len(document), chunk_size)]
+
+def assert_scan_error(chunks: Iterable[bytes]):
+    with pytest.raises(JsonScanError):
+        scan_object_keys(chunks)
+
+
+@pytest.mark.parametrize('document', VALID_DOCUMENTS)
+def test_valid_documents(document: str):
+    """
+    The keys of the valid documents are the same json.loads returns, whatever their chunks are.
+    """
+    encoded = document.encode('utf-8')
+    expected_keys = set(json.loads(document))
+    for chunk_size in CHUNK_SIZES:
+        assert scan_object_keys(split(encoded, chunk_size)) == expected_keys
+
+@pytest.mark.parametrize('document', INVALID_DOCUMENTS)
+def test_invalid_documents(document: str):
+    """
+    The documents json.loads rejects (or that aren't objects) are rejected.
+    """
+    try:
+        is_object = isinstance(json.loads(document), dict)
+    except ValueError:
+        is_object = False
+    assert not is_object
+    for chunk_size in CHUNK_SIZES:
+        assert_scan_error(split(document.encode('utf-8'), chunk_size))
+
+@pytest.mark.parametrize('document', VALID_DOCUMENTS[1:])
+def test_truncated_documents(document: str):
+    """
+    Every prefix of a valid document is rejected, like json.loads does.
+    """
+    encoded = document.encode('utf-8').rstrip()
+    # The long string is only cut at some points
+    ends = range(1, len(encoded)) if len(encoded) < 1000 else [1, 10, 500, 50000, len(encoded) - 5]
+    for end in ends:
+        truncated = encoded[:end]
+        with pytest.raises(ValueError):
+            json.loads(truncated)
+        for chunk_size in [1, 7, 1024 * 1024]:
+            assert_scan_error(split(truncated, chunk_size))
+
+def test_non_standard_numbers():
+    """
+    NaN and Infinity are accepted by json.loads, but they aren't JSON.
+    """
+    for number in ['NaN', 'Infinity', '-Infinity']:
+        json.loads('{"a": %s}' % number)
+        assert_scan_error([b'{"a": %s}' % number.encode()])
+
+def test_deeply_nested_documents():
+    """
+    The nesting is scanned without recursion, so any depth is accepted (json.loads has a limit).
+    """
+    depth = 100000
+    document = ('{"a": ' + '[{"b": ' * depth + 'null' + '}]' * depth + ', "c": 1}').encode()
+    with pytest.raises(RecursionError):
+        json.loads(document)
+    assert scan_object_keys(split(document, 4096)) == {'a', 'c'}
+
+    assert_scan_error([document[:-1]])
+    assert_scan_error([document.replace(b'}]}]', b'}}]]', 1)])
+
+def test_invalid_utf8():
+    assert_scan_error([b'{"a": "\xff"}'])
+    # A character cut between two chunks is valid, a character cut at the end isn't
+    character = 'é'.encode('utf-8')
+    assert scan_object_keys([b'{"a": "' + character[:1], character[1:] + b'"}']) == {'a'}
+    assert_scan_error([b'{"a": "' + character[:1]])
+
+def test_string_value_spans():
+    """
+    The spans of the top-level strings are their raw content (escapes included), nested keys are ignored.
+    """
+    document = json.dumps({
+        'meta': {'file': 'nested'}, 'list': [{'file': 'nested'}], 'number': 1,
+        'escaped': 'a"b\n', 'file': 'top-level'
+    }).encode()
+    spans = JsonScanner(split(document, 3)).scan_object()
+    assert spans['meta'] is None and spans['list'] is None and spans['number'] is None
+    assert json.loads(b'"' + document[slice(*spans['escaped'])] + b'"') == 'a"b\n'
+    assert document[slice(*get_string_value_span(document, 'file'))] == b'top-level'
+    assert get_string_value_span(b'{"meta": {"file": "nested"}}', 'file') is None
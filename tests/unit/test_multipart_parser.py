@@ -0,0 +1,114 @@
+import os, sys
+from typing import List
+
+import pytest
+
+# The parser is a module of the common layer, it's tested without sam local
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'layers', 'common'))
+from multipart_parser import BufferReader, MultipartError, iter_multipart_parts
+
+BOUNDARY = '----ApiVisorBoundary'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def make_body(*parts: bytes, closing: bytes=b'--' + BOUNDARY.encode() + b'--\r\n') -> bytes:
+    delimiter = b'--' + BOUNDARY.encode()
+    return b''.join(delimiter + b'\r\n' + part + b'\r\n' for part in parts) + closing
+
+def file_part(content: bytes, name: str='file', filename: str='a.pdf') -> bytes:
+    return (
+        f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+        'Content-Type: application/pdf\r\n\r\n'
+    ).encode() + content
+
+def field_part(name: str, value: str) -> bytes:
+    return f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}'.encode()
+
+def parse(body: bytes, content_type: str=CONTENT_TYPE) -> List:
+    return list(iter_multipart_parts(body, content_type))
+
+
+def test_parts_and_headers():
+    """
+    The fields and the files are returned in order, with their headers.
+    """
+    parts = parse(make_body(field_part('contract_number', 'C1'), file_part(b'%PDF-1.4')))
+
+    assert [part.name for part in parts] == ['contract_number', 'file']
+    assert bytes(parts[0].content) == b'C1'
+    assert parts[0].filename is None
+    assert parts[1].filename == 'a.pdf'
+    assert parts[1].content_type == 'application/pdf'
+    assert bytes(parts[1].content) == b'%PDF-1.4'
+
+def test_quoted_boundary():
+    parts = parse(make_body(field_part('a', '1')), f'multipart/form-data; boundary="{BOUNDARY}"')
+    assert bytes(parts[0].content) == b'1'
+
+def test_crlf_inside_content():
+    """
+    The line breaks of the content are kept, only the one before the next delimiter is removed.
+    """
+    content = b'line 1\r\nline 2\r\n\r\n--not a delimiter\r\n'
+    parts = parse(make_body(file_part(content), field_part('a', '1')))
+    assert bytes(parts[0].content) == content
+    assert bytes(parts[1].content) == b'1'
+
+def test_lf_line_breaks_are_rejected():
+    body = make_body(field_part('a', '1')).replace(b'\r\n', b'\n')
+    with pytest.raises(MultipartError):
+        parse(body)
+
+def test_boundary_inside_content():
+    """
+    The boundary text inside a part is only a delimiter at the beginning of a line, followed by
+    a line break, the transport padding or '--'.
+    """
+    content = (
+        f'--{BOUNDARY} in the middle of a line\r\n'
+        f'--{BOUNDARY}-longer-boundary\r\n'
+        f'--{BOUNDARY}x'
+    ).encode()
+    parts = parse(make_body(file_part(content)))
+    assert len(parts) == 1
+    assert bytes(parts[0].content) == content
+
+def test_missing_closing_delimiter():
+    body = make_body(field_part('a', '1'), file_part(b'data'), closing=b'')
+    with pytest.raises(MultipartError):
+        parse(body)
+
+def test_missing_part_delimiter():
+    with pytest.raises(MultipartError):
+        parse(b'no parts here')
+    with pytest.raises(MultipartError):
+        parse(make_body(field_part('a', '1')), 'multipart/form-data')
+
+def test_transport_padding_after_delimiters():
+    """
+    Spaces and tabs after a delimiter (RFC 2046 transport padding) are ignored.
+    """
+    delimiter = b'--' + BOUNDARY.encode()
+    body = (
+        b'preamble\r\n'
+        + delimiter + b'  \t\r\n' + field_part('a', '1') + b'\r\n'
+        + delimiter + b' \r\n' + file_part(b'data') + b'\r\n'
+        + delimiter + b'-- \r\nepilogue'
+    )
+    parts = parse(body)
+    assert [bytes(part.content) for part in parts] == [b'1', b'data']
+
+def test_content_is_a_view_of_the_body():
+    body = bytearray(make_body(file_part(b'%PDF-1.4')))
+    part = parse(body)[0]
+    body[body.find(b'%PDF')] = ord('#')
+    assert bytes(part.content) == b'#PDF-1.4'
+
+def test_buffer_reader():
+    reader = BufferReader(memoryview(b'0123456789')[2:8])
+    assert len(reader) == 6
+    assert reader.read(3) == b'234'
+    reader.seek(-2, os.SEEK_END)
+    assert reader.read() == b'67'
+    reader.seek(0)
+    assert reader.read() == b'234567'